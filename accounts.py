@@ -0,0 +1,273 @@
+import logging
+import time
+from telethon import utils
+from telethon.errors import (
+    AuthKeyDuplicatedError,
+    AuthKeyUnregisteredError,
+    ChannelPrivateError,
+    ChatAdminRequiredError,
+    ChatRestrictedError,
+    ChatSendMediaForbiddenError,
+    ChatSendPhotosForbiddenError,
+    ChatWriteForbiddenError,
+    FloodWaitError,
+    PeerFloodError,
+    SessionRevokedError,
+    UserBannedInChannelError,
+    UserDeactivatedBanError,
+    UserDeactivatedError,
+)
+from connectivity import CONNECTION_ERRORS
+from rate_limiter import ThrottledError
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning an account can't post in a destination, another account is tried
+NO_RIGHTS_ERRORS = (
+    ChannelPrivateError,
+    ChatAdminRequiredError,
+    ChatRestrictedError,
+    ChatSendMediaForbiddenError,
+    ChatSendPhotosForbiddenError,
+    ChatWriteForbiddenError,
+    UserBannedInChannelError,
+)
+
+# Errors meaning a session can't be used any more
+SESSION_ERRORS = (
+    AuthKeyDuplicatedError,
+    AuthKeyUnregisteredError,
+    SessionRevokedError,
+    UserDeactivatedBanError,
+    UserDeactivatedError,
+)
+
+# How long an account that couldn't post in a destination isn't tried there again (seconds)
+NO_RIGHTS_RETRY_INTERVAL = 3600
+# How long an account is left alone after Telegram flagged it for spam (seconds)
+PEER_FLOOD_PAUSE = 3600
+
+class NoAccountError(Exception):
+    """No account of the pool can send to a destination right now"""
+
+class NotMemberError(Exception):
+    """An account can't find a destination among its chats"""
+
+class Account:
+    """A session of the pool with its own rate limiter and resolved destinations"""
+    def __init__(self, client, rate_limiter):
+        self.client = client
+        self.rate_limiter = rate_limiter
+        # Telegram user id, set once connected
+        self.name = None
+        # Why the account is left out, None while it is usable
+        self.disabled = None
+        # Sends holding or waiting for a token of this account
+        self.pending = 0
+        self._peers = {}
+        self._no_rights = {}
+        self._dialogs_loaded = False
+
+    @property
+    def usable(self):
+        return self.disabled is None and self.client.is_connected()
+
+    def can_post(self, peer_id):
+        """Whether the account wasn't refused in a destination recently"""
+        refused_at = self._no_rights.get(peer_id)
+        return refused_at is None or time.monotonic() - refused_at > NO_RIGHTS_RETRY_INTERVAL
+
+    def refuse(self, peer_id):
+        """Leave the account out for a destination it can't post in"""
+        self._no_rights[peer_id] = time.monotonic()
+        self._peers.pop(peer_id, None)
+
+    async def input_peer(self, peer_id):
+        """This account's InputPeer of a marked peer id, access hashes differ per account"""
+        peer = self._peers.get(peer_id)
+        if peer is None:
+            try:
+                peer = await self.client.get_input_entity(peer_id)
+            except ValueError:
+                # Not seen by this session yet, the dialogs hold every chat the account is in
+                if not self._dialogs_loaded:
+                    self._dialogs_loaded = True
+                    await self.client.get_dialogs()
+                try:
+                    peer = await self.client.get_input_entity(peer_id)
+                except ValueError:
+                    raise NotMemberError(f"Account {self.name} is not in {peer_id}")
+            self._peers[peer_id] = peer
+        return peer
+
+    def stats(self):
+        return dict(
+            self.rate_limiter.stats(),
+            name=self.name,
+            usable=self.usable,
+            disabled=self.disabled,
+            pending=self.pending,
+            refused_destinations=sum(1 for peer_id in self._no_rights if not self.can_post(peer_id))
+        )
+
+class AccountPool:
+    """
+    Every account that sends, the first one also receives the updates
+    Each send goes to the usable account that could send it soonest, given its
+    flood state and the sends it already has waiting, among those that can
+    post in the destination. Flood waits longer than failover_wait, lost
+    connections, missing rights and dead sessions move the send to the next
+    account, a send pinned to an account (edits and deletes of the copies it
+    sent) never moves.
+    """
+    def __init__(self, listener, failover_wait=5):
+        """listener is the Account of the client the event handlers run on"""
+        self.listener = listener
+        self.accounts = [listener]
+        self.failover_wait = failover_wait
+        self.failovers = 0
+
+    def add(self, account):
+        self.accounts.append(account)
+
+    @property
+    def flood_waits(self):
+        return sum(account.rate_limiter.flood_waits for account in self.accounts)
+
+    @property
+    def flood_wait_seconds(self):
+        return sum(account.rate_limiter.flood_wait_seconds for account in self.accounts)
+
+    async def start(self):
+        """Connect the sending accounts, the listener is started by the caller first"""
+        self.listener.name = await self._user_id(self.listener.client)
+        for index, account in enumerate(self.accounts[1:], start=1):
+            try:
+                await account.client.connect()
+                if not await account.client.is_user_authorized():
+                    account.disabled = "session not authorized"
+                    logger.error(f"Sending account {index} is not authorized, regenerate its session string")
+                    continue
+                account.name = await self._user_id(account.client)
+                account.disabled = None
+                logger.info(f"Sending account {account.name} connected")
+            except Exception as e:
+                account.disabled = str(e)
+                logger.error(f"Could not connect sending account {index}: {str(e)}")
+
+    async def stop(self):
+        """Disconnect the sending accounts"""
+        for account in self.accounts[1:]:
+            try:
+                await account.client.disconnect()
+            except Exception as e:
+                logger.error(f"Error disconnecting sending account {account.name}: {str(e)}")
+
+    async def _user_id(self, client):
+        return str(utils.get_peer_id(await client.get_me(input_peer=True)))
+
+    def get(self, name):
+        """Account by name, None (copies sent before there was a pool) is the listener"""
+        if name is None:
+            return self.listener
+        for account in self.accounts:
+            if account.name == name:
+                return account
+        return None
+
+    def owner(self, sent):
+        """Account a sent message (or album) came back from, None if unknown"""
+        if isinstance(sent, list):
+            sent = sent[0] if sent else None
+        client = getattr(sent, 'client', None)
+        for account in self.accounts:
+            if account.client is client:
+                return account
+        return None
+
+    def name_of(self, sent):
+        """Name of the account a sent message (or album) came back from"""
+        account = self.owner(sent)
+        return account.name if account else None
+
+    def _pick(self, peer_id, tried, strict=False):
+        """
+        Account that could send soonest, preferring connected accounts that
+        weren't refused in the destination. Unless strict, the others are
+        still tried when nothing better is left, so their own errors surface.
+        """
+        candidates = [account for account in self.accounts if account not in tried and account.disabled is None]
+        preferences = [lambda account: account.usable and account.can_post(peer_id)]
+        if not strict:
+            preferences += [lambda account: account.usable, lambda account: True]
+        for preferred in preferences:
+            matching = [account for account in candidates if preferred(account)]
+            if matching:
+                return min(matching, key=lambda account: account.rate_limiter.wait_estimate(peer_id, account.pending))
+        return None
+
+    async def call(self, entity, method, *args, account=None, failover=False, **kwargs):
+        """
+        Run client.<method>(entity, *args, **kwargs) on the best account
+        entity is the listener's InputPeer of the destination, the others use
+        their own. With account, only that account is used. With failover as
+        well, ThrottledError is raised instead of waiting longer than
+        failover_wait when another account could send, so the caller can send
+        it from the others in another way.
+        """
+        peer_id = utils.get_peer_id(entity)
+        tried = []
+        error = None
+        while True:
+            if account is not None:
+                candidate = account if not tried else None
+            else:
+                candidate = self._pick(peer_id, tried)
+            if candidate is None:
+                raise error or NoAccountError(f"No account can send to {peer_id}")
+            if tried:
+                self.failovers += 1
+            tried.append(candidate)
+            if candidate.disabled is not None:
+                error = NoAccountError(f"Account {candidate.name} is disabled: {candidate.disabled}")
+                continue
+
+            # Another account is better than a long wait on this one
+            max_wait = None
+            if (account is None or failover) and self._pick(peer_id, tried, strict=True):
+                max_wait = self.failover_wait
+            candidate.pending += 1
+            try:
+                peer = entity if candidate is self.listener else await candidate.input_peer(peer_id)
+                return await candidate.rate_limiter.call(
+                    peer_id, getattr(candidate.client, method), peer, *args, max_wait=max_wait, **kwargs
+                )
+            except (ThrottledError, FloodWaitError) as e:
+                logger.warning(f"Account {candidate.name} is rate limited for {peer_id}: {str(e)}")
+                error = e
+            except PeerFloodError as e:
+                if len(self.accounts) > 1:
+                    # The others take over while it rests
+                    logger.warning(f"Account {candidate.name} was flagged for flooding, resting it for {PEER_FLOOD_PAUSE}s")
+                    candidate.rate_limiter.account.pause(PEER_FLOOD_PAUSE)
+                error = e
+            except NO_RIGHTS_ERRORS + (NotMemberError,) as e:
+                logger.warning(f"Account {candidate.name} can't post in {peer_id} ({e.__class__.__name__})")
+                candidate.refuse(peer_id)
+                error = e
+            except SESSION_ERRORS as e:
+                logger.error(f"Account {candidate.name} can't be used any more ({e.__class__.__name__})")
+                candidate.disabled = e.__class__.__name__
+                error = e
+            except CONNECTION_ERRORS as e:
+                logger.warning(f"Account {candidate.name} lost its connection: {str(e)}")
+                error = e
+            finally:
+                candidate.pending -= 1
+
+    def stats(self):
+        """Per account flood state and how often sends moved to another account"""
+        return {
+            "failovers": self.failovers,
+            "accounts": [account.stats() for account in self.accounts]
+        }
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram albums hold at most this many items
+MAX_ALBUM_SIZE = 10
+
+class AlbumAggregator:
+    """
+    Buffer messages sharing a grouped_id so an album is forwarded in one send
+    Every new item pushes the flush back by quiet_period seconds, without going
+    past max_wait seconds after the first item, and a full album is flushed
+    right away. Later messages of a chat with an album being collected are
+    held back and handed over after it, so the chat keeps its order.
+    """
+    def __init__(self, on_album, on_message, quiet_period=0.5, max_wait=3.0):
+        """
+        on_album is a coroutine function called with the album messages in order
+        on_message is a coroutine function called with a message held back behind an album
+        """
+        self.on_album = on_album
+        self.on_message = on_message
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self._albums = {}
+        # Per chat, album keys and held messages in arrival order
+        self._chats = {}
+        # Flushes started by timers, the loop only keeps weak references to tasks
+        self._tasks = set()
+        self.albums_flushed = 0
+        self.messages_grouped = 0
+        self.messages_held = 0
+
+    @property
+    def pending(self):
+        """Albums still being collected, or waiting for an earlier one, and messages held behind them"""
+        return sum(len(entries) for entries in self._chats.values())
+
+    def add(self, message):
+        """
+        Buffer a message, returns False if it isn't part of an album and
+        no album of its chat is being collected
+        """
+        grouped_id = getattr(message, 'grouped_id', None)
+        entries = self._chats.get(message.chat_id)
+        if not grouped_id:
+            if not entries:
+                return False
+            entries.append(message)
+            self.messages_held += 1
+            return True
+
+        key = (message.chat_id, grouped_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = {
+                "messages": {},
+                "started": time.monotonic(),
+                "timer": None,
+                "complete": False
+            }
+            self._chats.setdefault(message.chat_id, []).append(key)
+        # Keyed by id so a repeated update doesn't duplicate an item
+        album["messages"][message.id] = message
+        if album["complete"]:
+            # Already waiting for an earlier album of the chat
+            return True
+
+        if album["timer"]:
+            album["timer"].cancel()
+        if len(album["messages"]) >= MAX_ALBUM_SIZE:
+            delay = 0
+        else:
+            elapsed = time.monotonic() - album["started"]
+            delay = max(0, min(self.quiet_period, self.max_wait - elapsed))
+        album["timer"] = asyncio.get_running_loop().call_later(
+            delay, lambda: self._spawn(self.flush(key))
+        )
+        return True
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, key):
+        """
+        Mark a buffered album complete and hand it over, once the albums of
+        its chat collected before it are, followed by the messages held
+        behind it
+        """
+        album = self._albums.get(key)
+        if not album or album["complete"]:
+            return
+        if album["timer"]:
+            album["timer"].cancel()
+        album["complete"] = True
+
+        # Taken off at once, so a concurrent flush can't hand anything over out of order
+        ready = []
+        entries = self._chats[key[0]]
+        while entries and (not isinstance(entries[0], tuple) or self._albums[entries[0]]["complete"]):
+            ready.append(entries.pop(0))
+        if not entries:
+            del self._chats[key[0]]
+
+        for entry in ready:
+            if not isinstance(entry, tuple):
+                try:
+                    await self.on_message(entry)
+                except Exception as e:
+                    logger.error(f"Error handling message {entry.id} held behind an album: {str(e)}")
+                continue
+            album = self._albums.pop(entry)
+            messages = [album["messages"][message_id] for message_id in sorted(album["messages"])]
+            self.albums_flushed += 1
+            self.messages_grouped += len(messages)
+            logger.info("Album %s complete with %s items", entry[1], len(messages))
+            try:
+                await self.on_album(messages)
+            except Exception as e:
+                logger.error(f"Error handling album {entry[1]}: {str(e)}")
+
+    async def flush_all(self):
+        """Flush every buffered album, used on shutdown"""
+        for key in list(self._albums):
+            await self.flush(key)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
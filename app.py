@@ -1,18 +1,17 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify
 import threading
 import telegram_forwarder
+import metrics
+from log_setup import setup_logging
+from health import UNHEALTHY
 import logging
 import os
 import sys
 import asyncio
 from datetime import datetime
 
-# Configure logging first
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout  # Log to stdout for Render
-)
+# Same log pipeline as the bot, set up when telegram_forwarder is imported
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Log the starting of the application
@@ -33,74 +32,119 @@ bot_status = {
 loop = asyncio.new_event_loop()
 asyncio.set_event_loop(loop)
 
-def run_bot():
-    """Run the Telegram forwarder bot in a separate thread"""
+# The bot runs on one event loop thread for the life of the process. The
+# Telethon clients stay bound to the loop they first connected on, so a bot
+# started again after /stop must run on the same loop.
+bot_loop = asyncio.new_event_loop()
+
+def run_bot_loop():
+    """Run the bot's event loop in a separate thread"""
+    asyncio.set_event_loop(bot_loop)
+    bot_loop.run_forever()
+
+async def run_bot():
+    """Run the Telegram forwarder bot on the bot loop"""
     try:
-        logger.info("Bot thread starting")
-        bot_status["running"] = True
-        bot_status["error"] = None
-        bot_status["start_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Create a new event loop for this thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Run the bot
         logger.info("Starting telegram_forwarder.main()")
-        loop.run_until_complete(telegram_forwarder.main())
+        await telegram_forwarder.main()
     except Exception as e:
         bot_status["error"] = str(e)
         logger.error(f"Bot error: {e}")
     finally:
         bot_status["running"] = False
-        loop.close()
-        logger.info("Bot thread ended")
+        logger.info("Bot ended")
+
+# Requests starting the bot at the same time start it once
+bot_lock = threading.Lock()
+
+def start_bot():
+    """Start the bot on the bot loop, returns False if it is already running"""
+    with bot_lock:
+        if bot_status["running"]:
+            return False
+        telegram_forwarder.is_running = True
+        bot_status["running"] = True
+        bot_status["error"] = None
+        bot_status["start_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        asyncio.run_coroutine_threadsafe(run_bot(), bot_loop)
+        return True
 
-# Start the bot in a separate thread during app initialization
-logger.info("Starting bot thread during app initialization")
-bot_thread = threading.Thread(target=run_bot)
+# Start the bot during app initialization
+logger.info("Starting bot loop thread during app initialization")
+bot_thread = threading.Thread(target=run_bot_loop, name='bot-loop')
 bot_thread.daemon = True
 bot_thread.start()
-logger.info("Bot thread started with daemon=True")
+start_bot()
+logger.info("Bot started on the bot loop thread")
+
+def on_bot_loop(func, timeout=5):
+    """
+    Call func on the bot's event loop and return its result
+    Stats and health read state the bot changes on its loop, reading it from
+    a request thread could see it halfway through an update
+    """
+    if not bot_loop.is_running():
+        return func()
+
+    async def call():
+        return func()
+    return asyncio.run_coroutine_threadsafe(call(), bot_loop).result(timeout)
 
 @app.route('/')
 def home():
     """Home page showing bot status"""
     try:
-        return jsonify({
-            "status": "active" if bot_status["running"] else "inactive",
-            "error": bot_status["error"],
-            "last_message": bot_status["last_message"],
-            "start_time": bot_status["start_time"],
-            "service": "Telegram Forwarder",
-            "health": "ok"
-        })
+        queue_stats = telegram_forwarder.db.get_queue_stats_blocking()
+        state, _ = on_bot_loop(lambda: telegram_forwarder.check_health(queue_stats, bot_status["running"]))
+        return jsonify(dict(
+            on_bot_loop(telegram_forwarder.collect_stats),
+            status="active" if bot_status["running"] else "inactive",
+            error=bot_status["error"],
+            last_message=bot_status["last_message"],
+            start_time=bot_status["start_time"],
+            service="Telegram Forwarder",
+            health=state
+        ))
     except Exception as e:
         logger.error(f"Error in home route: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/health')
 def health():
-    """Health check endpoint"""
+    """Health from loop lag, connection state and queue age, 503 when unhealthy"""
     try:
-        if bot_status["running"] and not bot_status["error"]:
-            return jsonify({"status": "healthy"}), 200
-        return jsonify({
-            "status": "unhealthy",
-            "error": bot_status["error"]
-        }), 503
+        queue_stats = telegram_forwarder.db.get_queue_stats_blocking()
+        state, checks = on_bot_loop(lambda: telegram_forwarder.check_health(queue_stats, bot_status["running"]))
+        if bot_status["error"]:
+            checks["bot"]["error"] = bot_status["error"]
+        return jsonify({"status": state, "checks": checks}), 503 if state == UNHEALTHY else 200
     except Exception as e:
         logger.error(f"Error in health check: {e}")
+        return jsonify({"status": UNHEALTHY, "error": str(e)}), 503
+
+@app.route('/stats')
+def stats():
+    """Live stats of every component"""
+    try:
+        return jsonify(on_bot_loop(telegram_forwarder.collect_stats))
+    except Exception as e:
+        logger.error(f"Error collecting stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics in the Prometheus text format"""
+    try:
+        return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        logger.error(f"Error rendering metrics: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/start')
 def start():
     """Start the bot if it's not running"""
     try:
-        if not bot_status["running"]:
-            thread = threading.Thread(target=run_bot)
-            thread.daemon = True
-            thread.start()
+        if start_bot():
             return jsonify({"status": "started"}), 200
         return jsonify({"status": "already running"}), 200
     except Exception as e:
@@ -112,8 +156,8 @@ def stop():
     """Stop the bot if it's running"""
     try:
         if bot_status["running"]:
-            # Signal the bot to stop
-            bot_status["running"] = False
+            # Signal the bot to stop, it shuts down within a second
+            telegram_forwarder.is_running = False
             return jsonify({"status": "stopping"}), 200
         return jsonify({"status": "not running"}), 200
     except Exception as e:
@@ -123,11 +167,7 @@ def stop():
 def start_server():
     """Start the Flask server with the correct port"""
     try:
-        # Start the bot in a separate thread
-        bot_thread = threading.Thread(target=run_bot)
-        bot_thread.daemon = True
-        bot_thread.start()
-        
+        # The bot was started on the bot loop when this module was imported
         # Get port from environment variable (Render sets this)
         port = int(os.environ.get('PORT', 10000))
         app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+from telethon import types
+from albums import MAX_ALBUM_SIZE
+
+logger = logging.getLogger(__name__)
+
+# How often reading the history of a source is tried before its catch-up is
+# given up, and the delay before the first retry (seconds, doubled each time)
+MAX_TRIES = 5
+RETRY_DELAY = 5
+
+class CheckpointTracker:
+    """
+    Per source, the message id up to which everything has been handled
+    A message is handled once it was forwarded or put in the database queue.
+    Lanes and retries finish messages out of order, so the checkpoint only
+    moves up to just below the oldest message still in flight, and never past
+    a hold put on it by a catch-up still reading older messages.
+    """
+    def __init__(self, db):
+        self.db = db
+        self._saved = {}
+        self._done = {}
+        self._in_flight = {}
+        self._holds = {}
+
+    async def load(self, hold=False):
+        """
+        Read the checkpoints saved before the last shutdown, with hold they
+        stay where they are until release()
+        """
+        try:
+            self._saved = await self.db.load_checkpoints()
+            self._done = dict(self._saved)
+            if hold:
+                self._holds = dict(self._saved)
+            logger.info(f"Loaded checkpoints of {len(self._saved)} sources")
+        except Exception as e:
+            logger.error(f"Error loading source checkpoints: {str(e)}")
+
+    def get(self, chat_id):
+        """Saved checkpoint of a source, None if it has none yet"""
+        return self._saved.get(chat_id)
+
+    def hold(self, chat_id, message_id):
+        """Keep the checkpoint of a source at or below message_id"""
+        self._holds[chat_id] = message_id
+
+    def release(self, chat_id):
+        """Let the checkpoint of a source move freely again"""
+        self._holds.pop(chat_id, None)
+
+    def start(self, chat_id, message_id):
+        """A message of a source is on its way"""
+        self._in_flight.setdefault(chat_id, set()).add(message_id)
+
+    async def finish(self, chat_id, message_ids):
+        """Messages of a source were handled, saves the checkpoint if it moved"""
+        in_flight = self._in_flight.get(chat_id, set())
+        in_flight.difference_update(message_ids)
+        done = self._done[chat_id] = max(self._done.get(chat_id, 0), max(message_ids))
+        checkpoint = min(done, min(in_flight) - 1) if in_flight else done
+        if chat_id in self._holds:
+            checkpoint = min(checkpoint, self._holds[chat_id])
+        if checkpoint <= self._saved.get(chat_id, 0):
+            return
+        self._saved[chat_id] = checkpoint
+        try:
+            await self.db.save_checkpoint(chat_id, checkpoint)
+        except Exception as e:
+            logger.error(f"Error saving checkpoint of {chat_id}: {str(e)}")
+
+    def stats(self):
+        """Checkpoint and messages in flight per source"""
+        return {
+            str(chat_id): {"checkpoint": checkpoint, "in_flight": len(self._in_flight.get(chat_id, ()))}
+            for chat_id, checkpoint in self._saved.items()
+        }
+
+class Backfill:
+    """
+    Catch up on messages posted while the forwarder was down
+    Every source is read oldest first from its checkpoint with iter_messages,
+    one page at a time, and handed to the forwarding lanes with at most
+    concurrency messages or albums in flight, so memory use doesn't depend on
+    the size of the gap. Messages that also arrive live are forwarded once.
+    A catch-up that keeps failing leaves the checkpoint where it stopped, the
+    next start resumes from there.
+    """
+    def __init__(self, client, checkpoints, resolve, forward, lane_for, concurrency=8, limit=0):
+        """
+        resolve(chat_id) is a coroutine function returning the source entity
+        forward(messages) is the coroutine function forwarding a message or an album
+        lane_for(messages) is the dispatcher messages are submitted to
+        limit, if set, is how many of the latest messages of a gap are caught up on
+        """
+        self.client = client
+        self.checkpoints = checkpoints
+        self.resolve = resolve
+        self.forward = forward
+        self.lane_for = lane_for
+        self.concurrency = concurrency
+        self.limit = limit
+        # Per source being caught up: last id it covers, last id dispatched
+        # and ids beyond that which already arrived live
+        self._until = {}
+        self._position = {}
+        self._live = {}
+        self._slots = None
+        self.forwarded = 0
+        self.skipped_live = 0
+        self.skipped_limit = 0
+
+    def watch(self, sources):
+        """
+        Remember the live messages of sources from now on, until their
+        catch-up is done. Called before any of them can be forwarded live, so
+        messages arriving while the catch-up looks for the end of the gap
+        aren't sent twice.
+        """
+        for chat_id in sources:
+            self._live[chat_id] = set()
+
+    def claim(self, chat_id, message_id):
+        """Whether a live message should be forwarded, backfill leaves it alone afterwards"""
+        live = self._live.get(chat_id)
+        if live is None:
+            return True
+        until = self._until.get(chat_id)
+        if until is not None and message_id > until:
+            return True
+        if message_id <= self._position.get(chat_id, 0):
+            # Already handed over by the backfill
+            self.skipped_live += 1
+            return False
+        live.add(message_id)
+        return True
+
+    async def run(self, sources):
+        """Catch up on every source concurrently"""
+        # Created here so it belongs to the running loop
+        self._slots = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._run_source(chat_id) for chat_id in sources))
+        logger.info(f"Backfill finished, {self.forwarded} messages caught up on")
+
+    async def _run_source(self, chat_id):
+        try:
+            entity, latest_id = await self._retry(chat_id, self._find_end, chat_id)
+            # Held since startup, so live messages haven't moved it yet
+            checkpoint = self.checkpoints.get(chat_id)
+            if checkpoint is None:
+                # First start for this source, later restarts catch up from here
+                await self.checkpoints.finish(chat_id, [latest_id])
+                return
+            if latest_id <= checkpoint:
+                self.checkpoints.release(chat_id)
+                return
+
+            min_id = checkpoint
+            if self.limit and latest_id - checkpoint > self.limit:
+                min_id = latest_id - self.limit
+                self.skipped_limit += min_id - checkpoint
+                logger.warning(f"Gap of {latest_id - checkpoint} messages in {chat_id}, catching up on the last {self.limit}")
+            logger.info(f"Catching up on {chat_id} from message {min_id} to {latest_id}")
+
+            self._until[chat_id] = latest_id
+            self._position[chat_id] = min_id
+            self._live.setdefault(chat_id, set())
+            await self._retry(chat_id, self._catch_up, chat_id, entity, latest_id)
+            # Covered ids that never existed or arrived live are done too
+            self.checkpoints.release(chat_id)
+            await self.checkpoints.finish(chat_id, [latest_id])
+        except asyncio.CancelledError:
+            self._keep_hold(chat_id)
+            raise
+        except Exception as e:
+            self._keep_hold(chat_id)
+            logger.error(f"Error catching up on {chat_id}, the next start resumes from there: {str(e)}")
+        finally:
+            self._until.pop(chat_id, None)
+            self._position.pop(chat_id, None)
+            self._live.pop(chat_id, None)
+
+    def _keep_hold(self, chat_id):
+        """
+        Keep the checkpoint of an unfinished catch-up at the last message it
+        dispatched, so live messages can't move it over the rest of the gap
+        """
+        position = self._position.get(chat_id)
+        if position is not None:
+            self.checkpoints.hold(chat_id, position)
+
+    async def _retry(self, chat_id, func, *args):
+        """Run func(*args), trying again with a growing delay while reading the source fails"""
+        for attempt in range(1, MAX_TRIES + 1):
+            try:
+                return await func(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == MAX_TRIES:
+                    raise
+                delay = RETRY_DELAY * 2 ** (attempt - 1)
+                logger.warning(f"Error reading {chat_id} for the catch-up ({str(e)}), trying again in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def _find_end(self, chat_id):
+        """Entity of a source and the id of its latest message, where its gap ends"""
+        entity = await self.resolve(chat_id)
+        latest = await self.client.get_messages(entity, limit=1)
+        return entity, latest[0].id if latest else 0
+
+    async def _catch_up(self, chat_id, entity, latest_id):
+        """Dispatch the messages of a source after the last one dispatched, up to latest_id"""
+        album = []
+        min_id = self._position[chat_id]
+        async for message in self.client.iter_messages(entity, min_id=min_id, max_id=latest_id + 1, reverse=True):
+            if not isinstance(message, types.Message):
+                continue
+            if album and (message.grouped_id != album[0].grouped_id or len(album) >= MAX_ALBUM_SIZE):
+                await self._dispatch(chat_id, album)
+                album = []
+            if message.grouped_id:
+                album.append(message)
+            else:
+                await self._dispatch(chat_id, [message])
+        if album:
+            await self._dispatch(chat_id, album)
+
+    async def _dispatch(self, chat_id, messages):
+        self._position[chat_id] = messages[-1].id
+        live = self._live[chat_id]
+        messages = [message for message in messages if message.id not in live]
+        if not messages:
+            return
+
+        await self._slots.acquire()
+        for message in messages:
+            self.checkpoints.start(chat_id, message.id)
+        self.checkpoints.hold(chat_id, messages[-1].id)
+        lane = self.lane_for(messages)
+        # A full lane is left to live traffic, the backfill waits its turn
+        while not lane.submit(chat_id, self._forward, messages):
+            await asyncio.sleep(1)
+        self.forwarded += len(messages)
+
+    async def _forward(self, messages):
+        try:
+            await self.forward(messages)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        """Catch-up progress for monitoring"""
+        return {
+            "sources_pending": len(self._until),
+            "forwarded": self.forwarded,
+            "skipped_live": self.skipped_live,
+            "skipped_limit": self.skipped_limit,
+            "checkpoints": self.checkpoints.stats()
+        }
@@ -0,0 +1,123 @@
+"""
+Microbenchmark for the message queue storage
+
+Compares enqueue and status update throughput of the Database writer thread
+(one WAL connection, group commit) against the previous implementation that
+opened, committed and closed a connection for every call.
+
+Usage: python benchmarks/bench_database.py [--messages 2000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+class LegacyDatabase:
+    """The connect/commit/close per call implementation, kept for comparison"""
+    def __init__(self, db_file):
+        self.db_file = db_file
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS queued_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_id INTEGER,
+                    chat_id INTEGER,
+                    message_text TEXT,
+                    media_path TEXT,
+                    created_at TIMESTAMP,
+                    retries INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    error_message TEXT,
+                    is_edit BOOLEAN DEFAULT 0
+                )
+            ''')
+
+    def queue_message(self, message_id, chat_id, message_text=None, media_path=None, is_edit=False):
+        with sqlite3.connect(self.db_file) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO queued_messages
+                (message_id, chat_id, message_text, media_path, created_at, is_edit)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (message_id, chat_id, message_text, media_path, datetime.now(), is_edit))
+            conn.commit()
+            return cursor.lastrowid
+
+    def update_message_status(self, message_id, status, error_message=None):
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('UPDATE queued_messages SET status = ? WHERE message_id = ?', (status, message_id))
+            conn.commit()
+
+async def run_legacy(db_file, messages, concurrency):
+    """Legacy calls are synchronous, so they block the loop one after another"""
+    db = LegacyDatabase(db_file)
+
+    async def worker(ids):
+        for i in ids:
+            db.queue_message(i, -100, f'message {i}')
+            await asyncio.sleep(0)
+
+    async def updater(ids):
+        for i in ids:
+            db.update_message_status(i, 'completed')
+            await asyncio.sleep(0)
+
+    return await measure(worker, updater, messages, concurrency)
+
+async def run_current(db_file, messages, concurrency):
+    db = Database(db_file)
+
+    async def worker(ids):
+        for i in ids:
+            await db.queue_message(i, -100, f'message {i}')
+
+    async def updater(ids):
+        # Rows are updated by primary key, ids follow insertion order
+        for i in ids:
+            await db.update_message_status(i + 1, 'completed')
+
+    try:
+        return await measure(worker, updater, messages, concurrency)
+    finally:
+        db.close()
+
+async def measure(worker, updater, messages, concurrency):
+    """Run enqueue then update with concurrency coroutines, returns ops/s for both"""
+    shards = [range(i, messages, concurrency) for i in range(concurrency)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(ids) for ids in shards))
+    enqueue = messages / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(updater(ids) for ids in shards))
+    update = messages / (time.perf_counter() - start)
+    return enqueue, update
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        legacy = asyncio.run(run_legacy(os.path.join(temp_dir, 'legacy.db'), args.messages, args.concurrency))
+        current = asyncio.run(run_current(os.path.join(temp_dir, 'current.db'), args.messages, args.concurrency))
+
+    print(f"{'':<10}{'enqueue/s':>12}{'update/s':>12}")
+    print(f"{'legacy':<10}{legacy[0]:>12.0f}{legacy[1]:>12.0f}")
+    print(f"{'current':<10}{current[0]:>12.0f}{current[1]:>12.0f}")
+    print(f"{'speedup':<10}{current[0] / legacy[0]:>11.1f}x{current[1] / legacy[1]:>11.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,663 @@
+"""
+Load test of the whole forwarding path against a fake Telegram client
+
+Runs telegram_forwarder.main() with an in-process stand-in for the
+TelegramClient and feeds events to handle_new_message and
+handle_edited_message, so dispatching, albums, edit coalescing, media
+strategies, the rate limiter and the queue processor all run as in
+production. The fake client answers after a configurable round trip, moves
+media bytes over a link of limited bandwidth, can answer sends with flood
+waits (at random, or past a per-account send rate) and can drop off the
+network. With --accounts, extra fake sending accounts join the pool.
+Nothing leaves the machine.
+
+Each workload reports source messages per second, end-to-end latency from
+the event to the copy arriving (p50/p99), peak RSS and peak temp disk use:
+
+    text      bursts of text messages across several source chats
+    albums    photo albums, sent by reference
+    media     large videos (streamed) and documents (downloaded) from a
+              protected chat, interleaved with text
+    edits     storms of edits to the same messages
+    offline   messages posted while the network is down, then after it is back
+
+Usage: python benchmarks/bench_forwarder.py [--workloads text,albums,media,edits,offline]
+       [--rtt-ms 20] [--link-mbps 200] [--flood-rate 0] [--accounts 1]
+       [--account-send-limit 0] [--bulk-bandwidth-mb 0] [--json]
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKLOADS = ('text', 'albums', 'media', 'edits', 'offline')
+DC_ID = 2
+# Every source message text carries this marker, copies are matched on it
+MARKER = re.compile(r'\[bench:(\d+)\]')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workloads', default=','.join(WORKLOADS))
+    parser.add_argument('--sources', type=int, default=4, help='source chats')
+    parser.add_argument('--destinations', type=int, default=2, help='destinations per source')
+    parser.add_argument('--rtt-ms', type=float, default=20, help='round trip of every request')
+    parser.add_argument('--link-mbps', type=float, default=200, help='bandwidth for media, each direction')
+    parser.add_argument('--flood-rate', type=float, default=0, help='share of sends answered with a flood wait')
+    parser.add_argument('--flood-seconds', type=int, default=1)
+    parser.add_argument('--accounts', type=int, default=1, help='sending accounts, the first one also listens')
+    parser.add_argument('--account-send-limit', type=float, default=0,
+                        help='sends per second an account may make before getting flood waits (0 means no limit)')
+    parser.add_argument('--send-rate', type=float, default=1000, help='starting account/destination send rate')
+    parser.add_argument('--bulk-bandwidth-mb', type=float, default=0,
+                        help='BULK_LANE_BANDWIDTH_MB of the forwarder (0 means no limit)')
+    parser.add_argument('--text-messages', type=int, default=400)
+    parser.add_argument('--albums', type=int, default=40)
+    parser.add_argument('--album-size', type=int, default=5)
+    parser.add_argument('--videos', type=int, default=4)
+    parser.add_argument('--video-mb', type=float, default=20)
+    parser.add_argument('--documents', type=int, default=8)
+    parser.add_argument('--document-mb', type=float, default=4)
+    parser.add_argument('--edited-messages', type=int, default=40)
+    parser.add_argument('--edits-per-message', type=int, default=10)
+    parser.add_argument('--offline-messages', type=int, default=200)
+    parser.add_argument('--offline-seconds', type=float, default=2)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--verbose', action='store_true', help='keep the forwarder logs')
+    return parser.parse_args()
+
+def configure(args, workdir):
+    """Environment read by telegram_forwarder at import time"""
+    os.environ.pop('RENDER', None)
+    os.environ.update({
+        'TELEGRAM_API_ID': '1',
+        'TELEGRAM_API_HASH': 'bench',
+        'ROUTES': json.dumps([
+            {
+                "source": str(-1000000000000 - source),
+                "destinations": [f'@bench_{index}' for index in range(args.destinations)]
+            }
+            for source in range(1, args.sources + 1)
+        ]),
+        'ACCOUNT_SEND_RATE': str(args.send_rate),
+        'DESTINATION_SEND_RATE': str(args.send_rate),
+        'BULK_LANE_BANDWIDTH_MB': str(args.bulk_bandwidth_mb),
+        # Short quiet periods keep the runs short, coalescing still happens
+        'ALBUM_QUIET_PERIOD': '0.1',
+        'EDIT_QUIET_PERIOD': '0.2',
+        'EDIT_MAX_WAIT': '2',
+    })
+    # The queue database and temp directory are created in the working directory
+    os.chdir(workdir)
+
+class FakeClient:
+    """
+    In-process stand-in for the TelegramClient used by the forwarder
+    Requests take rtt seconds, media bytes share one link per direction, sends
+    fail with a flood wait at flood_rate or beyond send_limit sends per second,
+    and nothing works while offline. Like Telegram's access hashes, media can
+    only be sent by reference from the account it belongs to, its access_hash
+    is the user_id of that account.
+    """
+    def __init__(self, rtt, link_bytes, flood_rate=0, flood_seconds=1, seed=1, user_id=1, send_limit=0, network=None):
+        self.rtt = rtt
+        self.link_bytes = link_bytes
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.random = random.Random(seed)
+        self.session = SimpleNamespace(dc_id=DC_ID)
+        # Message.text is the raw text without a parse mode
+        self.parse_mode = None
+        # Shared by every account, they all go offline together
+        self.network = network or SimpleNamespace(online=True)
+        self.source = {}
+        self.sizes = {}
+        self.flood_waits = 0
+        self.user_id = user_id
+        self.send_limit = send_limit
+        self._sends = collections.deque()
+        self.on_delivery = None
+        self._ids = itertools.count(1)
+        self._down = None
+        self._up = None
+
+    # Connection
+
+    @property
+    def online(self):
+        return self.network.online
+
+    @online.setter
+    def online(self, online):
+        self.network.online = online
+
+    async def start(self):
+        self._down = asyncio.Lock()
+        self._up = asyncio.Lock()
+
+    async def connect(self):
+        await self.start()
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_me(self, input_peer=False):
+        return types.InputPeerUser(self.user_id, 0)
+
+    async def get_dialogs(self):
+        await self._rpc()
+        return []
+
+    async def disconnect(self):
+        pass
+
+    def is_connected(self):
+        return self.online
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    def remove_event_handler(self, callback, event=None):
+        pass
+
+    async def probe(self):
+        """Connectivity probe, the forwarder's is an HTTP request"""
+        return self.online
+
+    async def _rpc(self, send=False):
+        await asyncio.sleep(self.rtt / 2)
+        if not self.online:
+            raise ConnectionError("Fake network is down")
+        if send and self.flood_rate and self.random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        if send and self.send_limit:
+            now = time.monotonic()
+            while self._sends and now - self._sends[0] > 1:
+                self._sends.popleft()
+            if len(self._sends) >= self.send_limit:
+                self.flood_waits += 1
+                raise FloodWaitError(request=None, capture=self.flood_seconds)
+            self._sends.append(now)
+        await asyncio.sleep(self.rtt / 2)
+
+    async def _transmit(self, link, size):
+        async with link:
+            if not self.online:
+                raise ConnectionError("Fake network is down")
+            await asyncio.sleep(size / self.link_bytes)
+
+    # Sources
+
+    def add_source(self, message):
+        message._client = self
+        self.source[(message.chat_id, message.id)] = message
+        if isinstance(message.media, types.MessageMediaDocument):
+            self.sizes[message.media.document.id] = message.media.document.size
+
+    async def get_input_entity(self, peer):
+        await self._rpc()
+        if isinstance(peer, str):
+            return types.InputPeerChannel(abs(hash(peer)) % 1000000, 1)
+        real_id, _ = utils.resolve_id(peer)
+        return types.InputPeerChannel(real_id, 1)
+
+    async def get_messages(self, chat, ids):
+        await self._rpc()
+        chat_id = utils.get_peer_id(chat)
+        return [self.source.get((chat_id, message_id)) for message_id in ids]
+
+    # Sends
+
+    def _sent(self, entity, text, media=None):
+        message = types.Message(
+            id=next(self._ids), peer_id=types.PeerChannel(entity.channel_id), date=datetime.now(),
+            message=text or '', media=media
+        )
+        # Like Telethon, sent messages know the client they came back from
+        message._client = self
+        if self.on_delivery:
+            self.on_delivery(text)
+        return message
+
+    def _sent_media(self, file):
+        """Media of a sent copy, reusable by reference like the real thing"""
+        document = types.Document(
+            id=self.random.getrandbits(62), access_hash=self.user_id, file_reference=b'ref', date=None,
+            mime_type='application/octet-stream', size=0, dc_id=DC_ID, attributes=[]
+        )
+        return types.MessageMediaDocument(document=document)
+
+    async def _upload_path(self, path, progress_callback=None):
+        """Upload a file part by part, reporting the bytes sent after each part like Telethon"""
+        size = os.path.getsize(path)
+        for offset in range(0, size, 512 * 1024):
+            chunk = min(512 * 1024, size - offset)
+            await self._transmit(self._up, chunk)
+            if progress_callback:
+                await helpers._maybe_await(progress_callback(offset + chunk, size))
+
+    def _check_owner(self, file):
+        """Media by reference of another account is rejected like Telegram does"""
+        for item in file if isinstance(file, list) else [file]:
+            if isinstance(item, (types.InputMediaPhoto, types.InputMediaDocument)) and item.id.access_hash != self.user_id:
+                raise MediaEmptyError(request=None)
+
+    async def send_message(self, entity, message='', **kwargs):
+        await self._rpc(send=True)
+        return self._sent(entity, message)
+
+    async def send_file(self, entity, file, caption=None, progress_callback=None, **kwargs):
+        await self._rpc(send=True)
+        self._check_owner(file)
+        if isinstance(file, list):
+            captions = caption if isinstance(caption, list) else [caption] * len(file)
+            for index, item in enumerate(file):
+                if isinstance(item, str):
+                    # Albums report their progress in files
+                    await self._upload_path(item, progress_callback and (
+                        lambda sent, size, index=index: progress_callback(index + sent / size, len(file))
+                    ))
+            return [self._sent(entity, text, self._sent_media(item)) for item, text in zip(file, captions)]
+        if isinstance(file, str):
+            await self._upload_path(file, progress_callback)
+        return self._sent(entity, caption, self._sent_media(file))
+
+    async def edit_message(self, entity, message, text=None, file=None, **kwargs):
+        await self._rpc(send=True)
+        self._check_owner(file)
+        return self._sent(entity, text)
+
+    async def delete_messages(self, entity, message_ids):
+        await self._rpc(send=True)
+        return []
+
+    # Media
+
+    def _size(self, media):
+        if isinstance(media, types.MessageMediaDocument):
+            return media.document.size
+        return 256 * 1024
+
+    async def download_media(self, message, file=None, progress_callback=None, **kwargs):
+        await self._rpc()
+        size = self._size(message.media)
+        with open(file, 'wb') as f:
+            for offset in range(0, size, 512 * 1024):
+                chunk = min(512 * 1024, size - offset)
+                await self._transmit(self._down, chunk)
+                f.write(bytes(chunk))
+                if progress_callback:
+                    await helpers._maybe_await(progress_callback(offset + chunk, size))
+        return file
+
+    async def iter_download(self, media, request_size=512 * 1024, **kwargs):
+        size = self._size(media)
+        for offset in range(0, size, request_size):
+            await self._rpc()
+            chunk = min(request_size, size - offset)
+            await self._transmit(self._down, chunk)
+            yield bytes(chunk)
+
+    async def upload_file(self, file, file_size=None, file_name=None, progress_callback=None, **kwargs):
+        if isinstance(file, str):
+            await self._rpc()
+            await self._upload_path(file, progress_callback)
+            return types.InputFile(id=self.random.getrandbits(62), parts=1, name=os.path.basename(file), md5_checksum='')
+        read = 0
+        parts = 0
+        while read < file_size:
+            data = await file.read(min(512 * 1024, file_size - read))
+            if not data:
+                break
+            await self._rpc()
+            await self._transmit(self._up, len(data))
+            read += len(data)
+            parts += 1
+            if progress_callback:
+                await helpers._maybe_await(progress_callback(read, file_size))
+        return types.InputFileBig(id=self.random.getrandbits(62), parts=parts, name=file_name)
+
+    async def __call__(self, request):
+        """Raw requests, used by the parallel part transfers"""
+        await self._rpc()
+        if isinstance(request, GetFileRequest):
+            size = self.sizes.get(request.location.id, 0)
+            data = bytes(max(0, min(request.limit, size - request.offset)))
+            await self._transmit(self._down, len(data))
+            return types.upload.File(type=types.storage.FilePartial(), mtime=0, bytes=data)
+        if isinstance(request, SaveBigFilePartRequest):
+            await self._transmit(self._up, len(request.bytes))
+            return True
+        raise TypeError(f"Unexpected request {request.__class__.__name__}")
+
+class Recorder:
+    """End-to-end latencies of delivered copies, and resource peaks"""
+    def __init__(self, temp_dir):
+        self.temp_dir = temp_dir
+        self.posted_at = {}
+        self.latencies = []
+        self.last_delivery = None
+        self.peak_rss = 0
+        self.peak_disk = 0
+
+    def posted(self, message_id):
+        self.posted_at[message_id] = time.perf_counter()
+
+    def delivered(self, text):
+        for match in MARKER.finditer(text if isinstance(text, str) else ''):
+            posted_at = self.posted_at.get(int(match.group(1)))
+            if posted_at is not None:
+                self.last_delivery = time.perf_counter()
+                self.latencies.append(self.last_delivery - posted_at)
+
+    def reset(self):
+        self.posted_at.clear()
+        self.latencies = []
+        self.last_delivery = None
+        self.peak_rss = 0
+        self.peak_disk = 0
+
+    async def sample(self, interval=0.05):
+        while True:
+            self.peak_rss = max(self.peak_rss, current_rss())
+            self.peak_disk = max(self.peak_disk, directory_size(self.temp_dir))
+            await asyncio.sleep(interval)
+
+def current_rss():
+    """Resident set size in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak since start instead, in KB on Linux and bytes on macOS
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class Workloads:
+    """Synthetic source traffic fed to the forwarder's event handlers"""
+    def __init__(self, args, client, recorder):
+        self.args = args
+        self.client = client
+        self.recorder = recorder
+        self.chats = [types.PeerChannel(source) for source in range(1, args.sources + 1)]
+        self._ids = itertools.count(1)
+        self._media_ids = itertools.count(1)
+
+    def message(self, chat, text='', media=None, grouped_id=None, noforwards=False, message_id=None):
+        message_id = message_id or next(self._ids)
+        message = types.Message(
+            id=message_id, peer_id=chat, date=datetime.now(), message=text,
+            media=media, grouped_id=grouped_id, noforwards=noforwards
+        )
+        self.client.add_source(message)
+        return message
+
+    # Source media belongs to the listening account, user_id 1
+
+    def photo(self):
+        return types.MessageMediaPhoto(photo=types.Photo(
+            id=next(self._media_ids), access_hash=1, file_reference=b'ref', date=None,
+            sizes=[types.PhotoSize(type='y', w=1280, h=1280, size=256 * 1024)], dc_id=DC_ID
+        ))
+
+    def document(self, size, mime_type, attributes):
+        return types.MessageMediaDocument(document=types.Document(
+            id=next(self._media_ids), access_hash=1, file_reference=b'ref', date=None,
+            mime_type=mime_type, size=size, dc_id=DC_ID, attributes=attributes
+        ))
+
+    async def post(self, message):
+        self.recorder.posted(message.id)
+        await tf.handle_new_message(SimpleNamespace(chat_id=message.chat_id, message=message))
+
+    async def edit(self, message, text):
+        edited = self.message(message.peer_id, text, message.media, message_id=message.id)
+        edited.edit_date = datetime.now()
+        self.recorder.posted(edited.id)
+        await tf.handle_edited_message(SimpleNamespace(chat_id=edited.chat_id, message=edited))
+
+    async def text(self):
+        """Back-to-back text messages spread over the source chats"""
+        for index in range(self.args.text_messages):
+            chat = self.chats[index % len(self.chats)]
+            message_id = next(self._ids)
+            await self.post(self.message(chat, f'Text message [bench:{message_id}]', message_id=message_id))
+        return self.args.text_messages
+
+    async def albums(self):
+        """Photo albums, the caption rides on the first item"""
+        for index in range(self.args.albums):
+            chat = self.chats[index % len(self.chats)]
+            grouped_id = 10 ** 9 + index
+            items = []
+            for item in range(self.args.album_size):
+                message_id = next(self._ids)
+                text = f'Album {index} [bench:{message_id}]' if item == 0 else ''
+                items.append(self.message(chat, text, self.photo(), grouped_id, message_id=message_id))
+            for message in items:
+                await self.post(message)
+            await asyncio.sleep(0.01)
+        return self.args.albums * self.args.album_size
+
+    async def media(self):
+        """Large videos and documents from a protected chat, with text in between"""
+        chat = self.chats[0]
+        video_size = int(self.args.video_mb * 1024 * 1024)
+        document_size = int(self.args.document_mb * 1024 * 1024)
+        heavy = (
+            [('video', index) for index in range(self.args.videos)]
+            + [('document', index) for index in range(self.args.documents)]
+        )
+        posted = 0
+        for kind, index in heavy:
+            message_id = next(self._ids)
+            if kind == 'video':
+                media = self.document(video_size, 'video/mp4', [
+                    types.DocumentAttributeVideo(duration=60, w=1280, h=720)
+                ])
+            else:
+                media = self.document(document_size, 'application/pdf', [
+                    types.DocumentAttributeFilename(f'document_{index}.pdf')
+                ])
+            await self.post(self.message(
+                chat, f'{kind} {index} [bench:{message_id}]', media, noforwards=True, message_id=message_id
+            ))
+            # Text keeps flowing on the fast lane while the bulk lane is busy
+            for _ in range(5):
+                message_id = next(self._ids)
+                await self.post(self.message(chat, f'Text message [bench:{message_id}]', message_id=message_id))
+            posted += 6
+        return posted
+
+    async def edits(self):
+        """Every message edited repeatedly, faster than the quiet period"""
+        messages = []
+        for index in range(self.args.edited_messages):
+            chat = self.chats[index % len(self.chats)]
+            message_id = next(self._ids)
+            message = self.message(chat, f'Original [bench:{message_id}]', message_id=message_id)
+            messages.append(message)
+            await self.post(message)
+        for revision in range(1, self.args.edits_per_message + 1):
+            for message in messages:
+                await self.edit(message, f'Revision {revision} [bench:{message.id}]')
+            await asyncio.sleep(0.02)
+        return len(messages) * (1 + self.args.edits_per_message)
+
+    async def offline(self):
+        """Half the messages are posted during an outage, half once it is over"""
+        half = self.args.offline_messages // 2
+        self.client.online = False
+        for index in range(half):
+            chat = self.chats[index % len(self.chats)]
+            message_id = next(self._ids)
+            await self.post(self.message(chat, f'Offline message [bench:{message_id}]', message_id=message_id))
+            await asyncio.sleep(self.args.offline_seconds / half)
+        self.client.online = True
+        for index in range(self.args.offline_messages - half):
+            chat = self.chats[index % len(self.chats)]
+            message_id = next(self._ids)
+            await self.post(self.message(chat, f'Online message [bench:{message_id}]', message_id=message_id))
+        return self.args.offline_messages
+
+def is_idle():
+    return (
+        tf.connectivity.is_online
+        and not tf.album_aggregator.pending
+        and not tf.edit_debouncer.stats()["waiting"]
+        and not tf.dispatcher.depth and not tf.dispatcher.stats()["busy_workers"]
+        and not tf.bulk_dispatcher.depth and not tf.bulk_dispatcher.stats()["busy_workers"]
+    )
+
+async def settle(timeout=600):
+    """Wait until nothing is buffered, dispatched or queued any more"""
+    deadline = time.monotonic() + timeout
+    quiet_rounds = 0
+    while quiet_rounds < 3:
+        if time.monotonic() > deadline:
+            raise TimeoutError("Forwarder did not settle")
+        await asyncio.sleep(0.1)
+        if is_idle() and not (await tf.db.get_queue_stats())["backlog"]:
+            quiet_rounds += 1
+        else:
+            quiet_rounds = 0
+
+def percentile(samples, point):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))]
+
+async def run_workload(name, workloads, recorder):
+    recorder.reset()
+    sampler = asyncio.create_task(recorder.sample())
+    started = time.perf_counter()
+    try:
+        messages = await getattr(workloads, name)()
+        await settle()
+    finally:
+        sampler.cancel()
+    finished = recorder.last_delivery or time.perf_counter()
+    latencies = recorder.latencies
+    return {
+        "workload": name,
+        "messages": messages,
+        "copies": len(latencies),
+        "msgs_per_s": round(messages / max(finished - started, 1e-6), 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "peak_rss_mb": round(recorder.peak_rss / 1024 / 1024, 1),
+        "peak_temp_mb": round(recorder.peak_disk / 1024 / 1024, 1)
+    }
+
+async def run(args, names):
+    fakes = [
+        FakeClient(
+            args.rtt_ms / 1000, args.link_mbps * 1024 * 1024 / 8,
+            flood_rate=args.flood_rate, flood_seconds=args.flood_seconds,
+            seed=index + 1, user_id=index + 1, send_limit=args.account_send_limit
+        )
+        for index in range(max(1, args.accounts))
+    ]
+    fake = fakes[0]
+    recorder = Recorder(tf.get_temp_dir())
+    for sender in fakes:
+        sender.network = fake.network
+        sender.on_delivery = recorder.delivered
+
+    # The real client is only replaced, everything else runs as in production
+    tf.client = fake
+    tf.parallel_transfer.client = fake
+    tf.accounts.listener.client = fake
+    for sender in fakes[1:]:
+        tf.accounts.add(tf.Account(sender, tf.new_rate_limiter()))
+    tf.SESSION_STRING = 'bench'
+    tf.connectivity.probe = fake.probe
+    tf.connectivity.probe_interval = 0.1
+    tf.connectivity.check_interval = 0.1
+    # Rows that failed right before the outage was noticed are retried soon
+    database.RETRY_DELAY = 1
+
+    bot = asyncio.create_task(tf.main())
+    while tf.queue_wakeup is None:
+        if bot.done():
+            await bot
+        await asyncio.sleep(0.01)
+
+    results = []
+    workloads = Workloads(args, fake, recorder)
+    try:
+        for name in names:
+            results.append(await run_workload(name, workloads, recorder))
+    finally:
+        tf.is_running = False
+        await bot
+    return results, sum(sender.flood_waits for sender in fakes)
+
+def main():
+    args = parse_args()
+    names = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    unknown = set(names) - set(WORKLOADS)
+    if unknown:
+        sys.exit(f"Unknown workloads: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='bench_forwarder_')
+    configure(args, workdir)
+
+    # Failed sends during the outage are expected, the results are what matters
+    if not args.verbose:
+        logging.disable(logging.ERROR)
+    global tf, database, helpers, types, utils, FloodWaitError, MediaEmptyError, GetFileRequest, SaveBigFilePartRequest
+    import database
+    import telegram_forwarder as tf
+    from telethon import helpers, types, utils
+    from telethon.errors import FloodWaitError, MediaEmptyError
+    from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest
+
+    try:
+        results, flood_waits = asyncio.run(run(args, names))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"results": results, "flood_waits": flood_waits}, indent=2))
+        return
+    print(f"{args.sources} sources x {args.destinations} destinations, {args.rtt_ms:.0f} ms RTT, "
+          f"{args.link_mbps:.0f} Mbit/s link, flood wait rate {args.flood_rate}, {args.accounts} accounts")
+    print(f"{'workload':<10}{'messages':>10}{'copies':>8}{'msgs/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'RSS MB':>9}{'temp MB':>9}")
+    for result in results:
+        print(f"{result['workload']:<10}{result['messages']:>10}{result['copies']:>8}{result['msgs_per_s']:>9}"
+              f"{str(result['p50_ms']):>9}{str(result['p99_ms']):>9}"
+              f"{result['peak_rss_mb']:>9}{result['peak_temp_mb']:>9}")
+    if flood_waits:
+        print(f"{flood_waits} flood waits injected")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark for parallel chunked transfers
+
+Downloads and uploads a file with a real TelegramClient whose MTProtoSender
+is replaced by a local stand-in for a Telegram DC, which answers
+GetFile/SaveFilePart/SaveBigFilePart requests after a round trip and over a
+link of limited bandwidth. Compares Telethon's own download_media and
+upload_file with ParallelTransfer, both going through the same client.
+
+The speedup is modelled: like MTProtoSender, the stand-in sends every
+request right away on one connection, and it serves the requests in flight
+concurrently. A real DC that handles the requests of one connection one at
+a time would leave ParallelTransfer little to gain, so this shows what
+overlapping round trips is worth under that assumption, not what a given
+DC delivers.
+
+Usage: python benchmarks/bench_transfer.py [--size-mb 64] [--rtt-ms 80] [--link-mbps 400] [--workers 4]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import TelegramClient, types
+from telethon.sessions import StringSession
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest, SaveFilePartRequest
+from parallel_transfer import PART_SIZE, ParallelTransfer
+
+DC_ID = 2
+
+class LocalDC:
+    """
+    Stand-in for a Telegram DC
+    Every request takes a full round trip, requests in flight are served
+    concurrently and their bytes share one link of link_bytes per second
+    """
+    def __init__(self, file_data, rtt, link_bytes):
+        self.file_data = file_data
+        self.rtt = rtt
+        self.link_bytes = link_bytes
+        self.parts = {}
+        self._link = asyncio.Lock()
+
+    async def _transmit(self, size):
+        async with self._link:
+            await asyncio.sleep(size / self.link_bytes)
+
+    async def __call__(self, request):
+        await asyncio.sleep(self.rtt / 2)
+        if isinstance(request, GetFileRequest):
+            data = self.file_data[request.offset:request.offset + request.limit]
+            await self._transmit(len(data))
+            await asyncio.sleep(self.rtt / 2)
+            return types.upload.File(type=types.storage.FilePartial(), mtime=0, bytes=data)
+        if isinstance(request, (SaveFilePartRequest, SaveBigFilePartRequest)):
+            await self._transmit(len(request.bytes))
+            self.parts[request.file_part] = request.bytes
+            await asyncio.sleep(self.rtt / 2)
+            return True
+        raise TypeError(request)
+
+    def uploaded(self):
+        return b''.join(self.parts[part] for part in sorted(self.parts))
+
+class FakeSender:
+    """Stand-in for MTProtoSender, every request is sent to the DC right away"""
+    def __init__(self, dc):
+        self.dc = dc
+
+    def send(self, request, ordered=False):
+        return asyncio.ensure_future(self.dc(request))
+
+def make_client(dc):
+    """A TelegramClient connected to the stand-in DC instead of Telegram"""
+    client = TelegramClient(StringSession(), 1, 'bench')
+    client.session.set_dc(DC_ID, '127.0.0.1', 443)
+    client._sender = FakeSender(dc)
+    return client
+
+def make_media(size):
+    document = types.Document(
+        id=1, access_hash=1, file_reference=b'', date=None, mime_type='video/mp4',
+        size=size, dc_id=DC_ID, attributes=[]
+    )
+    return types.MessageMediaDocument(document=document)
+
+async def telethon_download(client, media, size):
+    return await client.download_media(media, file=bytes)
+
+async def telethon_upload(client, data):
+    return await client.upload_file(io.BytesIO(data), file_size=len(data), file_name='bench.mp4')
+
+async def parallel_download(client, media, size, workers):
+    transfer = ParallelTransfer(client, workers=workers)
+    out = io.BytesIO()
+    async for data in transfer.iter_download(media, size):
+        out.write(data)
+    return out.getvalue()
+
+async def parallel_upload(client, data, workers):
+    transfer = ParallelTransfer(client, workers=workers)
+    return await transfer.upload(io.BytesIO(data), len(data), 'bench.mp4')
+
+async def measure(coroutine_function, *args):
+    start = time.perf_counter()
+    result = await coroutine_function(*args)
+    return result, time.perf_counter() - start
+
+async def run(size, rtt, link_bytes, workers):
+    data = os.urandom(size)
+    media = make_media(size)
+    results = {}
+
+    dc = LocalDC(data, rtt, link_bytes)
+    client = make_client(dc)
+    downloaded, elapsed = await measure(telethon_download, client, media, size)
+    assert downloaded == data
+    results[('telethon', 'download')] = elapsed
+    _, elapsed = await measure(telethon_upload, client, data)
+    assert dc.uploaded() == data
+    results[('telethon', 'upload')] = elapsed
+
+    dc = LocalDC(data, rtt, link_bytes)
+    client = make_client(dc)
+    downloaded, elapsed = await measure(parallel_download, client, media, size, workers)
+    assert downloaded == data
+    results[('parallel', 'download')] = elapsed
+    _, elapsed = await measure(parallel_upload, client, data, workers)
+    assert dc.uploaded() == data
+    results[('parallel', 'upload')] = elapsed
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=64)
+    parser.add_argument('--rtt-ms', type=float, default=80)
+    parser.add_argument('--link-mbps', type=float, default=400)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    # Whole parts keep the stand-in simple
+    size = int(args.size_mb * 1024 * 1024) // PART_SIZE * PART_SIZE
+    results = asyncio.run(run(size, args.rtt_ms / 1000, args.link_mbps * 1024 * 1024 / 8, args.workers))
+
+    megabytes = size / 1024 / 1024
+    print(f"{size // 1024 // 1024} MB file, {args.rtt_ms:.0f} ms RTT, {args.link_mbps:.0f} Mbit/s link")
+    print(f"{'':<22}{'download MB/s':>15}{'upload MB/s':>15}")
+    for mode, label in (('telethon', 'telethon'), ('parallel', f'parallel ({args.workers} parts)')):
+        print(f"{label:<22}{megabytes / results[(mode, 'download')]:>15.1f}{megabytes / results[(mode, 'upload')]:>15.1f}")
+    print(f"{'modelled speedup':<22}"
+          f"{results[('telethon', 'download')] / results[('parallel', 'download')]:>14.1f}x"
+          f"{results[('telethon', 'upload')] / results[('parallel', 'upload')]:>14.1f}x")
+    print("Modelled: the stand-in DC serves the requests pipelined on one connection concurrently")
+
+if __name__ == '__main__':
+    main()
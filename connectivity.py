@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from telethon import events
+
+logger = logging.getLogger(__name__)
+
+# Connectivity states
+UNKNOWN = 'unknown'
+ONLINE = 'online'
+DEGRADED = 'degraded'
+OFFLINE = 'offline'
+
+# Exceptions that point to a network problem rather than an API error
+CONNECTION_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError)
+
+class ConnectivityMonitor:
+    """
+    Keep a cached online/offline state for the whole process
+    The state is fed by Telethon (updates received, client connection state)
+    and by send results, and the probe is only run while the state is unknown,
+    degraded or offline, so reading it never does any I/O
+    """
+    def __init__(self, probe, probe_interval=10, check_interval=5):
+        """
+        probe is a coroutine function returning True when the network is reachable
+        probe_interval is the delay between probes while not online
+        check_interval is how often the client connection state is looked at
+        """
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.check_interval = check_interval
+        self.state = UNKNOWN
+        self.changed_at = time.monotonic()
+        self._client = None
+        self._task = None
+        self._online = None
+        self._degraded = None
+        self._listeners = []
+
+    @property
+    def is_online(self):
+        """Whether sends should be attempted right now, without any I/O"""
+        return self.state != OFFLINE
+
+    def start(self, client):
+        """Attach to a started client and run the monitor in the background"""
+        # Events are created here so they belong to the running loop
+        self._online = asyncio.Event()
+        self._degraded = asyncio.Event()
+        self._client = client
+        client.add_event_handler(self._on_update, events.Raw())
+        self._task = asyncio.create_task(self._run())
+        logger.info("Connectivity monitor started")
+
+    async def stop(self):
+        """Stop the background monitor"""
+        if self._client:
+            self._client.remove_event_handler(self._on_update)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add_listener(self, callback):
+        """Call callback() every time connectivity comes back, once however often it is added"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def report_success(self):
+        """Record that something just went through the network"""
+        self._set_state(ONLINE)
+
+    def report_failure(self, error):
+        """Record a failed send, only network errors degrade the state"""
+        if isinstance(error, CONNECTION_ERRORS) and self.state != OFFLINE:
+            self._set_state(DEGRADED)
+
+    async def wait_online(self, timeout=None):
+        """Wait until the state is no longer offline, returns the current is_online"""
+        if self.is_online or self._online is None:
+            return self.is_online
+        try:
+            await asyncio.wait_for(self._online.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.is_online
+
+    async def _on_update(self, update):
+        """Any update from Telegram proves the connection is alive"""
+        if self.state != ONLINE:
+            self.report_success()
+
+    def _set_state(self, state):
+        """Change the state and wake up whoever is waiting on it"""
+        if state == self.state:
+            return
+        logger.info(f"Connectivity changed: {self.state} -> {state}")
+        was_online = self.is_online
+        self.state = state
+        self.changed_at = time.monotonic()
+        if self._online is None:
+            return
+        if state == OFFLINE:
+            self._online.clear()
+        else:
+            self._online.set()
+        if state == ONLINE:
+            self._degraded.clear()
+        else:
+            self._degraded.set()
+        if self.is_online and not was_online:
+            for callback in self._listeners:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in connectivity listener: {str(e)}")
+
+    async def _run(self):
+        """Probe while not online, otherwise just watch the client connection"""
+        if self.state == ONLINE:
+            self._online.set()
+        else:
+            self._degraded.set()
+        while True:
+            try:
+                if self._client and not self._client.is_connected() and self.state == ONLINE:
+                    self._set_state(DEGRADED)
+
+                if self.state == ONLINE:
+                    try:
+                        await asyncio.wait_for(self._degraded.wait(), self.check_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if await self.probe():
+                    # The network is back, Telethon reconnects on its own
+                    if self._client is None or self._client.is_connected():
+                        self._set_state(ONLINE)
+                    else:
+                        self._set_state(DEGRADED)
+                else:
+                    self._set_state(OFFLINE)
+                await asyncio.sleep(self.probe_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in connectivity monitor: {str(e)}")
+                await asyncio.sleep(self.probe_interval)
@@ -1,121 +1,745 @@
 import sqlite3
 import json
 import logging
+import queue
+import threading
+import time
+import asyncio
+import concurrent.futures
 from datetime import datetime
+from metrics import STAGE_SECONDS
 
 logger = logging.getLogger(__name__)
 
+# Failed messages are retried this many times before they are given up on
+MAX_RETRIES = 3
+# Base delay before retrying a failed message, doubled on every retry
+RETRY_DELAY = 60
+
+def _migrate_v1(cursor):
+    """Initial schema: message queue and resolved entity cache"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS queued_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER,
+            chat_id INTEGER,
+            message_text TEXT,
+            media_path TEXT,
+            created_at TIMESTAMP,
+            retries INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pending',
+            error_message TEXT,
+            is_edit BOOLEAN DEFAULT 0
+        )
+    ''')
+
+    # Add is_edit column if it doesn't exist
+    try:
+        cursor.execute('ALTER TABLE queued_messages ADD COLUMN is_edit BOOLEAN DEFAULT 0')
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS entity_cache (
+            key TEXT PRIMARY KEY,
+            peer_type TEXT,
+            peer_id INTEGER,
+            access_hash INTEGER,
+            resolved_at REAL
+        )
+    ''')
+
+def _migrate_v2(cursor):
+    """
+    Leased claiming: next_attempt_at is when a pending row becomes due, or when
+    the lease of an in_flight row expires and it can be claimed again
+    """
+    cursor.execute('ALTER TABLE queued_messages ADD COLUMN next_attempt_at REAL DEFAULT 0')
+    # Failed rows used to be left behind, give those with retries left another go
+    cursor.execute('''
+        UPDATE queued_messages SET status = 'pending'
+        WHERE status = 'failed' AND retries < ?
+    ''', (MAX_RETRIES,))
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queued_status_next
+        ON queued_messages (status, next_attempt_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queued_chat_message
+        ON queued_messages (chat_id, message_id)
+    ''')
+
+def _migrate_v3(cursor):
+    """Album items share a grouped_id so they are claimed and retried together"""
+    cursor.execute('ALTER TABLE queued_messages ADD COLUMN grouped_id INTEGER')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queued_chat_group
+        ON queued_messages (chat_id, grouped_id)
+        WHERE grouped_id IS NOT NULL
+    ''')
+
+def _migrate_v4(cursor):
+    """Rows can target a single destination, NULL means every route of the source"""
+    cursor.execute('ALTER TABLE queued_messages ADD COLUMN destination TEXT')
+
+def _migrate_v5(cursor):
+    """Fingerprints of recently sent content, for deduplication"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sent_fingerprints (
+            destination TEXT NOT NULL,
+            fingerprint BLOB NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (destination, fingerprint)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fingerprints_seen_at
+        ON sent_fingerprints (seen_at)
+    ''')
+
+def _migrate_v6(cursor):
+    """Which destination message each forwarded source message became"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_map (
+            source_chat INTEGER NOT NULL,
+            source_msg_id INTEGER NOT NULL,
+            destination TEXT NOT NULL,
+            dest_msg_id INTEGER NOT NULL,
+            media_id INTEGER,
+            formatted BOOLEAN DEFAULT 1,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (source_chat, source_msg_id, destination)
+        ) WITHOUT ROWID
+    ''')
+    # Deletes outside channels come without a chat, only with message ids
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_message_map_msg
+        ON message_map (source_msg_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_message_map_created
+        ON message_map (created_at)
+    ''')
+
+def _migrate_v7(cursor):
+    """Last source message handled per source, where catch-up starts after a restart"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS source_checkpoints (
+            source_chat INTEGER PRIMARY KEY,
+            last_msg_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def _migrate_v8(cursor):
+    """Account that sent each copy, NULL for copies sent before there were several"""
+    cursor.execute('ALTER TABLE message_map ADD COLUMN account TEXT')
+
+def _migrate_v9(cursor):
+    """Dedupe fingerprint each copy was remembered under, forgotten when the copy is deleted"""
+    cursor.execute('ALTER TABLE message_map ADD COLUMN fingerprint BLOB')
+
+# Schema migrations, the schema version is the number of migrations applied
+MIGRATIONS = [
+    _migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6, _migrate_v7, _migrate_v8,
+    _migrate_v9
+]
+
 class Database:
-    def __init__(self, db_file='message_queue.db'):
+    """
+    Message queue storage on a single long-lived SQLite connection in WAL mode
+    All statements run on a dedicated writer thread so the asyncio loop never
+    waits on SQLite. Jobs arriving within group_window seconds of each other
+    are committed together in one transaction (group commit).
+    """
+    def __init__(self, db_file='message_queue.db', group_window=0.002, max_batch=256):
         """Initialize database connection and create tables if they don't exist"""
         self.db_file = db_file
+        self.group_window = group_window
+        self.max_batch = max_batch
+        self.edits_collapsed = 0
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.row_factory = sqlite3.Row
         self.init_db()
 
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='database-writer', daemon=True)
+        self._thread.start()
+
     def init_db(self):
-        """Create the necessary tables if they don't exist"""
+        """Bring the schema up to date by running the missing migrations"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                cursor = conn.cursor()
-                
-                # Create messages table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS queued_messages (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        message_id INTEGER,
-                        chat_id INTEGER,
-                        message_text TEXT,
-                        media_path TEXT,
-                        created_at TIMESTAMP,
-                        retries INTEGER DEFAULT 0,
-                        status TEXT DEFAULT 'pending',
-                        error_message TEXT,
-                        is_edit BOOLEAN DEFAULT 0
-                    )
-                ''')
-                
-                # Add is_edit column if it doesn't exist
-                try:
-                    cursor.execute('ALTER TABLE queued_messages ADD COLUMN is_edit BOOLEAN DEFAULT 0')
-                except sqlite3.OperationalError:
-                    # Column already exists
-                    pass
-                
-                conn.commit()
-                logger.info("Database initialized successfully")
-                
+            cursor = self.conn.cursor()
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            for target, migration in enumerate(MIGRATIONS, start=1):
+                if target <= version:
+                    continue
+                cursor.execute('BEGIN IMMEDIATE')
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {target}')
+                cursor.execute('COMMIT')
+                logger.info(f"Database migrated to schema version {target}")
+            logger.info("Database initialized successfully")
+
         except Exception as e:
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
             logger.error(f"Error initializing database: {str(e)}")
             raise
 
-    def queue_message(self, message_id, chat_id, message_text=None, media_path=None, is_edit=False):
-        """Add a message to the queue"""
+    async def _submit(self, func, *args):
+        """Run func(cursor, *args) on the writer thread and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        started = time.perf_counter()
+        self._jobs.put((func, args, loop, future))
+        try:
+            return await future
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, 'db')
+
+    def _call(self, func, *args, timeout=5):
+        """Run func(cursor, *args) on the writer thread from a thread without the bot loop"""
+        if not self._thread.is_alive():
+            raise RuntimeError("database is closed")
+        future = concurrent.futures.Future()
+        self._jobs.put((func, args, None, future))
+        return future.result(timeout)
+
+    def _run(self):
+        """Writer thread: take jobs, group those arriving together, commit once"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            batch = [job]
+            stop = False
+            deadline = time.monotonic() + self.group_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    job = self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+
+            self._execute_batch(batch)
+            if stop:
+                break
+
+    def _execute_batch(self, batch):
+        """Run a batch of jobs in one transaction, each isolated by a savepoint"""
+        results = []
+        cursor = self.conn.cursor()
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for func, args, loop, future in batch:
+                cursor.execute('SAVEPOINT job')
+                try:
+                    result = func(cursor, *args)
+                    cursor.execute('RELEASE job')
+                    results.append((loop, future, result, None))
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO job')
+                    cursor.execute('RELEASE job')
+                    results.append((loop, future, None, e))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"Error committing database batch: {str(e)}")
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            results = [(loop, future, None, e) for _, _, loop, future in batch]
+
+        for loop, future, result, error in results:
+            if loop is None:
+                _resolve_future(future, result, error)
+                continue
+            try:
+                loop.call_soon_threadsafe(_resolve_future, future, result, error)
+            except RuntimeError:
+                # The loop waiting for this job is already closed
+                pass
+
+    def close(self):
+        """Finish pending jobs and close the connection"""
+        if self._thread.is_alive():
+            self._jobs.put(None)
+            self._thread.join()
+        self.conn.close()
+
+    async def queue_message(self, message_id, chat_id, message_text=None, media_path=None, is_edit=False,
+                            grouped_id=None, destination=None, delay=0):
+        """Add a message to the queue, due in delay seconds, returns its row id"""
+        return await self._submit(
+            self._queue_message, message_id, chat_id, message_text, media_path, is_edit, grouped_id, destination,
+            delay
+        )
+
+    def _queue_message(self, cursor, message_id, chat_id, message_text, media_path, is_edit, grouped_id, destination,
+                       delay):
+        try:
+            if is_edit:
+                # Queued rows are re-fetched when processed, so a row still
+                # waiting for this message will already send the latest version
                 cursor.execute('''
-                    INSERT INTO queued_messages 
-                    (message_id, chat_id, message_text, media_path, created_at, is_edit)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (message_id, chat_id, message_text, media_path, datetime.now(), is_edit))
-                conn.commit()
-                logger.info(f"Message {message_id} queued successfully")
-                return cursor.lastrowid
+                    SELECT id FROM queued_messages
+                    WHERE chat_id = ? AND message_id = ? AND destination IS ? AND status = 'pending'
+                    LIMIT 1
+                ''', (chat_id, message_id, destination))
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute('''
+                        UPDATE queued_messages SET message_text = ? WHERE id = ?
+                    ''', (message_text, row[0]))
+                    self.edits_collapsed += 1
+                    logger.info("Edit of message %s merged into queued row %s", message_id, row[0])
+                    return row[0]
+            cursor.execute('''
+                INSERT INTO queued_messages
+                (message_id, chat_id, message_text, media_path, created_at, is_edit, next_attempt_at,
+                 grouped_id, destination)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (message_id, chat_id, message_text, media_path, datetime.now(), is_edit, time.time() + delay,
+                  grouped_id, destination))
+            logger.info("Message %s queued successfully", message_id)
+            return cursor.lastrowid
         except Exception as e:
             logger.error(f"Error queuing message: {str(e)}")
             raise
 
-    def get_pending_messages(self, limit=10):
-        """Get pending messages that need to be forwarded"""
+    async def get_pending_messages(self, limit=10):
+        """Get pending messages that are due, without claiming them"""
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT * FROM queued_messages 
-                    WHERE status = 'pending' 
-                    AND retries < 3
-                    ORDER BY created_at ASC
-                    LIMIT ?
-                ''', (limit,))
-                return cursor.fetchall()
+            return await self._submit(self._get_pending_messages, limit)
         except Exception as e:
             logger.error(f"Error getting pending messages: {str(e)}")
             return []
 
-    def update_message_status(self, message_id, status, error_message=None):
-        """Update the status of a message in the queue"""
+    def _get_pending_messages(self, cursor, limit):
+        cursor.execute('''
+            SELECT * FROM queued_messages
+            WHERE status = 'pending'
+            AND next_attempt_at <= ?
+            ORDER BY next_attempt_at ASC, id ASC
+            LIMIT ?
+        ''', (time.time(), limit))
+        return cursor.fetchall()
+
+    async def claim_pending_messages(self, limit=10, lease_seconds=300):
+        """
+        Atomically claim up to limit due messages for processing
+        Claimed rows are in_flight until updated or until the lease expires,
+        so concurrent consumers never get the same row. The other items of a
+        claimed album are claimed along with it.
+        """
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                cursor = conn.cursor()
-                if status == 'failed':
-                    cursor.execute('''
-                        UPDATE queued_messages 
-                        SET status = ?, error_message = ?, retries = retries + 1
-                        WHERE message_id = ?
-                    ''', (status, error_message, message_id))
-                else:
-                    cursor.execute('''
-                        UPDATE queued_messages 
-                        SET status = ?
-                        WHERE message_id = ?
-                    ''', (status, message_id))
-                conn.commit()
-                logger.info(f"Message {message_id} status updated to {status}")
+            return await self._submit(self._claim_pending_messages, limit, lease_seconds)
+        except Exception as e:
+            logger.error(f"Error claiming pending messages: {str(e)}")
+            return []
+
+    def _claim_pending_messages(self, cursor, limit, lease_seconds):
+        now = time.time()
+        cursor.execute('''
+            SELECT * FROM queued_messages
+            WHERE status IN ('pending', 'in_flight')
+            AND next_attempt_at <= ?
+            ORDER BY next_attempt_at ASC, id ASC
+            LIMIT ?
+        ''', (now, limit))
+        rows = cursor.fetchall()
+
+        claimed = {row['id'] for row in rows}
+        albums = {(row['chat_id'], row['grouped_id']) for row in rows if row['grouped_id']}
+        for chat_id, grouped_id in albums:
+            cursor.execute('''
+                SELECT * FROM queued_messages
+                WHERE chat_id = ? AND grouped_id = ?
+                AND (status = 'pending' OR (status = 'in_flight' AND next_attempt_at <= ?))
+            ''', (chat_id, grouped_id, now))
+            for row in cursor.fetchall():
+                if row['id'] not in claimed:
+                    claimed.add(row['id'])
+                    rows.append(row)
+
+        # An expired lease is an attempt that never finished (a crash or a
+        # hang), it uses up a retry like any failed attempt
+        expired = [row for row in rows if row['status'] == 'in_flight']
+        if expired:
+            cursor.executemany('''
+                UPDATE queued_messages
+                SET status = CASE WHEN retries + 1 >= ? THEN 'failed' ELSE status END,
+                    error_message = 'Lease expired before the message was handled',
+                    retries = retries + 1
+                WHERE id = ?
+            ''', [(MAX_RETRIES, row['id']) for row in expired])
+            given_up = {row['id'] for row in expired if row['retries'] + 1 >= MAX_RETRIES}
+            if given_up:
+                logger.warning(f"Giving up on {len(given_up)} queued messages whose leases kept expiring")
+                rows = [row for row in rows if row['id'] not in given_up]
+
+        if rows:
+            cursor.executemany('''
+                UPDATE queued_messages
+                SET status = 'in_flight', next_attempt_at = ?
+                WHERE id = ?
+            ''', [(now + lease_seconds, row['id']) for row in rows])
+        return rows
+
+    async def renew_leases(self, row_ids, lease_seconds=300):
+        """Extend the leases of claimed messages still in_flight, while a slow batch is processed"""
+        if not row_ids:
+            return
+        return await self._submit(self._renew_leases, list(row_ids), lease_seconds)
+
+    def _renew_leases(self, cursor, row_ids, lease_seconds):
+        expires = time.time() + lease_seconds
+        cursor.executemany('''
+            UPDATE queued_messages
+            SET next_attempt_at = ?
+            WHERE id = ? AND status = 'in_flight'
+        ''', [(expires, row_id) for row_id in row_ids])
+
+    async def update_message_status(self, row_id, status, error_message=None, retry=True):
+        """
+        Update the status of a queued message by its row id
+        A 'failed' message goes back to pending with a growing delay until it
+        runs out of retries, unless retry is False
+        """
+        return await self.update_messages_status([row_id], status, error_message, retry)
+
+    async def update_messages_status(self, row_ids, status, error_message=None, retry=True):
+        """Update the status of several queued messages in one write, see update_message_status"""
+        if not row_ids:
+            return
+        return await self._submit(self._update_messages_status, list(row_ids), status, error_message, retry)
+
+    def _update_messages_status(self, cursor, row_ids, status, error_message, retry):
+        try:
+            if status == 'failed':
+                max_retries = MAX_RETRIES if retry else 0
+                now = time.time()
+                cursor.executemany('''
+                    UPDATE queued_messages
+                    SET status = CASE WHEN retries + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                        error_message = ?,
+                        next_attempt_at = ? + ? * (1 << retries),
+                        retries = retries + 1
+                    WHERE id = ?
+                ''', [(max_retries, error_message, now, RETRY_DELAY, row_id) for row_id in row_ids])
+            else:
+                cursor.executemany('''
+                    UPDATE queued_messages
+                    SET status = ?
+                    WHERE id = ?
+                ''', [(status, row_id) for row_id in row_ids])
+            if len(row_ids) == 1:
+                logger.info("Queued message %s status updated to %s", row_ids[0], status)
+            else:
+                logger.info("%s queued messages status updated to %s", len(row_ids), status)
         except Exception as e:
             logger.error(f"Error updating message status: {str(e)}")
             raise
 
-    def cleanup_old_messages(self, days=7):
+    async def defer_messages(self, row_ids, delay, error_message=None):
+        """
+        Put claimed messages back as pending, due in delay seconds, without
+        using up a retry: their attempt only failed because sending is paused
+        """
+        if not row_ids:
+            return
+        return await self._submit(self._defer_messages, list(row_ids), delay, error_message)
+
+    def _defer_messages(self, cursor, row_ids, delay, error_message):
+        try:
+            cursor.executemany('''
+                UPDATE queued_messages
+                SET status = 'pending', error_message = ?, next_attempt_at = ?
+                WHERE id = ?
+            ''', [(error_message, time.time() + delay, row_id) for row_id in row_ids])
+            logger.info("%s queued messages deferred for %.0fs", len(row_ids), delay)
+        except Exception as e:
+            logger.error(f"Error deferring messages: {str(e)}")
+            raise
+
+    async def get_next_due_at(self):
+        """Earliest time a pending row becomes due or an in_flight lease expires, None if empty"""
+        return await self._submit(self._get_next_due_at)
+
+    def _get_next_due_at(self, cursor):
+        cursor.execute('''
+            SELECT MIN(next_attempt_at) FROM queued_messages
+            WHERE status IN ('pending', 'in_flight')
+        ''')
+        return cursor.fetchone()[0]
+
+    async def get_queue_stats(self):
+        """Backlog size and age in seconds of the oldest waiting message"""
+        try:
+            return await self._submit(self._get_queue_stats)
+        except Exception as e:
+            logger.error(f"Error getting queue stats: {str(e)}")
+            return {"backlog": None, "oldest_age": None}
+
+    def get_queue_stats_blocking(self, timeout=5):
+        """get_queue_stats() for other threads, such as the web server"""
+        return self._call(self._get_queue_stats, timeout=timeout)
+
+    def _get_queue_stats(self, cursor):
+        cursor.execute('''
+            SELECT COUNT(*),
+                   (julianday('now', 'localtime') - julianday(MIN(created_at))) * 86400
+            FROM queued_messages
+            WHERE status IN ('pending', 'in_flight')
+        ''')
+        backlog, oldest_age = cursor.fetchone()
+        return {
+            "backlog": backlog,
+            "oldest_age": round(oldest_age, 1) if oldest_age is not None else None
+        }
+
+    async def cleanup_old_messages(self, days=7):
         """Clean up old messages from the queue"""
+        return await self._submit(self._cleanup_old_messages, days)
+
+    def _cleanup_old_messages(self, cursor, days):
         try:
-            with sqlite3.connect(self.db_file) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    DELETE FROM queued_messages 
-                    WHERE datetime(created_at) < datetime('now', '-' || ? || ' days')
-                    AND status != 'pending'
-                ''', (str(days),))
-                conn.commit()
-                logger.info(f"Cleaned up messages older than {days} days")
+            cursor.execute('''
+                DELETE FROM queued_messages
+                WHERE datetime(created_at) < datetime('now', '-' || ? || ' days')
+                AND status NOT IN ('pending', 'in_flight')
+            ''', (str(days),))
+            logger.info(f"Cleaned up messages older than {days} days")
         except Exception as e:
             logger.error(f"Error cleaning up old messages: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+
+    async def load_entities(self):
+        """Get all cached entities"""
+        try:
+            return await self._submit(self._load_entities)
+        except Exception as e:
+            logger.error(f"Error loading cached entities: {str(e)}")
+            return []
+
+    def _load_entities(self, cursor):
+        cursor.execute('''
+            SELECT key, peer_type, peer_id, access_hash, resolved_at
+            FROM entity_cache
+        ''')
+        return cursor.fetchall()
+
+    async def save_entity(self, key, peer_type, peer_id, access_hash, resolved_at):
+        """Insert or replace a cached entity"""
+        return await self._submit(self._save_entity, key, peer_type, peer_id, access_hash, resolved_at)
+
+    def _save_entity(self, cursor, key, peer_type, peer_id, access_hash, resolved_at):
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO entity_cache
+                (key, peer_type, peer_id, access_hash, resolved_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key, peer_type, peer_id, access_hash, resolved_at))
+        except Exception as e:
+            logger.error(f"Error saving cached entity: {str(e)}")
+            raise
+
+    async def delete_entity(self, key):
+        """Remove a cached entity"""
+        return await self._submit(self._delete_entity, key)
+
+    def _delete_entity(self, cursor, key):
+        try:
+            cursor.execute('DELETE FROM entity_cache WHERE key = ?', (key,))
+        except Exception as e:
+            logger.error(f"Error deleting cached entity: {str(e)}")
+            raise
+
+    async def load_fingerprints(self, since, limit):
+        """Get the most recent fingerprints seen after since, newest first"""
+        try:
+            return await self._submit(self._load_fingerprints, since, limit)
+        except Exception as e:
+            logger.error(f"Error loading fingerprints: {str(e)}")
+            return []
+
+    def _load_fingerprints(self, cursor, since, limit):
+        cursor.execute('''
+            SELECT destination, fingerprint, seen_at
+            FROM sent_fingerprints
+            WHERE seen_at >= ?
+            ORDER BY seen_at DESC
+            LIMIT ?
+        ''', (since, limit))
+        return cursor.fetchall()
+
+    async def find_fingerprint(self, destination, fingerprint, since):
+        """When fingerprint was last sent to destination, None if not since since"""
+        return await self._submit(self._find_fingerprint, destination, fingerprint, since)
+
+    def _find_fingerprint(self, cursor, destination, fingerprint, since):
+        cursor.execute('''
+            SELECT seen_at FROM sent_fingerprints
+            WHERE destination = ? AND fingerprint = ? AND seen_at >= ?
+        ''', (destination, fingerprint, since))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    async def save_fingerprint(self, destination, fingerprint, seen_at):
+        """Insert or refresh a sent fingerprint"""
+        return await self._submit(self._save_fingerprint, destination, fingerprint, seen_at)
+
+    def _save_fingerprint(self, cursor, destination, fingerprint, seen_at):
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO sent_fingerprints (destination, fingerprint, seen_at)
+                VALUES (?, ?, ?)
+            ''', (destination, fingerprint, seen_at))
+        except Exception as e:
+            logger.error(f"Error saving fingerprint: {str(e)}")
+            raise
+
+    async def prune_fingerprints(self, before):
+        """Remove fingerprints last seen before before"""
+        return await self._submit(self._prune_fingerprints, before)
+
+    def _prune_fingerprints(self, cursor, before):
+        try:
+            cursor.execute('DELETE FROM sent_fingerprints WHERE seen_at < ?', (before,))
+            if cursor.rowcount:
+                logger.info(f"Pruned {cursor.rowcount} old fingerprints")
+        except Exception as e:
+            logger.error(f"Error pruning fingerprints: {str(e)}")
+            raise
+
+    async def delete_fingerprints(self, keys):
+        """Remove fingerprints by (destination, fingerprint)"""
+        if not keys:
+            return
+        return await self._submit(self._delete_fingerprints, list(keys))
+
+    def _delete_fingerprints(self, cursor, keys):
+        try:
+            cursor.executemany('''
+                DELETE FROM sent_fingerprints
+                WHERE destination = ? AND fingerprint = ?
+            ''', keys)
+        except Exception as e:
+            logger.error(f"Error deleting fingerprints: {str(e)}")
+            raise
+
+    async def save_mapping(self, source_chat, source_msg_id, destination, dest_msg_id, media_id, formatted=True,
+                           account=None, fingerprint=None):
+        """Insert or replace the destination copy of a source message"""
+        return await self._submit(
+            self._save_mapping, source_chat, source_msg_id, destination, dest_msg_id, media_id, formatted, account,
+            fingerprint
+        )
+
+    def _save_mapping(self, cursor, source_chat, source_msg_id, destination, dest_msg_id, media_id, formatted,
+                      account, fingerprint):
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO message_map
+                (source_chat, source_msg_id, destination, dest_msg_id, media_id, formatted, account, fingerprint,
+                 created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                source_chat, source_msg_id, destination, dest_msg_id, media_id, formatted, account, fingerprint,
+                time.time()
+            ))
+        except Exception as e:
+            logger.error(f"Error saving message mapping: {str(e)}")
+            raise
+
+    async def get_mappings(self, source_chat, source_msg_ids):
+        """
+        Destination copies of source messages
+        A source_chat of None matches the ids in any chat that isn't a channel
+        """
+        return await self._submit(self._get_mappings, source_chat, list(source_msg_ids))
+
+    def _get_mappings(self, cursor, source_chat, source_msg_ids):
+        placeholders = ', '.join('?' * len(source_msg_ids))
+        if source_chat is None:
+            # Marked channel ids are below -10^12, see telethon.utils.get_peer_id
+            cursor.execute(f'''
+                SELECT * FROM message_map
+                WHERE source_msg_id IN ({placeholders}) AND source_chat > -1000000000000
+            ''', source_msg_ids)
+        else:
+            cursor.execute(f'''
+                SELECT * FROM message_map
+                WHERE source_chat = ? AND source_msg_id IN ({placeholders})
+            ''', [source_chat] + source_msg_ids)
+        return cursor.fetchall()
+
+    async def delete_mappings(self, keys):
+        """Remove mappings by (source_chat, source_msg_id, destination)"""
+        if not keys:
+            return
+        return await self._submit(self._delete_mappings, list(keys))
+
+    def _delete_mappings(self, cursor, keys):
+        try:
+            cursor.executemany('''
+                DELETE FROM message_map
+                WHERE source_chat = ? AND source_msg_id = ? AND destination = ?
+            ''', keys)
+        except Exception as e:
+            logger.error(f"Error deleting message mappings: {str(e)}")
+            raise
+
+    async def prune_mappings(self, days):
+        """Remove mappings older than days, their messages can no longer be edited or deleted"""
+        return await self._submit(self._prune_mappings, days)
+
+    def _prune_mappings(self, cursor, days):
+        try:
+            cursor.execute('DELETE FROM message_map WHERE created_at < ?', (time.time() - days * 86400,))
+            if cursor.rowcount:
+                logger.info(f"Pruned {cursor.rowcount} old message mappings")
+        except Exception as e:
+            logger.error(f"Error pruning message mappings: {str(e)}")
+            raise
+
+    async def load_checkpoints(self):
+        """{source_chat: last_msg_id} of every source"""
+        return await self._submit(self._load_checkpoints)
+
+    def _load_checkpoints(self, cursor):
+        cursor.execute('SELECT source_chat, last_msg_id FROM source_checkpoints')
+        return {row['source_chat']: row['last_msg_id'] for row in cursor.fetchall()}
+
+    async def save_checkpoint(self, source_chat, last_msg_id):
+        """Move the checkpoint of a source forward, it never goes back"""
+        return await self._submit(self._save_checkpoint, source_chat, last_msg_id)
+
+    def _save_checkpoint(self, cursor, source_chat, last_msg_id):
+        try:
+            cursor.execute('''
+                INSERT INTO source_checkpoints (source_chat, last_msg_id, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (source_chat) DO UPDATE SET
+                    last_msg_id = MAX(last_msg_id, excluded.last_msg_id),
+                    updated_at = excluded.updated_at
+            ''', (source_chat, last_msg_id, time.time()))
+        except Exception as e:
+            logger.error(f"Error saving source checkpoint: {str(e)}")
+            raise
+
+def _resolve_future(future, result, error):
+    """Hand a writer thread result back to the waiting coroutine"""
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
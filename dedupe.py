@@ -0,0 +1,172 @@
+import collections
+import hashlib
+import logging
+import time
+from telethon import types
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different copies compare equal"""
+    return ' '.join((text or '').split()).casefold()
+
+def is_text_only(message):
+    """Whether a message has no media besides a link preview"""
+    return message.media is None or isinstance(message.media, types.MessageMediaWebPage)
+
+def message_fingerprint(message, text=False):
+    """
+    Fingerprint of what a forward of message would contain: its photo or
+    document id and access hash, its normalised text and its sender
+    Messages without media are only fingerprinted by their text if text is
+    set, otherwise by the source message and its edit, so only re-deliveries
+    of the same message (retries, catch-up) match and a short reply like "ok"
+    posted twice isn't dropped
+    Returns None for media that can't be told apart this way (polls,
+    locations...), such messages are never treated as duplicates
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    media = message.media
+    if isinstance(media, types.MessageMediaPhoto) and media.photo:
+        digest.update(f"photo:{media.photo.id}:{media.photo.access_hash}".encode())
+    elif isinstance(media, types.MessageMediaDocument) and media.document:
+        digest.update(f"document:{media.document.id}:{media.document.access_hash}".encode())
+    elif media is not None and not isinstance(media, types.MessageMediaWebPage):
+        return None
+    elif not text:
+        edit_date = message.edit_date.timestamp() if message.edit_date else ''
+        digest.update(f"message:{message.chat_id}:{message.id}:{edit_date}".encode())
+        return digest.digest()
+
+    digest.update(b'\0' + normalize_text(message.message).encode())
+    # Channel posts are "sent" by the channel itself, leaving it out lets the
+    # same post cross-posted by several sources match
+    sender_id = getattr(message, 'sender_id', None)
+    if sender_id is not None and sender_id != message.chat_id:
+        digest.update(f"\0{sender_id}".encode())
+    return digest.digest()
+
+def album_fingerprint(messages):
+    """Fingerprint of a whole album, None if any item can't be fingerprinted"""
+    digest = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        fingerprint = message_fingerprint(message)
+        if fingerprint is None:
+            return None
+        digest.update(fingerprint)
+    return digest.digest()
+
+class DedupeCache:
+    """
+    Fingerprints of what was recently sent to each destination
+    The most recent max_size entries are kept in an in-memory LRU, every entry
+    is also written to the database so the window survives restarts. Content
+    already sent to a destination less than window seconds ago is a duplicate.
+    """
+    def __init__(self, db, window=3600, max_size=10000, text_window=0):
+        """
+        A window of 0 turns deduplication off. Messages without media are
+        matched by their text only if text_window is set, and only within it.
+        """
+        self.db = db
+        self.window = window
+        self.text_window = min(text_window, window)
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        # Set once entries only exist on disk, misses then check the database
+        self._spilled = False
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        """Load the most recent fingerprints still inside the window"""
+        if self.window <= 0:
+            return
+        since = time.time() - self.window
+        rows = await self.db.load_fingerprints(since, self.max_size + 1)
+        self._spilled = len(rows) > self.max_size
+        # Oldest first so the LRU order matches the send order
+        for destination, fingerprint, seen_at in reversed(rows[:self.max_size]):
+            self._entries[(destination, bytes(fingerprint))] = seen_at
+        logger.info(f"Loaded {len(self._entries)} message fingerprints")
+
+    def fingerprint(self, message):
+        """Fingerprint of a message, see message_fingerprint"""
+        return message_fingerprint(message, text=self.text_window > 0)
+
+    def window_for(self, message):
+        """How long a message stays a duplicate, None for the whole window"""
+        return self.text_window if self.text_window > 0 and is_text_only(message) else None
+
+    async def is_duplicate(self, destination, fingerprint, window=None):
+        """Whether fingerprint was sent to destination within window, by default the whole window"""
+        if fingerprint is None or self.window <= 0:
+            return False
+        key = (destination, fingerprint)
+        since = time.time() - (self.window if window is None else window)
+        seen_at = self._entries.get(key)
+        if seen_at is None and self._spilled:
+            try:
+                seen_at = await self.db.find_fingerprint(destination, fingerprint, since)
+            except Exception as e:
+                logger.error(f"Error looking up fingerprint: {str(e)}")
+        if seen_at is not None and seen_at >= since:
+            self.hits += 1
+            self._entries[key] = seen_at
+            self._entries.move_to_end(key)
+            self._evict()
+            return True
+        self.misses += 1
+        return False
+
+    async def remember(self, destination, fingerprint):
+        """Record that fingerprint was just sent to destination"""
+        if fingerprint is None or self.window <= 0:
+            return
+        key = (destination, fingerprint)
+        seen_at = time.time()
+        self._entries[key] = seen_at
+        self._entries.move_to_end(key)
+        self._evict()
+        try:
+            await self.db.save_fingerprint(destination, fingerprint, seen_at)
+        except Exception as e:
+            logger.error(f"Error persisting fingerprint: {str(e)}")
+
+    async def forget(self, keys):
+        """Drop fingerprints by (destination, fingerprint), content that was deleted there"""
+        keys = [(destination, fingerprint) for destination, fingerprint in keys if fingerprint is not None]
+        if not keys or self.window <= 0:
+            return
+        for key in keys:
+            self._entries.pop(key, None)
+        try:
+            await self.db.delete_fingerprints(keys)
+        except Exception as e:
+            logger.error(f"Error deleting fingerprints: {str(e)}")
+
+    async def prune(self):
+        """Drop fingerprints that fell out of the window"""
+        if self.window <= 0:
+            return
+        before = time.time() - self.window
+        for key in [key for key, seen_at in self._entries.items() if seen_at < before]:
+            del self._entries[key]
+        await self.db.prune_fingerprints(before)
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._spilled = True
+
+    def stats(self):
+        """Hit rate of the duplicate check for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "window": self.window,
+            "text_window": self.text_window,
+            "duplicates": self.hits,
+            "checked": total,
+            "hit_ratio": round(self.hits / total, 3) if total else None
+        }
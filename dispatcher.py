@@ -0,0 +1,137 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Nearest-rank percentiles of samples, None when there are none"""
+    if not samples:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(samples)
+    return {
+        f"p{point}": round(ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))], 3)
+        for point in points
+    }
+
+class Dispatcher:
+    """
+    Bounded pool of workers running forwarding jobs off the event handlers
+    Jobs are keyed (by source chat): jobs with the same key run one at a time
+    in submission order, different keys run in parallel. When max_queue jobs
+    are waiting, submit() refuses new ones so the caller can spill them to the
+    database queue.
+    """
+    def __init__(self, workers=4, max_queue=1000, name='dispatcher', latency_samples=1000):
+        """latency_samples is how many recent job latencies the percentiles are taken over"""
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pending = {}
+        self._ready = None
+        self._tasks = []
+        self._depth = 0
+        self._busy = 0
+        self._busy_time = 0.0
+        self._started_at = None
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        # Seconds from submit() to the end of the job, most recent last
+        self._latencies = collections.deque(maxlen=latency_samples)
+
+    @property
+    def depth(self):
+        """Jobs submitted and not yet started"""
+        return self._depth
+
+    def start(self):
+        """Start the workers on the running loop"""
+        self._ready = asyncio.Queue()
+        self._started_at = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._worker(index))
+            for index in range(self.workers)
+        ]
+        logger.info(f"Dispatcher {self.name} started with {self.workers} workers")
+
+    async def stop(self, timeout=30):
+        """Give waiting jobs up to timeout seconds to finish, then stop the workers"""
+        deadline = time.monotonic() + timeout
+        while (self._depth or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._ready = None
+        if self._depth:
+            logger.warning(f"Dispatcher {self.name} stopped with {self._depth} jobs waiting")
+
+    def submit(self, key, func, *args):
+        """
+        Schedule func(*args) after the jobs already submitted with the same key
+        Returns False if the dispatcher is full or not running
+        """
+        if self._ready is None or self._depth >= self.max_queue:
+            self.rejected += 1
+            return False
+
+        jobs = self._pending.get(key)
+        if jobs is None:
+            jobs = self._pending[key] = collections.deque()
+            # The key isn't being worked on, so it can be picked up right away
+            self._ready.put_nowait(key)
+        jobs.append((func, args, time.monotonic()))
+        self._depth += 1
+        return True
+
+    async def _worker(self, index):
+        """Take a ready key, run its oldest job, then put the key back if needed"""
+        while True:
+            key = await self._ready.get()
+            jobs = self._pending[key]
+            func, args, submitted = jobs.popleft()
+            self._depth -= 1
+
+            self._busy += 1
+            started = time.monotonic()
+            try:
+                await func(*args)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error in {self.name} worker {index}: {str(e)}")
+            finally:
+                self._busy -= 1
+                self._busy_time += time.monotonic() - started
+                self._latencies.append(time.monotonic() - submitted)
+                # The key stays out of the ready queue while its job runs,
+                # which is what keeps jobs of one chat in order
+                if jobs:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+
+    def stats(self):
+        """Queue depth, worker utilisation and job latency for monitoring"""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            "workers": self.workers,
+            "busy_workers": self._busy,
+            "queue_depth": self._depth,
+            "queue_capacity": self.max_queue,
+            "active_chats": len(self._pending),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "utilisation": round(self._busy_time / (elapsed * self.workers), 3) if elapsed else None,
+            "latency": percentiles(self._latencies)
+        }
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class EditDebouncer:
+    """
+    Coalesce bursts of edits to the same message so only the final version is
+    forwarded
+    Edits are keyed by (chat_id, message_id). Every new edit replaces the one
+    waiting and pushes the flush back by quiet_period seconds, without going
+    past max_wait seconds after the first edit of the burst
+    """
+    def __init__(self, on_edit, quiet_period=10.0, max_wait=60.0, cost=None):
+        """
+        on_edit is a coroutine function called with the final edited message
+        cost(message) returns the (downloads, sends) forwarding message takes,
+        used to report what coalescing saved
+        """
+        self.on_edit = on_edit
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.cost = cost or (lambda message: (0, 1))
+        self._edits = {}
+        # Forwards started outside a caller, the loop only keeps weak references to tasks
+        self._tasks = set()
+        self.edits_received = 0
+        self.edits_forwarded = 0
+        self.saved_downloads = 0
+        self.saved_sends = 0
+
+    def add(self, message):
+        """Hold an edited message back until its burst of edits is over"""
+        self.edits_received += 1
+        if self.quiet_period <= 0:
+            self.edits_forwarded += 1
+            self._spawn(self._forward(message))
+            return
+
+        key = (message.chat_id, message.id)
+        edit = self._edits.get(key)
+        if edit is None:
+            edit = self._edits[key] = {
+                "message": message,
+                "started": time.monotonic(),
+                "timer": None
+            }
+        else:
+            # The previous version is never forwarded
+            downloads, sends = self.cost(edit["message"])
+            self.saved_downloads += downloads
+            self.saved_sends += sends
+            edit["message"] = message
+            edit["timer"].cancel()
+
+        elapsed = time.monotonic() - edit["started"]
+        delay = max(0, min(self.quiet_period, self.max_wait - elapsed))
+        edit["timer"] = asyncio.get_running_loop().call_later(
+            delay, lambda: self._spawn(self.flush(key))
+        )
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, key):
+        """Hand the latest version of an edited message over to on_edit"""
+        edit = self._edits.pop(key, None)
+        if not edit:
+            return
+        if edit["timer"]:
+            edit["timer"].cancel()
+        self.edits_forwarded += 1
+        await self._forward(edit["message"])
+
+    async def flush_all(self):
+        """Flush every waiting edit, used on shutdown"""
+        for key in list(self._edits):
+            await self.flush(key)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _forward(self, message):
+        try:
+            await self.on_edit(message)
+        except Exception as e:
+            logger.error(f"Error handling edit of message {message.id}: {str(e)}")
+
+    def stats(self):
+        """How many edits were coalesced and what that saved"""
+        return {
+            "waiting": len(self._edits),
+            "received": self.edits_received,
+            "forwarded": self.edits_forwarded,
+            "coalesced": self.edits_received - self.edits_forwarded - len(self._edits),
+            "saved_downloads": self.saved_downloads,
+            "saved_sends": self.saved_sends
+        }
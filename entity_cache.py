@@ -0,0 +1,122 @@
+import logging
+import time
+from telethon import types, utils
+from telethon.errors import (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    ChatIdInvalidError,
+    PeerIdInvalidError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning a cached peer is no longer usable and must be resolved again
+PEER_ERRORS = (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    ChatIdInvalidError,
+    PeerIdInvalidError,
+)
+
+def peer_to_row(peer):
+    """Turn an InputPeer into (peer_type, peer_id, access_hash) for storage"""
+    if isinstance(peer, types.InputPeerChannel):
+        return 'channel', peer.channel_id, peer.access_hash
+    if isinstance(peer, types.InputPeerUser):
+        return 'user', peer.user_id, peer.access_hash
+    if isinstance(peer, types.InputPeerChat):
+        return 'chat', peer.chat_id, None
+    if isinstance(peer, types.InputPeerSelf):
+        return 'self', None, None
+    return None
+
+def row_to_peer(peer_type, peer_id, access_hash):
+    """Rebuild an InputPeer from a stored row"""
+    if peer_type == 'channel':
+        return types.InputPeerChannel(channel_id=peer_id, access_hash=access_hash)
+    if peer_type == 'user':
+        return types.InputPeerUser(user_id=peer_id, access_hash=access_hash)
+    if peer_type == 'chat':
+        return types.InputPeerChat(chat_id=peer_id)
+    if peer_type == 'self':
+        return types.InputPeerSelf()
+    return None
+
+class EntityCache:
+    """
+    Cache of resolved InputPeers keyed by channel ID/username
+    Entries are persisted in the database so a restart doesn't have to
+    resolve everything again. Access hashes don't expire, an entry is dropped
+    as soon as using it fails with a peer error (invalidate_on_error), the ttl
+    only catches usernames that moved to another chat
+    """
+    def __init__(self, db, ttl=7 * 24 * 3600):
+        """A ttl of 0 keeps entries until they fail"""
+        self.db = db
+        self.ttl = ttl
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def load(self):
+        """Load persisted entries, expired ones are resolved again when used"""
+        for key, peer_type, peer_id, access_hash, resolved_at in await self.db.load_entities():
+            peer = row_to_peer(peer_type, peer_id, access_hash)
+            if peer is not None:
+                self._entries[key] = (peer, resolved_at)
+        logger.info(f"Loaded {len(self._entries)} cached entities")
+
+    async def put(self, key, entity):
+        """Store an entity (or InputPeer) under key"""
+        key = str(key)
+        peer = utils.get_input_peer(entity)
+        resolved_at = time.time()
+        self._entries[key] = (peer, resolved_at)
+        row = peer_to_row(peer)
+        if row:
+            try:
+                await self.db.save_entity(key, *row, resolved_at)
+            except Exception as e:
+                logger.error(f"Error persisting entity {key}: {str(e)}")
+        return peer
+
+    async def get(self, client, key):
+        """Get the InputPeer for key, resolving it through the client on a miss"""
+        entry = self._entries.get(str(key))
+        if entry and (self.ttl <= 0 or time.time() - entry[1] < self.ttl):
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        peer = await client.get_input_entity(key)
+        return await self.put(key, peer)
+
+    async def invalidate(self, key):
+        """Drop a cached entry"""
+        key = str(key)
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+            logger.info(f"Invalidated cached entity {key}")
+        try:
+            await self.db.delete_entity(key)
+        except Exception as e:
+            logger.error(f"Error deleting cached entity {key}: {str(e)}")
+
+    async def invalidate_on_error(self, key, error):
+        """Drop the entry for key if error means the peer is no longer valid"""
+        if isinstance(error, PEER_ERRORS):
+            await self.invalidate(key)
+            return True
+        return False
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / total, 3) if total else None
+        }
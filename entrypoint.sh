@@ -12,5 +12,9 @@ echo "DESTINATION_CHANNEL is set: $(if [ -n "$DESTINATION_CHANNEL" ]; then echo
 echo "TELEGRAM_SESSION_STRING is set: $(if [ -n "$TELEGRAM_SESSION_STRING" ]; then echo "YES"; else echo "NO"; fi)"
 
 # Start the web service
+if [ "$SERVER_MODE" = "asyncio" ]; then
+    echo "Starting asyncio status server..."
+    exec python server.py
+fi
 echo "Starting Gunicorn server..."
 exec gunicorn app:app --bind 0.0.0.0:$PORT --workers 1 --threads 2 --log-file - --log-level debug
\ No newline at end of file
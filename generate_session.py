@@ -1,6 +1,7 @@
 from telethon.sync import TelegramClient
 from telethon.sessions import StringSession
 from dotenv import load_dotenv
+import argparse
 import os
 
 load_dotenv()
@@ -8,7 +9,28 @@ load_dotenv()
 API_ID = os.getenv('TELEGRAM_API_ID')
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 
-with TelegramClient(StringSession(), API_ID, API_HASH) as client:
-    print("\nHere is your session string, please save it safely:\n")
-    print(client.session.save())
-    print("\nAdd this string to your environment variables as TELEGRAM_SESSION_STRING") 
\ No newline at end of file
+parser = argparse.ArgumentParser(description="Log in and print Telegram session strings")
+parser.add_argument('accounts', type=int, nargs='?', default=1,
+                    help='how many accounts to log in, the first one listens and all of them send')
+parser.add_argument('--senders', action='store_true',
+                    help='only log in extra sending accounts for an existing TELEGRAM_SESSION_STRING')
+args = parser.parse_args()
+
+sessions = []
+for index in range(args.accounts):
+    if args.accounts > 1:
+        print(f"\nLog in with account {index + 1} of {args.accounts}, each one needs its own phone number")
+    with TelegramClient(StringSession(), API_ID, API_HASH) as client:
+        me = client.get_me()
+        sessions.append(client.session.save())
+        print(f"\nHere is the session string of {me.first_name} ({me.id}), please save it safely:\n")
+        print(sessions[-1])
+
+listener = [] if args.senders else sessions[:1]
+senders = sessions[len(listener):]
+print("\nAdd these to your environment variables:\n")
+if listener:
+    print(f"TELEGRAM_SESSION_STRING={listener[0]}")
+if senders:
+    # Sending accounts must be members of every destination, with posting rights
+    print(f"SENDER_SESSION_STRINGS={','.join(senders)}")
@@ -0,0 +1,81 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Health states, worst last
+HEALTHY = 'healthy'
+# Running but not done starting up, not a failure
+STARTING = 'starting'
+DEGRADED = 'degraded'
+UNHEALTHY = 'unhealthy'
+
+class LoopLagMonitor:
+    """
+    How late the event loop runs a timer
+    Anything blocking the loop (CPU-heavy work, synchronous I/O) delays every
+    coroutine by the same amount, so this is the lag every message sees
+    """
+    def __init__(self, interval=1.0, window=10):
+        """The worst lag of the last window samples is reported"""
+        self.interval = interval
+        self._samples = collections.deque(maxlen=window)
+        self._task = None
+        self.last_tick = None
+
+    def start(self):
+        """Start measuring on the running loop"""
+        self._samples.clear()
+        self.last_tick = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.last_tick = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_tick = time.monotonic()
+            self._samples.append(max(0.0, self.last_tick - started - self.interval))
+
+    @property
+    def lag(self):
+        """
+        Worst recent lag in seconds, including the current tick if it is
+        already overdue (a loop blocked right now)
+        """
+        if self.last_tick is None:
+            return None
+        overdue = max(0.0, time.monotonic() - self.last_tick - self.interval)
+        return max(max(self._samples, default=0.0), overdue)
+
+    def stats(self):
+        lag = self.lag
+        return {
+            "lag": round(lag, 3) if lag is not None else None,
+            "last": round(self._samples[-1], 3) if self._samples else None
+        }
+
+def evaluate(checks):
+    """
+    Overall state from {name: (state, details)} checks, the worst one wins
+    Returns the state and the checks as a JSON-friendly dict
+    """
+    order = [HEALTHY, STARTING, DEGRADED, UNHEALTHY]
+    state = HEALTHY
+    report = {}
+    for name, (check_state, details) in checks.items():
+        if order.index(check_state) > order.index(state):
+            state = check_state
+        report[name] = dict(details, state=check_state)
+    return state, report
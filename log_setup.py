@@ -0,0 +1,125 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# Format of the console logs in the text format
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_sampler = None
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The classic format, noting how many similar lines were left out"""
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += f" ({suppressed} similar lines suppressed)"
+        return text
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate limit INFO and DEBUG lines per call site
+    Every line (logger, file and line number) may log rate_limit times per
+    second, beyond that only one in every 1/sample_rate lines gets through
+    and carries how many were left out. Warnings and errors always pass.
+    """
+    def __init__(self, rate_limit=20, sample_rate=0.1):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.keep_every = round(1 / sample_rate) if sample_rate > 0 else 0
+        # call site -> [tokens, last refill, suppressed since last kept]
+        self._sites = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate_limit <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [self.rate_limit, now, 0]
+            site[0] = min(self.rate_limit, site[0] + (now - site[1]) * self.rate_limit)
+            site[1] = now
+            if site[0] >= 1:
+                site[0] -= 1
+            else:
+                site[2] += 1
+                if not self.keep_every or site[2] % self.keep_every:
+                    self.suppressed += 1
+                    return False
+                # This one is kept, the others are counted on it
+                site[2] -= 1
+            record.suppressed = site[2]
+            site[2] = 0
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Left as is so the message is only formatted on the listener thread
+        return record
+
+def setup_logging():
+    """
+    Send every log record through a queue to a background thread that
+    formats and writes it, so logging never blocks the event loop
+    Configured by LOG_LEVEL, LOG_FORMAT (json or text), LOG_RATE_LIMIT and
+    LOG_SAMPLE_RATE, calling it again does nothing
+    """
+    global _listener, _sampler
+    if _listener is not None:
+        return
+
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    log_format = os.getenv('LOG_FORMAT', 'json').lower()
+    rate_limit = float(os.getenv('LOG_RATE_LIMIT', '20'))
+    sample_rate = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+
+    output = logging.StreamHandler(sys.stdout)  # Only log to stdout for Render
+    output.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    _sampler = SamplingFilter(rate_limit, sample_rate)
+    handler.addFilter(_sampler)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    # Whatever is still queued is written before the process exits
+    atexit.register(_listener.stop)
+
+def sampling_stats():
+    """Lines left out by sampling so far"""
+    return {"suppressed": _sampler.suppressed if _sampler else 0}
@@ -0,0 +1,192 @@
+import asyncio
+import collections
+import logging
+import os
+from telethon import types
+
+logger = logging.getLogger(__name__)
+
+def get_media_key(message):
+    """Stable cache key of the photo or document of a message, None if it has none"""
+    media = message.media
+    if isinstance(media, types.MessageMediaWebPage) and isinstance(media.webpage, types.WebPage):
+        photo, document = media.webpage.photo, media.webpage.document
+    else:
+        photo = getattr(media, 'photo', None) if isinstance(media, types.MessageMediaPhoto) else None
+        document = getattr(media, 'document', None) if isinstance(media, types.MessageMediaDocument) else None
+    if isinstance(photo, types.Photo):
+        return f'photo_{photo.id}'
+    if isinstance(document, types.Document):
+        return f'document_{document.id}'
+    return None
+
+def get_media_extension(message):
+    """File extension that helps the destination recognise the media type"""
+    media = message.media
+    if isinstance(media, types.MessageMediaPhoto):
+        return '.jpg'
+    if isinstance(media, types.MessageMediaDocument):
+        # Try to get extension from file name or mime type
+        if message.file and message.file.name:
+            return os.path.splitext(message.file.name)[1]
+        mime_type = media.document.mime_type if media.document else None
+        if mime_type:
+            if 'image/webp' in mime_type:
+                return '.webp'
+            if 'image/jpeg' in mime_type:
+                return '.jpg'
+            if 'video' in mime_type:
+                return '.mp4'
+            if 'audio' in mime_type:
+                return '.m4a'
+            if 'application/x-tgsticker' in mime_type:
+                return '.tgs'
+    elif isinstance(media, types.MessageMediaWebPage):
+        # For web pages with preview media
+        webpage = media.webpage
+        if getattr(webpage, 'photo', None):
+            return '.jpg'
+        document = getattr(webpage, 'document', None)
+        if document:
+            if 'video' in document.mime_type:
+                return '.mp4'
+            if 'audio' in document.mime_type:
+                return '.m4a'
+    return ''
+
+def get_media_filename(message):
+    """File name a message's media is downloaded to"""
+    key = get_media_key(message)
+    if key is None:
+        return f'media_{message.chat_id}_{message.id}{get_media_extension(message)}'
+    return f'{key}{get_media_extension(message)}'
+
+class MediaCache:
+    """
+    Downloaded media on disk, keyed by Telegram photo/document id
+    Retries, edits and fan-out to several destinations reuse one download.
+    Files are reference counted while in use, and unused ones are evicted
+    least recently used first once the cache is over max_bytes.
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, download=None):
+        """download(message, path) is the coroutine function that downloads media"""
+        self.directory = directory
+        self.download = download or (lambda message, path: message.download_media(path))
+        self.max_bytes = max_bytes
+        # key -> {"path", "size", "refs"}, least recently used first
+        self._entries = collections.OrderedDict()
+        self._paths = {}
+        self._downloads = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def acquire(self, message):
+        """
+        Path of the downloaded media of message, downloading it on a miss
+        Every acquired path must be given back with release()
+        """
+        key = get_media_key(message)
+        if key is None:
+            # Nothing stable to key it on, downloaded for this use only
+            self.misses += 1
+            return await self._download(message, get_media_filename(message))
+
+        entry = self._entries.get(key)
+        if entry and os.path.exists(entry["path"]):
+            self.hits += 1
+            entry["refs"] += 1
+            self._entries.move_to_end(key)
+            return entry["path"]
+
+        # Concurrent misses for the same media share one download
+        download = self._downloads.get(key)
+        if download is None:
+            self.misses += 1
+            download = self._downloads[key] = asyncio.ensure_future(
+                self._download(message, get_media_filename(message))
+            )
+            download.add_done_callback(lambda _: self._downloads.pop(key, None))
+        else:
+            self.hits += 1
+        path = await asyncio.shield(download)
+
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {"path": path, "size": os.path.getsize(path), "refs": 0}
+            self._paths[path] = key
+            self.size += entry["size"]
+        entry["refs"] += 1
+        self._entries.move_to_end(key)
+        self._evict()
+        return path
+
+    def release(self, path):
+        """Give back a path from acquire(), it may be evicted once unused"""
+        key = self._paths.get(path)
+        if key is None:
+            # Uncached download
+            self._remove(path)
+            return
+        entry = self._entries.get(key)
+        if entry and entry["refs"] > 0:
+            entry["refs"] -= 1
+        self._evict()
+
+    def clear(self):
+        """Forget every entry, used when the temp directory is removed"""
+        self._entries.clear()
+        self._paths.clear()
+        self.size = 0
+
+    async def _download(self, message, filename):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        # Downloaded under a temporary name so a partial file is never served
+        partial = path + '.part'
+        try:
+            await self.download(message, partial)
+            if not os.path.exists(partial) or os.path.getsize(partial) == 0:
+                raise Exception("Media download failed or file is empty")
+            os.replace(partial, path)
+        except BaseException:
+            self._remove(partial)
+            raise
+        logger.info("Media downloaded successfully: %s", path)
+        return path
+
+    def _evict(self):
+        for key in list(self._entries):
+            if self.size <= self.max_bytes:
+                return
+            entry = self._entries[key]
+            if entry["refs"]:
+                continue
+            del self._entries[key]
+            self._paths.pop(entry["path"], None)
+            self.size -= entry["size"]
+            self.evictions += 1
+            self._remove(entry["path"])
+
+    def _remove(self, path):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+                logger.info("Cleaned up media file: %s", path)
+            except Exception as e:
+                logger.error(f"Error cleaning up media file: {str(e)}")
+
+    def stats(self):
+        """Cache size and hit ratio for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "files": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "in_use": sum(1 for entry in self._entries.values() if entry["refs"]),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 3) if total else None
+        }
@@ -0,0 +1,65 @@
+import asyncio
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ChunkPipe:
+    """
+    Bounded in-memory pipe between a chunked download and an upload
+    The producer side is fed from an async iterator of byte chunks (e.g.
+    client.iter_download) and the consumer side is a file-like object with an
+    async read() that Telethon's upload_file accepts
+    """
+    def __init__(self, name=None, max_chunks=16):
+        """Create a pipe buffering at most max_chunks downloaded chunks"""
+        self.name = name
+        self._queue = asyncio.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        self.bytes_fed = 0
+        self.bytes_read = 0
+
+    async def feed(self, chunks, progress_callback=None):
+        """
+        Push chunks from an async iterator into the pipe until it is exhausted
+        progress_callback(fed, None), if given, is called (and awaited if it
+        is a coroutine function) for every chunk before it is pushed
+        """
+        try:
+            async for chunk in chunks:
+                self.bytes_fed += len(chunk)
+                if progress_callback:
+                    result = progress_callback(self.bytes_fed, None)
+                    if inspect.isawaitable(result):
+                        await result
+                await self._queue.put(bytes(chunk))
+            await self._queue.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error feeding media stream {self.name}: {str(e)}")
+            await self._queue.put(e)
+
+    async def read(self, size=-1):
+        """Read up to size bytes, waiting for the producer if needed"""
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = await self._queue.get()
+            if chunk is None:
+                self._eof = True
+            elif isinstance(chunk, Exception):
+                self._eof = True
+                raise chunk
+            else:
+                self._buffer += chunk
+
+        if size < 0 or size > len(self._buffer):
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def seekable(self):
+        """The pipe can only be read forward"""
+        return False
@@ -0,0 +1,121 @@
+import collections
+import logging
+from telethon import types
+
+logger = logging.getLogger(__name__)
+
+# A destination copy of a source message, the account that sent it and its dedupe fingerprint
+Copy = collections.namedtuple('Copy', ['dest_msg_id', 'media_id', 'formatted', 'account', 'fingerprint'])
+
+def get_media_id(message):
+    """Id of the photo or document of a message, None for anything else"""
+    media = getattr(message, 'media', None)
+    if isinstance(media, types.MessageMediaPhoto) and media.photo:
+        return media.photo.id
+    if isinstance(media, types.MessageMediaDocument) and media.document:
+        return media.document.id
+    return None
+
+def get_sent_id(sent):
+    """Id of a sent message, None if the send didn't return one"""
+    return getattr(sent, 'id', None)
+
+class MessageMap:
+    """
+    Which destination message each forwarded source message became
+    Recent entries are kept in an in-memory LRU keyed by (source_chat,
+    source_msg_id), older ones are read from the database on its writer
+    thread, so a lookup never blocks the event loop
+    """
+    def __init__(self, db, retention_days=30, max_size=10000):
+        self.db = db
+        self.retention_days = retention_days
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.edits_in_place = 0
+        self.deletes_propagated = 0
+
+    async def record(self, source_chat, source_msg_id, destination, dest_msg_id, media_id, formatted=True,
+                     account=None, fingerprint=None):
+        """Remember that source_msg_id was sent to destination as dest_msg_id by account"""
+        if dest_msg_id is None:
+            return
+        copy = Copy(dest_msg_id, media_id, formatted, account, fingerprint)
+        key = (source_chat, source_msg_id)
+        copies = self._entries.get(key)
+        if copies is not None:
+            copies[destination] = copy
+            self._touch(key, copies)
+        try:
+            await self.db.save_mapping(
+                source_chat, source_msg_id, destination, dest_msg_id, media_id, formatted, account, fingerprint
+            )
+        except Exception as e:
+            logger.error(f"Error persisting message mapping: {str(e)}")
+
+    async def get(self, source_chat, source_msg_id):
+        """{destination: Copy} of a source message, empty if it was never forwarded"""
+        key = (source_chat, source_msg_id)
+        copies = self._entries.get(key)
+        if copies is not None:
+            self.hits += 1
+            self._touch(key, copies)
+            return copies
+
+        self.misses += 1
+        copies = {}
+        try:
+            for row in await self.db.get_mappings(source_chat, [source_msg_id]):
+                copies[row['destination']] = Copy(
+                    row['dest_msg_id'], row['media_id'], bool(row['formatted']), row['account'],
+                    bytes(row['fingerprint']) if row['fingerprint'] is not None else None
+                )
+        except Exception as e:
+            logger.error(f"Error loading message mapping: {str(e)}")
+            return copies
+        self._touch(key, copies)
+        return copies
+
+    async def find(self, source_chat, source_msg_ids):
+        """
+        Mapping rows of several source messages, source_chat None matching
+        any chat that isn't a channel (deletes there don't say the chat)
+        """
+        return await self.db.get_mappings(source_chat, source_msg_ids)
+
+    async def forget(self, keys):
+        """Drop mappings by (source_chat, source_msg_id, destination)"""
+        for source_chat, source_msg_id, destination in keys:
+            copies = self._entries.get((source_chat, source_msg_id))
+            if copies is not None:
+                copies.pop(destination, None)
+        try:
+            await self.db.delete_mappings(keys)
+        except Exception as e:
+            logger.error(f"Error deleting message mappings: {str(e)}")
+
+    async def prune(self):
+        """Forget mappings past the retention period"""
+        # Cached entries are only a view of the table, they are simply reloaded
+        self._entries.clear()
+        await self.db.prune_mappings(self.retention_days)
+
+    def _touch(self, key, copies):
+        self._entries[key] = copies
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Lookup counters and how many edits/deletes were applied to copies"""
+        total = self.hits + self.misses
+        return {
+            "cached": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else None,
+            "edits_in_place": self.edits_in_place,
+            "deletes_propagated": self.deletes_propagated
+        }
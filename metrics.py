@@ -0,0 +1,152 @@
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a database write to a large upload
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+class Counter:
+    """Monotonic counter with optional labels"""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram:
+    """Histogram with fixed buckets and optional labels"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *labels):
+        """Context manager observing the time spent in its block"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labelnames + ('le',), labels + (bound,)), cumulative)
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), counts[-1]
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), cumulative
+
+class Gauge:
+    """
+    Value computed by a callback when metrics are scraped, metric_type is
+    'counter' for totals kept elsewhere
+    """
+    def __init__(self, name, documentation, callback, metric_type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.type = metric_type
+
+    def samples(self):
+        value = self.callback()
+        if value is not None:
+            yield self.name, '', value
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class Registry:
+    """
+    Metrics rendered in the Prometheus text format
+    Recording only takes a short uncontended lock, so the bot loop never
+    waits on a scrape, and render() can be called from any thread
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, metric_type='gauge'):
+        return self.register(Gauge(name, documentation, callback, metric_type))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {str(e)}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# Time spent per message in each stage: connectivity, download, upload, send, db
+STAGE_SECONDS = REGISTRY.histogram(
+    'forwarder_stage_seconds', 'Time spent per message in each forwarding stage', ['stage']
+)
+# Messages by outcome: forwarded, queued, failed, duplicate. A message routed
+# to several destinations is counted once for each of them.
+MESSAGES = REGISTRY.counter(
+    'forwarder_messages_total', 'Messages by outcome, counted once for each destination they are routed to',
+    ['result']
+)
@@ -0,0 +1,162 @@
+import asyncio
+import collections
+import inspect
+import logging
+from telethon import helpers, types, utils
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest
+
+logger = logging.getLogger(__name__)
+
+# Largest part Telegram accepts for downloads and uploads
+PART_SIZE = 512 * 1024
+# Files at least this large are uploaded as big file parts, smaller ones need
+# an md5 checksum and are left to Telethon
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+class ParallelTransferError(Exception):
+    """Raised when a file can't be transferred in parallel parts"""
+
+class ParallelTransfer:
+    """
+    Download and upload large files as parts transferred concurrently
+    Telethon waits for each part before requesting the next one, so a single
+    transfer is capped by round trips rather than by the link. Here up to
+    workers part requests are in flight at once on the client's connection,
+    which MTProto pipelines, while parts are still handed out in file order.
+    """
+    def __init__(self, client, workers=4, part_size=PART_SIZE, max_flood_wait=60):
+        """Part flood waits up to max_flood_wait seconds are waited out, longer ones fail the transfer"""
+        self.client = client
+        self.workers = workers
+        self.part_size = part_size
+        self.max_flood_wait = max_flood_wait
+        self.downloads = 0
+        self.uploads = 0
+        self.fallbacks = 0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+
+    async def iter_download(self, media, file_size):
+        """Yield the parts of a file in order, fetching up to workers parts at once"""
+        dc_id, location = utils.get_input_location(media)
+        if dc_id is not None and dc_id != self.client.session.dc_id:
+            # Other DCs need their own authorised connection, Telethon handles those
+            raise ParallelTransferError(f"media is stored on DC {dc_id}")
+
+        part_count = -(-file_size // self.part_size)
+        tasks = collections.deque()
+        next_part = 0
+        self.downloads += 1
+        try:
+            while next_part < part_count or tasks:
+                while next_part < part_count and len(tasks) < self.workers:
+                    tasks.append(asyncio.ensure_future(self._get_part(location, next_part)))
+                    next_part += 1
+                data = await tasks.popleft()
+                self.bytes_downloaded += len(data)
+                yield data
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Parts still in flight must not outlive the download, nor log unretrieved errors
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def download(self, media, file_size, path, progress_callback=None):
+        """
+        Download a file to path
+        progress_callback(downloaded, file_size), if given, is called (and
+        awaited if it is a coroutine function) after every part, like Telethon's
+        """
+        downloaded = 0
+        with open(path, 'wb') as f:
+            async for data in self.iter_download(media, file_size):
+                f.write(data)
+                downloaded += len(data)
+                if progress_callback:
+                    result = progress_callback(downloaded, file_size)
+                    if inspect.isawaitable(result):
+                        await result
+        return path
+
+    async def upload(self, stream, file_size, file_name, progress_callback=None):
+        """
+        Upload file_size bytes read from stream (a file or an object with an
+        async read()) and return the InputFileBig to send
+        progress_callback(read, file_size), if given, is called (and awaited if
+        it is a coroutine function) after every part is read, before it is sent
+        """
+        if file_size < BIG_FILE_SIZE:
+            raise ParallelTransferError("file is too small for big file parts")
+
+        file_id = helpers.generate_random_long()
+        part_count = -(-file_size // self.part_size)
+        slots = asyncio.Semaphore(self.workers)
+        tasks = []
+        self.uploads += 1
+        try:
+            for part in range(part_count):
+                data = await self._read(stream, min(self.part_size, file_size - part * self.part_size))
+                if progress_callback:
+                    result = progress_callback(part * self.part_size + len(data), file_size)
+                    if inspect.isawaitable(result):
+                        await result
+                await slots.acquire()
+                # A failed part fails the whole upload, no point reading further
+                for task in tasks:
+                    if task.done() and task.exception():
+                        raise task.exception()
+                task = asyncio.ensure_future(self._save_part(file_id, part, part_count, data))
+                task.add_done_callback(lambda _: slots.release())
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return types.InputFileBig(id=file_id, parts=part_count, name=file_name)
+
+    async def _read(self, stream, size):
+        """Read exactly size bytes"""
+        data = b''
+        while len(data) < size:
+            chunk = stream.read(size - len(data))
+            if inspect.isawaitable(chunk):
+                chunk = await chunk
+            if not chunk:
+                raise ParallelTransferError("file ended before its announced size")
+            data += chunk
+        return data
+
+    async def _get_part(self, location, part):
+        request = GetFileRequest(location, offset=part * self.part_size, limit=self.part_size)
+        result = await self._invoke(request)
+        if not isinstance(result, types.upload.File):
+            raise ParallelTransferError(f"unexpected {result.__class__.__name__} for part {part}")
+        return result.bytes
+
+    async def _save_part(self, file_id, part, part_count, data):
+        if not await self._invoke(SaveBigFilePartRequest(file_id, part, part_count, data)):
+            raise ParallelTransferError(f"part {part} was not saved")
+        self.bytes_uploaded += len(data)
+
+    async def _invoke(self, request):
+        while True:
+            try:
+                return await self.client(request)
+            except FloodWaitError as e:
+                if e.seconds > self.max_flood_wait:
+                    raise
+                await asyncio.sleep(e.seconds)
+
+    def stats(self):
+        """Transfer counters for monitoring"""
+        return {
+            "workers": self.workers,
+            "downloads": self.downloads,
+            "uploads": self.uploads,
+            "fallbacks": self.fallbacks,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_uploaded": self.bytes_uploaded
+        }
@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import logging
+import time
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+logger = logging.getLogger(__name__)
+
+# Set while a send runs inside RateLimiter.call, its flood waits are the limiter's
+_limited_call = contextvars.ContextVar('limited_call', default=False)
+
+class RateLimitedClient(TelegramClient):
+    """
+    TelegramClient that never sleeps flood waits of rate limited sends
+    Those are raised to the RateLimiter, which pauses every sender of the
+    account. Every other request (downloads, history, entity lookups) keeps
+    Telethon's flood_sleep_threshold.
+    """
+    @property
+    def flood_sleep_threshold(self):
+        return 0 if _limited_call.get() else self._flood_sleep_threshold
+
+    @flood_sleep_threshold.setter
+    def flood_sleep_threshold(self, value):
+        TelegramClient.flood_sleep_threshold.fset(self, value)
+
+class ThrottledError(Exception):
+    """Raised instead of waiting when a flood wait is longer than the caller accepts"""
+    def __init__(self, seconds):
+        super().__init__(f"Rate limited for another {seconds:.0f} seconds")
+        self.seconds = seconds
+
+class TokenBucket:
+    """
+    Token bucket with an adaptive rate and a hard pause
+    The rate is halved on every flood wait and grows back slowly with each
+    successful send (AIMD), so it settles just under what Telegram allows
+    """
+    def __init__(self, name, rate, burst, min_rate=None, max_rate=None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate or rate / 20
+        self.max_rate = max_rate or rate * 4
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # Created on first use so it belongs to the running loop
+        self._lock = None
+
+    def pause_remaining(self):
+        """Seconds left before sending is allowed again after a flood wait"""
+        return max(0.0, self.paused_until - time.monotonic())
+
+    def wait_estimate(self, amount=1):
+        """Seconds before amount tokens, taken one at a time, are handed out, without taking any"""
+        tokens = min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+        return self.pause_remaining() + max(0.0, amount - tokens) / self.rate
+
+    async def acquire(self, amount=1):
+        """
+        Wait for amount tokens, returns the seconds spent waiting
+        An amount larger than the burst is let through once the bucket is
+        full and leaves it in debt, so later callers wait for it to refill
+        """
+        started = time.monotonic()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                delay = self.paused_until - now
+                needed = min(amount, self.burst)
+                if delay <= 0:
+                    if self.tokens >= needed:
+                        self.tokens -= amount
+                        return time.monotonic() - started
+                    delay = (needed - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for exactly seconds and slow down afterwards"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning(f"Send rate for {self.name} paused for {seconds}s, rate lowered to {self.rate:.2f}/s")
+
+    def reward(self):
+        """Slowly raise the rate after a successful send"""
+        self.rate = min(self.max_rate, self.rate + self.min_rate / 10)
+
+class RateLimiter:
+    """
+    Rate limiter shared by every send of the account
+    Each send takes a token from the account bucket and from the bucket of its
+    destination. A FloodWaitError pauses the whole account for exactly the time
+    Telegram asked for, a SlowModeWaitError only pauses that destination.
+    """
+    def __init__(self, account_rate=5.0, account_burst=20, destination_rate=1.0, destination_burst=10,
+                 max_wait=300, max_tries=5):
+        """
+        Rates are sends per second, max_wait is the longest flood wait a send
+        is held back for before ThrottledError is raised instead
+        """
+        self.destination_rate = destination_rate
+        self.destination_burst = destination_burst
+        self.max_wait = max_wait
+        self.max_tries = max_tries
+        self.account = TokenBucket('account', account_rate, account_burst)
+        self._destinations = {}
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.throttled_seconds = 0.0
+        self.sends = 0
+
+    def _bucket(self, destination):
+        bucket = self._destinations.get(destination)
+        if bucket is None:
+            bucket = self._destinations[destination] = TokenBucket(
+                str(destination), self.destination_rate, self.destination_burst
+            )
+        return bucket
+
+    def wait_estimate(self, destination, queued=0):
+        """Seconds before a send to destination could go out, behind queued sends of the account"""
+        return max(self.account.wait_estimate(queued + 1), self._bucket(destination).wait_estimate())
+
+    async def call(self, destination, func, *args, max_wait=None, **kwargs):
+        """
+        Run a send coroutine function once the rate allows it, retrying flood waits
+        max_wait, if given, replaces the limiter's own for this call
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        bucket = self._bucket(destination)
+        for attempt in range(1, self.max_tries + 1):
+            remaining = max(self.account.pause_remaining(), bucket.pause_remaining())
+            if remaining > max_wait:
+                raise ThrottledError(remaining)
+
+            self.throttled_seconds += await self.account.acquire()
+            self.throttled_seconds += await bucket.acquire()
+            token = _limited_call.set(True)
+            try:
+                result = await func(*args, **kwargs)
+            except SlowModeWaitError as e:
+                self._record_flood_wait(e.seconds)
+                bucket.pause(e.seconds)
+                if attempt == self.max_tries:
+                    raise
+                continue
+            except FloodWaitError as e:
+                self._record_flood_wait(e.seconds)
+                self.account.pause(e.seconds)
+                bucket.pause(e.seconds)
+                if attempt == self.max_tries:
+                    raise
+                continue
+            finally:
+                _limited_call.reset(token)
+
+            self.sends += 1
+            self.account.reward()
+            bucket.reward()
+            return result
+
+    def _record_flood_wait(self, seconds):
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+
+    def stats(self):
+        """Flood wait totals, time spent throttled and current rates"""
+        return {
+            "sends": self.sends,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "account_rate": round(self.account.rate, 3),
+            "account_paused_for": round(self.account.pause_remaining(), 1),
+            "destination_rates": {
+                name: round(bucket.rate, 3) for name, bucket in self._destinations.items()
+            }
+        }
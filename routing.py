@@ -0,0 +1,126 @@
+import json
+import logging
+from telethon import utils
+
+logger = logging.getLogger(__name__)
+
+def validate_channel_id(channel_id):
+    """Validate and format channel ID"""
+    if isinstance(channel_id, str):
+        # If it's a username starting with @, return as is
+        if channel_id.startswith('@'):
+            return channel_id
+
+        try:
+            channel_id = int(channel_id)
+        except ValueError:
+            return channel_id
+
+    # For bare numeric IDs, add the -100 prefix used for supergroups/channels,
+    # negative IDs are already marked and are kept as they are
+    if isinstance(channel_id, int) and channel_id > 0:
+        return int(f"-100{channel_id}")
+
+    return channel_id
+
+def parse_chat(chat):
+    """Turn a configured source into a username or a numeric ID"""
+    if isinstance(chat, str) and chat.lstrip('-').isdigit():
+        return int(chat)
+    return chat
+
+class Route:
+    """One source -> destination pair with its formatting options"""
+    def __init__(self, source, destination, include_sender=None, mark_edits=True):
+        """
+        include_sender adds the "From: ..." header, None keeps the default of
+        adding it for group and channel sources
+        mark_edits adds "[Edited at ...]" to re-posted edits
+        """
+        self.source = parse_chat(source)
+        self.destination = validate_channel_id(destination)
+        self.include_sender = include_sender
+        self.mark_edits = mark_edits
+        self.source_id = None
+
+    @property
+    def key(self):
+        """Destination as stored in the database queue"""
+        return str(self.destination)
+
+    def __repr__(self):
+        return f"Route({self.source} -> {self.destination})"
+
+def load_routes(routes_file=None, routes_json=None, source=None, destination=None):
+    """
+    Load routes from a JSON file or string, falling back to a single
+    source -> destination route. The JSON is a list of objects like
+    {"source": "@news", "destinations": ["@mirror", "-1001234"], "include_sender": false}
+    """
+    config = None
+    if routes_file:
+        with open(routes_file) as f:
+            config = json.load(f)
+    elif routes_json:
+        config = json.loads(routes_json)
+
+    if config is None:
+        if source and destination:
+            return [Route(source, destination)]
+        return []
+
+    routes = []
+    for entry in config:
+        destinations = entry.get('destinations') or [entry['destination']]
+        for entry_destination in destinations:
+            routes.append(Route(
+                entry['source'],
+                entry_destination,
+                include_sender=entry.get('include_sender'),
+                mark_edits=entry.get('mark_edits', True)
+            ))
+    return routes
+
+class RoutingTable:
+    """
+    Routes compiled into a chat_id -> [route] index
+    Sources are resolved once by compile(), after that finding the routes of
+    an incoming message is a single dict lookup
+    """
+    def __init__(self, routes):
+        self.routes = routes
+        self._by_chat = {}
+
+    @property
+    def destinations(self):
+        """Distinct destinations of all routes"""
+        return list(dict.fromkeys(route.destination for route in self.routes))
+
+    @property
+    def sources(self):
+        """Resolved chat ids of all sources, empty before compile()"""
+        return list(self._by_chat)
+
+    async def compile(self, resolve):
+        """Resolve every source with the resolve coroutine function and build the index"""
+        by_chat = {}
+        for route in self.routes:
+            try:
+                route.source_id = utils.get_peer_id(await resolve(route.source))
+            except Exception as e:
+                logger.error(f"Could not resolve source {route.source}, skipping {route}: {str(e)}")
+                continue
+            by_chat.setdefault(route.source_id, []).append(route)
+        self._by_chat = by_chat
+        logger.info(f"Routing {len(by_chat)} sources to {len(self.destinations)} destinations")
+
+    def routes_for(self, chat_id):
+        """Routes of a source chat, empty if the chat isn't a source"""
+        return self._by_chat.get(chat_id, ())
+
+    def find(self, chat_id, destination):
+        """The route from chat_id to destination (as stored by Route.key)"""
+        for route in self.routes_for(chat_id):
+            if route.key == destination:
+                return route
+        return None
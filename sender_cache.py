@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import logging
+import time
+from telethon import types, utils
+
+logger = logging.getLogger(__name__)
+
+# How long a sender that couldn't be resolved is not looked up again (seconds)
+RESOLVE_RETRY_INTERVAL = 300
+
+UNKNOWN_SENDER = "Unknown Sender"
+
+def display_name(first_name=None, last_name=None, username=None):
+    """Sender header text: first and last name, then the @username"""
+    name = first_name or ''
+    if last_name:
+        name += f" {last_name}"
+    if username:
+        name += f" (@{username})"
+    return name
+
+def entity_display_name(entity):
+    """Display name of a user, or of a channel posting as itself"""
+    if isinstance(entity, types.User):
+        return display_name(entity.first_name, entity.last_name, entity.username or _active_username(entity.usernames))
+    return display_name(getattr(entity, 'title', None), None, getattr(entity, 'username', None))
+
+def _active_username(usernames):
+    for username in usernames or ():
+        if username.active:
+            return username.username
+    return None
+
+class SenderCache:
+    """
+    Display names of recent senders, keyed by peer id
+    Filled from the sender that comes with every source message, refreshed
+    from the users attached to any update and from name changes, so a
+    message whose sender Telethon didn't attach still gets the right header
+    without a network round trip. Unknown senders are resolved in the
+    background for their next message.
+    """
+    def __init__(self, max_size=5000, resolve=None):
+        """resolve(peer_id) is a coroutine function returning the entity of a sender"""
+        self.max_size = max_size
+        self.resolve = resolve
+        self._names = collections.OrderedDict()
+        self._resolving = set()
+        self._tasks = set()
+        self._failed = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    def put(self, entity):
+        """Remember the display name of a sender entity"""
+        try:
+            self._store(utils.get_peer_id(entity), entity_display_name(entity))
+        except Exception as e:
+            logger.error(f"Error caching sender: {str(e)}")
+
+    def refresh(self, update):
+        """Update cached senders from the entities attached to a raw update"""
+        if isinstance(update, types.UpdateUserName):
+            if update.user_id in self._names:
+                self._store(update.user_id, display_name(
+                    update.first_name, update.last_name, _active_username(update.usernames)
+                ))
+            return
+        entities = getattr(update, '_entities', None)
+        if not entities:
+            return
+        for peer_id, entity in entities.items():
+            # Only senders already known, other chats' users would push them out
+            if peer_id in self._names and isinstance(entity, types.User) and not entity.min:
+                self._store(peer_id, entity_display_name(entity))
+
+    def name_for(self, message):
+        """Display name of the sender of a message, never waits on the network"""
+        sender = message.sender
+        if sender is not None:
+            self.put(sender)
+        sender_id = message.sender_id
+        name = self._names.get(sender_id)
+        if name is not None:
+            self.hits += 1
+            self._names.move_to_end(sender_id)
+            return name
+        self.misses += 1
+        if sender_id is not None:
+            self._resolve_later(sender_id)
+        return UNKNOWN_SENDER
+
+    def _store(self, peer_id, name):
+        previous = self._names.get(peer_id)
+        if previous is not None and previous != name:
+            self.refreshes += 1
+        self._names[peer_id] = name
+        self._names.move_to_end(peer_id)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+            self.evictions += 1
+
+    def _resolve_later(self, sender_id):
+        if self.resolve is None or sender_id in self._resolving:
+            return
+        failed_at = self._failed.get(sender_id)
+        if failed_at is not None and time.monotonic() - failed_at < RESOLVE_RETRY_INTERVAL:
+            return
+        self._resolving.add(sender_id)
+        # The loop only keeps weak references to tasks
+        task = asyncio.ensure_future(self._resolve(sender_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, sender_id):
+        try:
+            self.put(await self.resolve(sender_id))
+            self._failed.pop(sender_id, None)
+        except Exception as e:
+            logger.warning(f"Could not resolve sender {sender_id}: {str(e)}")
+            if len(self._failed) >= self.max_size:
+                self._failed.clear()
+            self._failed[sender_id] = time.monotonic()
+        finally:
+            self._resolving.discard(sender_id)
+
+    def stats(self):
+        """Cache size, hit ratio and evictions for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._names),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "resolving": len(self._resolving),
+            "hit_ratio": round(self.hits / total, 3) if total else None
+        }
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import signal
+from datetime import datetime
+from aiohttp import web
+import telegram_forwarder
+import metrics
+from health import UNHEALTHY
+
+logger = logging.getLogger(__name__)
+
+# How long a stopping bot gets to flush its lanes before it is cancelled (seconds)
+STOP_TIMEOUT = 60
+
+class BotRunner:
+    """Runs the forwarder as a task on the server's own event loop"""
+    def __init__(self):
+        self.task = None
+        self.error = None
+        self.start_time = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    @property
+    def stopping(self):
+        return self.running and not telegram_forwarder.is_running
+
+    def start(self):
+        """Start the bot, returns False if it is already running"""
+        if self.running:
+            return False
+        telegram_forwarder.is_running = True
+        self.error = None
+        self.start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.task = asyncio.create_task(self._run())
+        return True
+
+    def stop(self):
+        """Ask the bot to shut down, returns False if it isn't running"""
+        if not self.running or self.stopping:
+            return False
+        telegram_forwarder.is_running = False
+        return True
+
+    async def wait(self, timeout=STOP_TIMEOUT):
+        """Wait for the bot to shut down, cancelling it after timeout seconds"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Bot didn't stop within {timeout}s, cancelling it")
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self):
+        logger.info("Starting telegram_forwarder.main()")
+        try:
+            await telegram_forwarder.main()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Bot error: {e}")
+        finally:
+            logger.info("Bot stopped")
+
+def create_app(bot):
+    """The status endpoints, served from the loop the bot runs on"""
+    routes = web.RouteTableDef()
+
+    async def health_report():
+        state, checks = telegram_forwarder.check_health(await telegram_forwarder.db.get_queue_stats(), bot.running)
+        if bot.error:
+            checks["bot"]["error"] = bot.error
+        return state, checks
+
+    @routes.get('/')
+    async def home(request):
+        """Bot status and overall health"""
+        try:
+            state, _ = await health_report()
+            return web.json_response({
+                "status": "stopping" if bot.stopping else "active" if bot.running else "inactive",
+                "error": bot.error,
+                "start_time": bot.start_time,
+                "service": "Telegram Forwarder",
+                "health": state
+            })
+        except Exception as e:
+            logger.error(f"Error in home route: {e}")
+            return web.json_response({"error": str(e)}, status=500)
+
+    @routes.get('/health')
+    async def health(request):
+        """Health from loop lag, connection state and queue age, 503 when unhealthy"""
+        try:
+            state, checks = await health_report()
+            return web.json_response(
+                {"status": state, "checks": checks},
+                status=503 if state == UNHEALTHY else 200
+            )
+        except Exception as e:
+            logger.error(f"Error in health check: {e}")
+            return web.json_response({"status": UNHEALTHY, "error": str(e)}, status=503)
+
+    @routes.get('/stats')
+    async def stats(request):
+        """Live stats of every component"""
+        try:
+            return web.json_response(telegram_forwarder.collect_stats())
+        except Exception as e:
+            logger.error(f"Error collecting stats: {e}")
+            return web.json_response({"error": str(e)}, status=500)
+
+    @routes.get('/metrics')
+    async def prometheus_metrics(request):
+        """Metrics in the Prometheus text format"""
+        try:
+            # Queue gauges wait on the database writer thread, not on this loop
+            text = await asyncio.get_running_loop().run_in_executor(None, metrics.REGISTRY.render)
+            return web.Response(body=text.encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+        except Exception as e:
+            logger.error(f"Error rendering metrics: {e}")
+            return web.json_response({"error": str(e)}, status=500)
+
+    @routes.get('/start')
+    async def start(request):
+        """Start the bot if it's not running"""
+        if bot.stopping:
+            return web.json_response({"status": "stopping"})
+        if bot.start():
+            return web.json_response({"status": "started"})
+        return web.json_response({"status": "already running"})
+
+    @routes.get('/stop')
+    async def stop(request):
+        """Stop the bot if it's running"""
+        if bot.stop():
+            return web.json_response({"status": "stopping"})
+        return web.json_response({"status": "stopping" if bot.stopping else "not running"})
+
+    app = web.Application()
+    app.add_routes(routes)
+    return app
+
+async def serve(port):
+    """Serve the status endpoints and run the bot until SIGTERM/SIGINT"""
+    bot = BotRunner()
+    runner = web.AppRunner(create_app(bot))
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', port)
+    await site.start()
+    logger.info(f"Status server listening on port {port}")
+
+    shutdown = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, shutdown.set)
+
+    bot.start()
+    try:
+        await shutdown.wait()
+    finally:
+        logger.info("Received shutdown signal")
+        bot.stop()
+        await bot.wait()
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    asyncio.run(serve(int(os.environ.get('PORT', 10000))))
@@ -1,40 +1,219 @@
 import os
 import logging
 import asyncio
-from telethon import TelegramClient, events, types
-from telethon.errors import FloodWaitError
+from telethon import events, types, utils
+from telethon.errors import (
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    FileReferenceEmptyError,
+    ChatForwardsRestrictedError,
+    MediaEmptyError,
+    MessageNotModifiedError,
+    MessageIdInvalidError,
+    MessageEditTimeExpiredError,
+    MessageAuthorRequiredError,
+    FloodWaitError,
+    SlowModeWaitError,
+)
 from telethon.sessions import StringSession
 from dotenv import load_dotenv
 from database import Database
+from media_stream import ChunkPipe
+from media_cache import MediaCache
+from parallel_transfer import ParallelTransfer
+from connectivity import OFFLINE, ONLINE, ConnectivityMonitor
+from entity_cache import EntityCache
+from dedupe import DedupeCache, album_fingerprint
+from message_map import MessageMap, get_media_id, get_sent_id
+from sender_cache import SenderCache
+from albums import AlbumAggregator
+from backfill import Backfill, CheckpointTracker
+from edits import EditDebouncer
+from dispatcher import Dispatcher
+from rate_limiter import RateLimitedClient, RateLimiter, ThrottledError, TokenBucket
+from accounts import Account, AccountPool, NoAccountError
+from routing import RoutingTable, load_routes, validate_channel_id
+from metrics import MESSAGES, REGISTRY, STAGE_SECONDS
+from log_setup import setup_logging, sampling_stats
+from health import DEGRADED, HEALTHY, STARTING, UNHEALTHY, LoopLagMonitor, evaluate
 import aiohttp
-import backoff
 from datetime import datetime
 import signal
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # Only log to stdout for Render
-    ]
-)
-logger = logging.getLogger(__name__)
+import time
 
 # Load environment variables
 load_dotenv()
 
+setup_logging()
+logger = logging.getLogger(__name__)
+
 API_ID = os.getenv('TELEGRAM_API_ID')
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 SOURCE = os.getenv('SOURCE')
 DESTINATION_CHANNEL = os.getenv('DESTINATION_CHANNEL')
 SESSION_STRING = os.getenv('TELEGRAM_SESSION_STRING')
 
+# Extra accounts, comma-separated session strings, that share the sends with
+# the TELEGRAM_SESSION_STRING account (which alone listens for updates). A send
+# moves to another account instead of waiting more than ACCOUNT_FAILOVER_WAIT
+# seconds for a flood wait.
+SENDER_SESSION_STRINGS = [session.strip() for session in os.getenv('SENDER_SESSION_STRINGS', '').split(',') if session.strip()]
+ACCOUNT_FAILOVER_WAIT = float(os.getenv('ACCOUNT_FAILOVER_WAIT', '5'))
+
+# Many sources to many destinations, as a JSON file or inline JSON, replaces
+# SOURCE/DESTINATION_CHANNEL when set
+ROUTES_FILE = os.getenv('ROUTES_FILE')
+ROUTES = os.getenv('ROUTES')
+
+# How long a resolved destination/source entity is reused before resolving it
+# again (0 means until using it fails), entities that fail are resolved again
+# right away
+ENTITY_CACHE_TTL = int(os.getenv('ENTITY_CACHE_TTL', '604800'))
+
+# Display names of this many recent group message senders are kept in memory
+SENDER_CACHE_SIZE = int(os.getenv('SENDER_CACHE_SIZE', '5000'))
+
+# Content already sent to a destination within this many seconds is not sent
+# again (0 disables), and how many fingerprints are kept in memory
+DEDUPE_WINDOW = int(os.getenv('DEDUPE_WINDOW', '3600'))
+DEDUPE_CACHE_SIZE = int(os.getenv('DEDUPE_CACHE_SIZE', '10000'))
+# Messages without media are only skipped when the same source message is
+# delivered again, with DEDUPE_TEXT also when the same text was sent within
+# DEDUPE_TEXT_WINDOW seconds
+DEDUPE_TEXT = os.getenv('DEDUPE_TEXT', 'false').lower() not in ('0', 'false', 'no')
+DEDUPE_TEXT_WINDOW = int(os.getenv('DEDUPE_TEXT_WINDOW', '300'))
+
+# Album items are collected until none arrived for this long (seconds)...
+ALBUM_QUIET_PERIOD = float(os.getenv('ALBUM_QUIET_PERIOD', '0.5'))
+# ...but never for longer than this after the first item
+ALBUM_MAX_WAIT = float(os.getenv('ALBUM_MAX_WAIT', '3'))
+
+# Edits are applied to the copies already sent instead of posting a new copy,
+# and deletes in the source delete the copies too. Mappings are kept this long.
+EDIT_IN_PLACE = os.getenv('EDIT_IN_PLACE', 'true').lower() not in ('0', 'false', 'no')
+PROPAGATE_DELETES = os.getenv('PROPAGATE_DELETES', 'true').lower() not in ('0', 'false', 'no')
+MESSAGE_MAP_RETENTION_DAYS = int(os.getenv('MESSAGE_MAP_RETENTION_DAYS', '30'))
+
+# Edits of a message are coalesced until none arrived for this long (seconds),
+# 0 forwards every edit, but never held back longer than EDIT_MAX_WAIT
+EDIT_QUIET_PERIOD = float(os.getenv('EDIT_QUIET_PERIOD', '10'))
+EDIT_MAX_WAIT = float(os.getenv('EDIT_MAX_WAIT', '60'))
+
+# On startup, messages posted since the last one handled before shutdown are
+# forwarded, with at most BACKFILL_CONCURRENCY messages/albums in flight.
+# BACKFILL_LIMIT caps how many of the latest messages of a gap are caught up on (0 means no cap).
+BACKFILL = os.getenv('BACKFILL', 'true').lower() not in ('0', 'false', 'no')
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', '8'))
+BACKFILL_LIMIT = int(os.getenv('BACKFILL_LIMIT', '0'))
+
+# Number of concurrent forwarding workers and how many messages may wait for
+# them before new ones are put in the database queue instead
+FORWARD_WORKERS = int(os.getenv('FORWARD_WORKERS', '4'))
+FORWARD_QUEUE_SIZE = int(os.getenv('FORWARD_QUEUE_SIZE', '1000'))
+
+# Videos and documents of at least BULK_LANE_THRESHOLD_MB go through a separate
+# bulk lane with its own workers, so they never hold text and photos back.
+# Bytes it downloads/uploads are limited to BULK_LANE_BANDWIDTH_MB per second
+# (0 means no limit).
+BULK_LANE_WORKERS = int(os.getenv('BULK_LANE_WORKERS', '2'))
+BULK_LANE_THRESHOLD = int(float(os.getenv('BULK_LANE_THRESHOLD_MB', '10')) * 1024 * 1024)
+BULK_LANE_BANDWIDTH = int(float(os.getenv('BULK_LANE_BANDWIDTH_MB', '0')) * 1024 * 1024)
+
+# Starting send rates (sends per second) for the whole account and for each
+# destination, both are adjusted after flood waits
+ACCOUNT_SEND_RATE = float(os.getenv('ACCOUNT_SEND_RATE', '5'))
+DESTINATION_SEND_RATE = float(os.getenv('DESTINATION_SEND_RATE', '1'))
+# Flood waits longer than this (seconds) send the message to the queue instead,
+# where it waits for the flood wait to end without using up a retry
+FLOOD_MAX_WAIT = int(os.getenv('FLOOD_MAX_WAIT', '300'))
+
+# Health turns unhealthy when the event loop runs timers more than
+# HEALTH_MAX_LOOP_LAG seconds late or the network has been unreachable for
+# HEALTH_MAX_OFFLINE seconds, and degraded when the oldest queued message is
+# older than HEALTH_MAX_QUEUE_AGE seconds
+HEALTH_MAX_LOOP_LAG = float(os.getenv('HEALTH_MAX_LOOP_LAG', '2'))
+HEALTH_MAX_OFFLINE = float(os.getenv('HEALTH_MAX_OFFLINE', '300'))
+HEALTH_MAX_QUEUE_AGE = float(os.getenv('HEALTH_MAX_QUEUE_AGE', '900'))
+
+# Queue processor batch size bounds, idle wake-up and old row cleanup (seconds)
+QUEUE_MIN_BATCH = 10
+QUEUE_MAX_BATCH = 100
+QUEUE_IDLE_TIMEOUT = 3600
+QUEUE_CLEANUP_INTERVAL = 3600
+# Claimed rows are leased for this long and renewed every third of it while
+# their batch is processed, so another consumer never claims them meanwhile (seconds)
+QUEUE_LEASE_SECONDS = 300
+# Sends that failed because no account could send are queued again after this long (seconds)
+NO_ACCOUNT_RETRY_DELAY = 60
+# Telegram returns at most this many messages per get_messages call
+FETCH_BATCH_SIZE = 100
+
+# Re-send photos/documents by file reference instead of download + re-upload
+MEDIA_RELAY = os.getenv('MEDIA_RELAY', 'true').lower() not in ('0', 'false', 'no')
+
+# Stream media that must be re-uploaded instead of downloading it to disk first
+MEDIA_STREAMING = os.getenv('MEDIA_STREAMING', 'true').lower() not in ('0', 'false', 'no')
+# Files at least this large are streamed, smaller ones are buffered on disk
+MEDIA_STREAM_THRESHOLD = int(float(os.getenv('MEDIA_STREAM_THRESHOLD_MB', '20')) * 1024 * 1024)
+# Download request size and in-memory buffer bound for streamed media
+MEDIA_STREAM_CHUNK_SIZE = 512 * 1024
+MEDIA_STREAM_BUFFER_CHUNKS = max(1, int(float(os.getenv('MEDIA_STREAM_BUFFER_MB', '8')) * 1024 * 1024) // MEDIA_STREAM_CHUNK_SIZE)
+
+# Documents of at least PARALLEL_TRANSFER_THRESHOLD_MB are downloaded and
+# uploaded as PARALLEL_TRANSFER_WORKERS parts at a time
+PARALLEL_TRANSFERS = os.getenv('PARALLEL_TRANSFERS', 'true').lower() not in ('0', 'false', 'no')
+PARALLEL_TRANSFER_THRESHOLD = int(float(os.getenv('PARALLEL_TRANSFER_THRESHOLD_MB', '20')) * 1024 * 1024)
+PARALLEL_TRANSFER_WORKERS = int(os.getenv('PARALLEL_TRANSFER_WORKERS', '4'))
+
+# Byte budget of downloaded media kept on disk for retries and fan-out
+MEDIA_CACHE_SIZE = int(float(os.getenv('MEDIA_CACHE_MB', '512')) * 1024 * 1024)
+
+# Media strategies
+MEDIA_RELAY_STRATEGY = 'relay'
+MEDIA_DOWNLOAD_STRATEGY = 'download'
+MEDIA_STREAM_STRATEGY = 'stream'
+
+# Errors meaning the media can't be re-sent by reference and must be downloaded
+RELAY_FALLBACK_ERRORS = (
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    FileReferenceEmptyError,
+    ChatForwardsRestrictedError,
+    MediaEmptyError,
+)
+
 # Initialize client with string session
-client = TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH)
+# Flood waits of sends are never slept inside Telethon, the rate limiter
+# handles them for every sender at once
+client = RateLimitedClient(StringSession(SESSION_STRING), API_ID, API_HASH)
 db = Database()
+entity_cache = EntityCache(db, ttl=ENTITY_CACHE_TTL)
+dedupe_cache = DedupeCache(
+    db, window=DEDUPE_WINDOW, max_size=DEDUPE_CACHE_SIZE, text_window=DEDUPE_TEXT_WINDOW if DEDUPE_TEXT else 0
+)
+message_map = MessageMap(db, retention_days=MESSAGE_MAP_RETENTION_DAYS)
+routing = RoutingTable(load_routes(ROUTES_FILE, ROUTES, SOURCE, DESTINATION_CHANNEL))
+checkpoints = CheckpointTracker(db)
+# Sender headers never wait on the network, unknown senders are resolved in the background
+sender_cache = SenderCache(max_size=SENDER_CACHE_SIZE, resolve=lambda peer_id: client.get_entity(peer_id))
 
 # Flag for graceful shutdown
 is_running = True
+# When main() finished starting up, None while the bot isn't running
+started_at = None
+loop_lag = LoopLagMonitor()
+
+# Set by the queue processor, wakes it up when something is queued
+queue_wakeup = None
+# Drain rate and backlog of the queue processor, for the status page
+queue_status = {
+    "processed": 0,
+    "fetch_calls": 0,
+    "drain_rate": 0,
+    "batch_size": QUEUE_MIN_BATCH,
+    "backlog": None,
+    "oldest_age": None
+}
 
 def signal_handler(signum, frame):
     """Handle shutdown signals"""
@@ -46,37 +225,63 @@ def signal_handler(signum, frame):
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
-def validate_channel_id(channel_id):
-    """Validate and format channel ID"""
-    if isinstance(channel_id, str):
-        # If it's a username starting with @, return as is
-        if channel_id.startswith('@'):
-            return channel_id
-        
-        # Remove any existing -100 prefix
-        if channel_id.startswith('-100'):
-            channel_id = channel_id[4:]
-        
-        try:
-            channel_id = int(channel_id)
-        except ValueError:
-            return channel_id
-    
-    # For numeric IDs, ensure they have the -100 prefix for supergroups/channels
-    if isinstance(channel_id, int):
-        return -100 + abs(channel_id)  # Ensure proper format for channels
-    
-    return channel_id
-
 async def check_internet_connection():
     """Check if we have internet connection"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://1.1.1.1', timeout=5) as response:
-                return response.status == 200
+        with STAGE_SECONDS.time('connectivity'):
+            async with aiohttp.ClientSession() as session:
+                async with session.get('https://1.1.1.1', timeout=5) as response:
+                    return response.status == 200
     except:
         return False
 
+# Shared connectivity state, probed in the background only while not online
+connectivity = ConnectivityMonitor(probe=check_internet_connection)
+
+def new_rate_limiter():
+    """Rate limiter of one account, every send of the account goes through it"""
+    return RateLimiter(
+        account_rate=ACCOUNT_SEND_RATE,
+        destination_rate=DESTINATION_SEND_RATE,
+        max_wait=FLOOD_MAX_WAIT
+    )
+
+rate_limiter = new_rate_limiter()
+# Sends are spread over the listening account and the extra sending accounts
+accounts = AccountPool(Account(client, rate_limiter), failover_wait=ACCOUNT_FAILOVER_WAIT)
+for sender_session in SENDER_SESSION_STRINGS:
+    accounts.add(Account(
+        RateLimitedClient(StringSession(sender_session), API_ID, API_HASH),
+        new_rate_limiter()
+    ))
+
+async def send_message(entity, **kwargs):
+    """Send a message from the account of the pool that can send it soonest"""
+    with STAGE_SECONDS.time('send'):
+        return await accounts.call(entity, 'send_message', **kwargs)
+
+async def send_file(entity, account=None, failover=False, **kwargs):
+    """
+    Send a file from the account of the pool that can send it soonest
+    Media sent by reference must be pinned to the account that owns the
+    reference, access hashes and file references are only valid for it.
+    With failover, ThrottledError is raised when that account can't send
+    within ACCOUNT_FAILOVER_WAIT but another one could.
+    """
+    if account is None and isinstance(kwargs.get('file'), (types.InputFile, types.InputFileBig)):
+        # Uploaded parts belong to the account that uploaded them, the listener
+        account = accounts.listener
+    with STAGE_SECONDS.time('send'):
+        return await accounts.call(entity, 'send_file', account=account, failover=failover, **kwargs)
+
+async def edit_message(entity, account, **kwargs):
+    """Edit a sent message, only the account that sent it can"""
+    return await accounts.call(entity, 'edit_message', account=account, **kwargs)
+
+async def delete_messages(entity, message_ids, account):
+    """Delete sent messages, from the account that sent them"""
+    return await accounts.call(entity, 'delete_messages', message_ids, account=account)
+
 def get_temp_dir():
     """Get the appropriate temp directory based on environment"""
     if os.environ.get('RENDER'):
@@ -85,64 +290,264 @@ def get_temp_dir():
     # Use local temp directory
     return os.path.join(os.getcwd(), 'temp')
 
+# Large files are transferred as parallel parts, falling back to Telethon's single stream
+parallel_transfer = ParallelTransfer(client, workers=PARALLEL_TRANSFER_WORKERS)
+
+def use_parallel_transfer(message):
+    """Whether the media of a message is large enough for parallel transfers"""
+    return (
+        PARALLEL_TRANSFERS
+        and isinstance(message.media, types.MessageMediaDocument)
+        and get_media_size(message) >= PARALLEL_TRANSFER_THRESHOLD
+    )
+
+def bulk_pacer(message):
+    """
+    Progress callback holding the transfer of bulk media back chunk by chunk,
+    so the bulk lane stays within BULK_LANE_BANDWIDTH whether the message is
+    forwarded live, from the queue or by the catch-up
+    None if the media of the message isn't limited
+    """
+    if bulk_bandwidth is None or not is_bulk(message):
+        return None
+    return byte_pacer()
+
+def album_pacer(messages):
+    """
+    Progress callback holding the upload of an album on the bulk lane back
+    Telethon reports the progress of an album in files, it is turned into
+    bytes from the sizes of the items
+    """
+    if bulk_bandwidth is None or lane_for(messages) is not bulk_dispatcher:
+        return None
+    sizes = [get_media_size(message) for message in messages]
+    pace = byte_pacer()
+
+    def progress(files, total):
+        index = min(int(files), len(sizes))
+        sent = sum(sizes[:index])
+        if index < len(sizes):
+            sent += sizes[index] * (files - index)
+        return pace(int(sent), sum(sizes))
+    return progress
+
+def byte_pacer():
+    """Progress callback taking bulk_bandwidth for the bytes transferred since its last call"""
+    done = 0
+
+    async def pace(current, total):
+        nonlocal done
+        if current < done:
+            # The transfer is being tried again from the start
+            done = 0
+        waited = await bulk_bandwidth.acquire(current - done)
+        done = current
+        if waited > 1:
+            logger.info("Bulk lane waited %.1fs for bandwidth", waited)
+    return pace
+
+async def download_media(message, path):
+    """Download the media of a message to path"""
+    pace = bulk_pacer(message)
+    if use_parallel_transfer(message):
+        try:
+            return await parallel_transfer.download(message.media, get_media_size(message), path, pace)
+        except Exception as e:
+            parallel_transfer.fallbacks += 1
+            logger.warning(f"Parallel download of message {message.id} failed ({str(e)}), using a single stream")
+    return await message.download_media(path, progress_callback=pace)
+
+async def upload_media(message, media_path):
+    """
+    send_file arguments for downloaded media, large documents are uploaded in
+    parallel parts first. Bulk media is uploaded within BULK_LANE_BANDWIDTH.
+    """
+    pace = bulk_pacer(message)
+    if use_parallel_transfer(message):
+        try:
+            with open(media_path, 'rb') as f, STAGE_SECONDS.time('upload'):
+                uploaded = await parallel_transfer.upload(
+                    f, os.path.getsize(media_path), os.path.basename(media_path), pace
+                )
+            return {
+                "file": uploaded,
+                "attributes": message.media.document.attributes,
+                "mime_type": message.file.mime_type
+            }
+        except Exception as e:
+            parallel_transfer.fallbacks += 1
+            logger.warning(f"Parallel upload of message {message.id} failed ({str(e)}), using a single stream")
+    return {"file": media_path, "progress_callback": pace}
+
+# Downloaded media is shared by retries, edits and every destination
+media_cache = MediaCache(
+    os.path.join(get_temp_dir(), 'media_cache'), max_bytes=MEDIA_CACHE_SIZE, download=download_media
+)
+
 async def handle_media(message):
     """
     Handle media files in messages
-    Returns the path to downloaded media file or None if no media
+    Returns the path to downloaded media file or None if no media, the path
+    must be handed back to cleanup_media()
     """
     if not message.media:
         return None
     
     try:
-        temp_dir = get_temp_dir()
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Add file extension to help with media type recognition
-        file_extension = ''
-        if isinstance(message.media, types.MessageMediaPhoto):
-            file_extension = '.jpg'
-        elif isinstance(message.media, types.MessageMediaDocument):
-            # Try to get extension from mime type or file name
-            if message.file and message.file.name:
-                file_extension = os.path.splitext(message.file.name)[1]
-            elif message.media.document.mime_type:
-                if 'image/webp' in message.media.document.mime_type:
-                    file_extension = '.webp'
-                elif 'image/jpeg' in message.media.document.mime_type:
-                    file_extension = '.jpg'
-                elif 'video' in message.media.document.mime_type:
-                    file_extension = '.mp4'
-                elif 'audio' in message.media.document.mime_type:
-                    file_extension = '.m4a'
-                elif 'application/x-tgsticker' in message.media.document.mime_type:
-                    file_extension = '.tgs'
-        elif isinstance(message.media, types.MessageMediaWebPage):
-            # For web pages with preview media
-            if message.media.webpage.photo:
-                file_extension = '.jpg'
-            elif message.media.webpage.document:
-                if 'video' in message.media.webpage.document.mime_type:
-                    file_extension = '.mp4'
-                elif 'audio' in message.media.webpage.document.mime_type:
-                    file_extension = '.m4a'
-        
-        temp_file = os.path.join(temp_dir, f'media_{message.id}{file_extension}')
-        await message.download_media(temp_file)
-        logger.info(f"Media downloaded successfully: {temp_file}")
-        return temp_file
-    
+        with STAGE_SECONDS.time('download'):
+            return await media_cache.acquire(message)
     except Exception as e:
         logger.error(f"Error downloading media: {str(e)}")
         return None
 
 async def cleanup_media(file_path):
-    """Clean up downloaded media files"""
-    if file_path and os.path.exists(file_path):
+    """Release downloaded media, the cache deletes it once it needs the space"""
+    if file_path:
+        media_cache.release(file_path)
+
+def is_protected_content(message):
+    """Check if the source forbids forwarding/saving this message's content"""
+    if getattr(message, 'noforwards', False):
+        return True
+    chat = getattr(message, 'chat', None)
+    return bool(chat and getattr(chat, 'noforwards', False))
+
+def choose_media_strategy(message):
+    """
+    Pick how the media of a message should be sent to the destination
+    Returns MEDIA_RELAY_STRATEGY, MEDIA_STREAM_STRATEGY, MEDIA_DOWNLOAD_STRATEGY
+    or None if no media
+    """
+    if not message.media:
+        return None
+    # Only real photos/documents can be re-sent by reference or streamed, web
+    # page previews are rebuilt from the downloaded file
+    if not isinstance(message.media, (types.MessageMediaPhoto, types.MessageMediaDocument)):
+        return MEDIA_DOWNLOAD_STRATEGY
+    if MEDIA_RELAY and not is_protected_content(message):
+        return MEDIA_RELAY_STRATEGY
+    return choose_upload_strategy(message)
+
+def choose_upload_strategy(message):
+    """Pick buffered download or streaming for media that must be re-uploaded"""
+    if not MEDIA_STREAMING or not isinstance(message.media, types.MessageMediaDocument):
+        return MEDIA_DOWNLOAD_STRATEGY
+    size = message.file.size if message.file else None
+    if size and size >= MEDIA_STREAM_THRESHOLD:
+        return MEDIA_STREAM_STRATEGY
+    return MEDIA_DOWNLOAD_STRATEGY
+
+async def relay_media(entity, message, caption, media=None, media_account=None):
+    """
+    Send the media of a message (or media, if given) by file reference,
+    without downloading it. The source media belongs to the listener, media
+    belongs to media_account. When that account can't send soon, the media
+    is uploaded again from the account the pool picks.
+    Returns the sent message, or None if the media has to be downloaded instead
+    """
+    owner = media_account if media is not None else accounts.listener
+    try:
+        input_media = utils.get_input_media(media or message.media)
+        return await send_file(
+            entity=entity,
+            account=owner,
+            failover=True,
+            file=input_media,
+            caption=caption,
+            force_document=False
+        )
+    except ThrottledError as e:
+        if len(accounts.accounts) == 1:
+            raise
+        logger.warning(f"Account {owner.name} can't relay media of message {message.id} ({str(e)}), uploading it from another account")
+        return await reupload_media(entity, message, caption, from_pool=True)
+    except RELAY_FALLBACK_ERRORS as e:
+        logger.warning(f"Cannot relay media of message {message.id} ({e.__class__.__name__}), falling back to re-upload")
+        return None
+    except TypeError as e:
+        logger.warning(f"Cannot build input media for message {message.id} ({str(e)}), falling back to re-upload")
+        return None
+
+async def stream_media(entity, message, caption):
+    """
+    Re-upload the media of a message while it is being downloaded
+    Chunks go through a bounded in-memory pipe, so nothing is written to disk
+    and memory use doesn't grow with the file size
+    """
+    file = message.file
+    file_name = file.name or f'media_{message.id}{file.ext or ""}'
+    uploaded = None
+    if use_parallel_transfer(message):
         try:
-            os.remove(file_path)
-            logger.info(f"Cleaned up media file: {file_path}")
+            uploaded = await transfer_stream(message, file_name, parallel=True)
         except Exception as e:
-            logger.error(f"Error cleaning up media file: {str(e)}")
+            parallel_transfer.fallbacks += 1
+            logger.warning(f"Parallel stream of message {message.id} failed ({str(e)}), using a single stream")
+    if uploaded is None:
+        uploaded = await transfer_stream(message, file_name, parallel=False)
+
+    sent = await send_file(
+        entity=entity,
+        file=uploaded,
+        caption=caption,
+        attributes=message.media.document.attributes,
+        mime_type=file.mime_type,
+        force_document=False
+    )
+    logger.info("Media streamed successfully for message %s", message.id)
+    return sent
+
+async def transfer_stream(message, file_name, parallel):
+    """Pipe the download of a message's media into an upload, returns the uploaded file"""
+    file = message.file
+    pipe = ChunkPipe(name=file_name, max_chunks=MEDIA_STREAM_BUFFER_CHUNKS)
+    if parallel:
+        chunks = parallel_transfer.iter_download(message.media, file.size)
+    else:
+        chunks = client.iter_download(message.media, request_size=MEDIA_STREAM_CHUNK_SIZE)
+    # The upload reads from the pipe, pacing the download paces both
+    producer = asyncio.create_task(pipe.feed(chunks, bulk_pacer(message)))
+    try:
+        logger.info("Streaming media for message %s (%s bytes)", message.id, file.size)
+        # Download and upload overlap here, the whole transfer counts as upload time
+        with STAGE_SECONDS.time('upload'):
+            if parallel:
+                return await parallel_transfer.upload(pipe, file.size, file_name)
+            return await client.upload_file(pipe, file_size=file.size, file_name=file_name)
+    finally:
+        if not producer.done():
+            producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+
+async def reupload_media(entity, message, caption, from_pool=False):
+    """
+    Download and re-upload the media of a message, streaming large files
+    With from_pool, the file is uploaded by the account the pool picks to
+    send it instead of by the listener, so it is never streamed or uploaded
+    in parallel parts first
+    """
+    if not from_pool and choose_upload_strategy(message) == MEDIA_STREAM_STRATEGY:
+        return await stream_media(entity, message, caption)
+
+    media_path = await handle_media(message)
+    try:
+        if not media_path or not os.path.exists(media_path):
+            raise Exception("Media download failed")
+        if from_pool:
+            upload = {"file": media_path, "progress_callback": bulk_pacer(message)}
+        else:
+            upload = await upload_media(message, media_path)
+        return await send_file(
+            entity=entity,
+            caption=caption,
+            force_document=False,
+            **upload
+        )
+    finally:
+        await cleanup_media(media_path)
 
 def get_message_type(message):
     """Determine the type of message for better handling"""
@@ -166,15 +571,7 @@ def get_message_type(message):
 
 def format_group_message(message, is_edit=False):
     """Format group message to include sender information"""
-    sender = message.sender
-    if sender:
-        sender_name = getattr(sender, 'first_name', '') or ''
-        if getattr(sender, 'last_name', ''):
-            sender_name += f" {sender.last_name}"
-        if getattr(sender, 'username', ''):
-            sender_name += f" (@{sender.username})"
-    else:
-        sender_name = "Unknown Sender"
+    sender_name = sender_cache.name_for(message)
 
     # Add edit indicator and timestamp for edited messages
     edit_info = ""
@@ -188,25 +585,50 @@ def format_group_message(message, is_edit=False):
     
     return formatted_text
 
-@backoff.on_exception(backoff.expo, FloodWaitError, max_tries=5)
-async def forward_message_with_retry(message, media_path=None, is_edit=False):
-    """Forward a message with exponential backoff retry"""
+def build_caption(message, is_edit=False, route=None):
+    """Build the text/caption sent to the destination of route for a message"""
+    # For group messages, we want to include sender information
+    is_group = isinstance(message.peer_id, types.PeerChat) or isinstance(message.peer_id, types.PeerChannel)
+    if route and route.include_sender is not None:
+        is_group = route.include_sender
+    if route and not route.mark_edits:
+        is_edit = False
+    formatted_text = format_group_message(message, is_edit) if is_group else message.text
+    
+    # Add edit indicator for non-group messages
+    if is_edit and not is_group:
+        edit_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        formatted_text = f"{formatted_text}\n[Edited at {edit_time}]"
+    return formatted_text
+
+def build_album_captions(messages, is_edit=False, route=None):
+    """Captions for an album, the formatted caption goes on the first item with text"""
+    carrier = next((message for message in messages if message.text), messages[0])
+    return [
+        build_caption(message, is_edit, route) if message is carrier else (message.text or '')
+        for message in messages
+    ]
+
+async def forward_message_with_retry(message, media_path=None, is_edit=False, strategy=None, route=None, media=None,
+                                     media_account=None):
+    """
+    Forward a message to the destination of route, flood waits are retried by
+    the rate limiter. Returns the sent message.
+    strategy is the media strategy picked by choose_media_strategy, with
+    MEDIA_RELAY_STRATEGY and MEDIA_STREAM_STRATEGY no media_path is needed.
+    media, if given, is sent by reference instead of the media of the message,
+    from media_account, the account that owns it.
+    """
     try:
         msg_type = get_message_type(message)
-        
-        # For group messages, we want to include sender information
-        is_group = isinstance(message.peer_id, types.PeerChat) or isinstance(message.peer_id, types.PeerChannel)
-        formatted_text = format_group_message(message, is_edit) if is_group else message.text
-        
-        # Add edit indicator for non-group messages
-        if is_edit and not is_group:
-            edit_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            formatted_text = f"{formatted_text}\n[Edited at {edit_time}]"
+        formatted_text = build_caption(message, is_edit, route)
 
-        dest_channel = validate_channel_id(DESTINATION_CHANNEL)
+        dest_channel = route.destination if route else validate_channel_id(DESTINATION_CHANNEL)
+        if media is not None:
+            strategy = MEDIA_RELAY_STRATEGY
         
         try:
-            entity = await client.get_entity(dest_channel)
+            entity = await entity_cache.get(client, dest_channel)
             
             # Handle web pages with media
             if isinstance(message.media, types.MessageMediaWebPage) and message.media.webpage:
@@ -214,7 +636,7 @@ async def forward_message_with_retry(message, media_path=None, is_edit=False):
                 # If webpage has media, download and send it
                 if webpage.photo or (webpage.document and ('video' in webpage.document.mime_type or 'audio' in webpage.document.mime_type)):
                     if media_path and os.path.exists(media_path):
-                        await client.send_file(
+                        sent = await send_file(
                             entity=entity,
                             file=media_path,
                             caption=formatted_text,
@@ -222,254 +644,952 @@ async def forward_message_with_retry(message, media_path=None, is_edit=False):
                         )
                     else:
                         # If media download failed, just send the message with the link
-                        await client.send_message(
+                        sent = await send_message(
                             entity=entity,
                             message=formatted_text
                         )
                 else:
                     # For web pages without media or with unsupported media
-                    await client.send_message(
+                    sent = await send_message(
                         entity=entity,
                         message=formatted_text
                     )
+            # Handle media sent by file reference
+            elif strategy == MEDIA_RELAY_STRATEGY and message.media:
+                sent = await relay_media(entity, message, formatted_text, media, media_account)
+                if sent is None:
+                    sent = await reupload_media(entity, message, formatted_text)
+            # Handle media streamed from the source without touching the disk
+            elif strategy == MEDIA_STREAM_STRATEGY and message.media:
+                sent = await stream_media(entity, message, formatted_text)
             # Handle regular media messages
             elif media_path and os.path.exists(media_path):
                 if os.path.getsize(media_path) > 0:
-                    await client.send_file(
+                    sent = await send_file(
                         entity=entity,
-                        file=media_path,
                         caption=formatted_text,
-                        force_document=False
+                        force_document=False,
+                        **await upload_media(message, media_path)
                     )
                 else:
                     logger.error(f"Media file exists but is empty: {media_path}")
-                    await client.send_message(
+                    sent = await send_message(
                         entity=entity,
                         message=formatted_text
                     )
             else:
-                await client.send_message(
+                sent = await send_message(
                     entity=entity,
                     message=formatted_text
                 )
-            return True
+            connectivity.report_success()
+            return sent
         except ValueError as e:
             logger.error(f"Invalid channel ID or username: {dest_channel}")
             raise
         except Exception as e:
             logger.error(f"Error sending message to channel: {str(e)}")
+            connectivity.report_failure(e)
+            await entity_cache.invalidate_on_error(dest_channel, e)
             raise
             
     except Exception as e:
         logger.error(f"Error in forward_message_with_retry: {str(e)}")
         raise
 
-@client.on(events.NewMessage(chats=SOURCE))
-async def handle_new_message(event):
-    """Handle new messages from source group/channel"""
+async def forward_album_with_retry(messages, is_edit=False, route=None, media=None, media_account=None):
+    """
+    Forward all items of an album to the destination of route with a single
+    multi-file send. Returns the sent messages.
+    media, if given, is a list sent by reference instead of the album media,
+    from media_account, the account that owns it.
+    """
+    captions = build_album_captions(messages, is_edit, route)
+    dest_channel = route.destination if route else validate_channel_id(DESTINATION_CHANNEL)
+    media_paths = []
     try:
-        message = event.message
-        logger.info(f"New message received from source")
-        
-        if not await check_internet_connection():
-            logger.warning("No internet connection. Queuing message for later.")
-            db.queue_message(
-                message_id=message.id,
-                chat_id=message.chat_id,
-                message_text=message.text,
-                media_path=None
+        entity = await entity_cache.get(client, dest_channel)
+        strategy = MEDIA_RELAY_STRATEGY
+        if media is None and any(choose_media_strategy(message) != MEDIA_RELAY_STRATEGY for message in messages):
+            strategy = MEDIA_DOWNLOAD_STRATEGY
+        logger.info("Using %s media strategy for album of %s items", strategy, len(messages))
+
+        sent = None
+        if strategy == MEDIA_RELAY_STRATEGY:
+            try:
+                sent = await send_file(
+                    entity=entity,
+                    account=media_account if media is not None else accounts.listener,
+                    failover=True,
+                    file=[utils.get_input_media(item) for item in (media or [message.media for message in messages])],
+                    caption=captions,
+                    force_document=False
+                )
+            except ThrottledError as e:
+                if len(accounts.accounts) == 1:
+                    raise
+                # Files sent by path are uploaded by the account the pool picks
+                logger.warning(f"Cannot relay album soon ({str(e)}), uploading it from another account")
+                strategy = MEDIA_DOWNLOAD_STRATEGY
+            except RELAY_FALLBACK_ERRORS as e:
+                logger.warning(f"Cannot relay album ({e.__class__.__name__}), falling back to re-upload")
+                strategy = MEDIA_DOWNLOAD_STRATEGY
+
+        if strategy == MEDIA_DOWNLOAD_STRATEGY:
+            for message in messages:
+                media_path = await handle_media(message)
+                if not media_path:
+                    raise Exception(f"Media download failed for album item {message.id}")
+                media_paths.append(media_path)
+            sent = await send_file(
+                entity=entity,
+                file=media_paths,
+                caption=captions,
+                force_document=False,
+                progress_callback=album_pacer(messages)
             )
-            return
+        connectivity.report_success()
+        return sent
+    except Exception as e:
+        logger.error(f"Error forwarding album: {str(e)}")
+        connectivity.report_failure(e)
+        await entity_cache.invalidate_on_error(dest_channel, e)
+        raise
+    finally:
+        for media_path in media_paths:
+            await cleanup_media(media_path)
 
-        media_path = await handle_media(message)
-        
+def get_reusable_media(message, sent):
+    """Media of a sent copy that later destinations can re-send by reference"""
+    if not isinstance(message.media, (types.MessageMediaPhoto, types.MessageMediaDocument)):
+        return None
+    media = getattr(sent, 'media', None)
+    if isinstance(media, (types.MessageMediaPhoto, types.MessageMediaDocument)):
+        return media
+    return None
+
+async def fan_out_message(message, routes, media_path=None, is_edit=False, strategy=None):
+    """
+    Forward a message to every route, its media is fetched or uploaded at most
+    once and re-sent by reference to the other destinations
+    Returns the routes that failed, mapped to their retry_after()
+    """
+    failed = {}
+    media = None
+    media_account = None
+    fingerprint = dedupe_cache.fingerprint(message)
+    for route in routes:
         try:
-            await forward_message_with_retry(message, media_path)
-            logger.info("Message forwarded successfully")
+            sent = await forward_message_with_retry(
+                message, media_path, is_edit, strategy, route=route, media=media, media_account=media_account
+            )
+            await dedupe_cache.remember(route.key, fingerprint)
+            await message_map.record(
+                message.chat_id, message.id, route.key, get_sent_id(sent), get_media_id(message),
+                account=accounts.name_of(sent), fingerprint=fingerprint
+            )
+            MESSAGES.inc('forwarded')
+            # The media of a copy can only be re-sent by the account that sent it
+            if media is None and accounts.owner(sent) is not None:
+                media = get_reusable_media(message, sent)
+                media_account = accounts.owner(sent)
         except Exception as e:
-            logger.error(f"Failed to forward message: {str(e)}")
+            logger.error(f"Failed to forward message {message.id} to {route.destination}: {str(e)}")
+            MESSAGES.inc('failed')
+            failed[route] = retry_after(e)
+    return failed
 
-            db.queue_message(
-                message_id=message.id,
-                chat_id=message.chat_id,
-                message_text=message.text,
-                media_path=media_path
-            )
-        finally:
-            if media_path:
-                await cleanup_media(media_path)
+async def fan_out_album(messages, routes, is_edit=False):
+    """
+    Forward an album to every route, uploading its media at most once
+    Returns the routes that failed, mapped to their retry_after()
+    """
+    failed = {}
+    media = None
+    media_account = None
+    fingerprint = album_fingerprint(messages)
+    for route in routes:
+        try:
+            sent = await forward_album_with_retry(messages, is_edit, route=route, media=media, media_account=media_account)
+            await dedupe_cache.remember(route.key, fingerprint)
+            MESSAGES.inc('forwarded', amount=len(messages))
+            if sent and len(sent) == len(messages):
+                # Only the carrier item got the formatted caption, see build_album_captions
+                carrier = next((message for message in messages if message.text), messages[0])
+                account = accounts.name_of(sent)
+                for message, item in zip(messages, sent):
+                    await message_map.record(
+                        message.chat_id, message.id, route.key, get_sent_id(item), get_media_id(message),
+                        formatted=message is carrier, account=account, fingerprint=fingerprint
+                    )
+            if media is None and sent and len(sent) == len(messages) and accounts.owner(sent) is not None:
+                reusable = [get_reusable_media(message, item) for message, item in zip(messages, sent)]
+                if all(reusable):
+                    media = reusable
+                    media_account = accounts.owner(sent)
+        except Exception as e:
+            logger.error(f"Failed to forward album to {route.destination}: {str(e)}")
+            MESSAGES.inc('failed', amount=len(messages))
+            failed[route] = retry_after(e)
+    return failed
+
+async def edit_copy(message, route, copy, fingerprint=None):
+    """
+    Apply an edit to the copy already sent to the destination of route,
+    fingerprint being that of the edited message
+    Returns False if the copy can't be edited in place and a new one is needed
+    """
+    account = accounts.get(copy.account)
+    if account is None:
+        # Sent by an account that is no longer configured
+        return False
+    media_id = get_media_id(message)
+    file = None
+    if media_id != copy.media_id:
+        # Media can only be swapped for other media sent by reference
+        if media_id is None or copy.media_id is None or choose_media_strategy(message) != MEDIA_RELAY_STRATEGY:
+            return False
+        if account is accounts.listener:
+            file = utils.get_input_media(message.media)
+        else:
+            # The listener's reference is useless to the account that sent the copy
+            file = await upload_from(account, message)
+
+    entity = await entity_cache.get(client, route.destination)
+    text = build_caption(message, route=route) if copy.formatted else (message.text or '')
+    try:
+        try:
+            await edit_message(entity, account, message=copy.dest_msg_id, text=text, file=file)
+        except RELAY_FALLBACK_ERRORS as e:
+            if not isinstance(file, (types.InputMediaPhoto, types.InputMediaDocument)):
+                raise
+            # The reference can't be used any more, the copy gets the media uploaded again
+            logger.warning(f"Cannot swap media of copy of message {message.id} by reference ({e.__class__.__name__}), re-uploading it")
+            file = await upload_from(account, message)
+            await edit_message(entity, account, message=copy.dest_msg_id, text=text, file=file)
+    except MessageNotModifiedError:
+        pass
+    except RELAY_FALLBACK_ERRORS as e:
+        # A new copy would duplicate the message, the copy is left as it is
+        logger.warning(f"Cannot swap media of copy of message {message.id} in {route.destination} ({e.__class__.__name__})")
+        return True
+    except (MessageIdInvalidError, MessageEditTimeExpiredError, MessageAuthorRequiredError) as e:
+        logger.warning(f"Cannot edit copy of message {message.id} in {route.destination} ({e.__class__.__name__})")
+        await message_map.forget([(message.chat_id, message.id, route.key)])
+        return False
+    if file is not None or fingerprint != copy.fingerprint:
+        await message_map.record(
+            message.chat_id, message.id, route.key, copy.dest_msg_id, media_id, copy.formatted, copy.account,
+            fingerprint
+        )
+    return True
+
+async def upload_from(account, message):
+    """Download the media of a message and upload it from account, for an edit of its copy"""
+    media_path = await handle_media(message)
+    try:
+        if not media_path or not os.path.exists(media_path):
+            raise Exception("Media download failed")
+        with STAGE_SECONDS.time('upload'):
+            return await account.client.upload_file(media_path, progress_callback=bulk_pacer(message))
+    finally:
+        await cleanup_media(media_path)
+
+async def edit_in_place(message, routes):
+    """
+    Edit the copies of message that were already sent, before anything is
+    downloaded. Returns the routes that still need a new copy.
+    """
+    if not EDIT_IN_PLACE:
+        return routes
+    copies = await message_map.get(message.chat_id, message.id)
+    if not copies:
+        return routes
+
+    fingerprint = dedupe_cache.fingerprint(message)
+    remaining = []
+    for route in routes:
+        copy = copies.get(route.key)
+        try:
+            if copy and await edit_copy(message, route, copy, fingerprint):
+                message_map.edits_in_place += 1
+                # The old content isn't in the destination any more
+                if copy.fingerprint != fingerprint:
+                    await dedupe_cache.forget([(route.key, copy.fingerprint)])
+                await dedupe_cache.remember(route.key, fingerprint)
+                logger.info("Edited copy of message %s in %s", message.id, route.destination)
+                continue
+        except Exception as e:
+            logger.error(f"Failed to edit copy of message {message.id} in {route.destination}: {str(e)}")
+            await entity_cache.invalidate_on_error(route.destination, e)
+        remaining.append(route)
+    return remaining
+
+async def propagate_deletes(chat_id, message_ids):
+    """Delete the copies of deleted source messages"""
+    rows = await message_map.find(chat_id, message_ids)
+    by_destination = {}
+    for row in rows:
+        # Without a chat, only ids of chats we forward from are considered
+        if chat_id is None and not routing.routes_for(row['source_chat']):
+            continue
+        # Copies are deleted by the account that sent them
+        by_destination.setdefault((row['destination'], row['account']), []).append(row)
+
+    for (destination, account_name), dest_rows in by_destination.items():
+        dest_channel = validate_channel_id(destination)
+        try:
+            account = accounts.get(account_name)
+            if account is None:
+                raise Exception(f"Account {account_name} that sent them is no longer configured")
+            entity = await entity_cache.get(client, dest_channel)
+            await delete_messages(entity, [row['dest_msg_id'] for row in dest_rows], account)
+            message_map.deletes_propagated += len(dest_rows)
+            logger.info("Deleted %s copies in %s", len(dest_rows), destination)
+        except Exception as e:
+            logger.error(f"Failed to delete copies in {destination}: {str(e)}")
+            await entity_cache.invalidate_on_error(dest_channel, e)
+            continue
+        await message_map.forget([
+            (row['source_chat'], row['source_msg_id'], row['destination']) for row in dest_rows
+        ])
+        # Content deleted from the destination may be posted there again
+        await dedupe_cache.forget([(row['destination'], row['fingerprint']) for row in dest_rows])
+
+async def propagate_deletes_after_bulk(chat_id, message_ids):
+    """Run propagate_deletes once the chat's pending bulk lane sends are done too"""
+    if not bulk_dispatcher.submit(chat_id, propagate_deletes, chat_id, message_ids):
+        await propagate_deletes(chat_id, message_ids)
+
+async def drop_duplicate_routes(fingerprint, routes, label, window=None):
+    """Routes that fingerprint wasn't sent to recently, checked before any download"""
+    fresh = []
+    for route in routes:
+        if await dedupe_cache.is_duplicate(route.key, fingerprint, window):
+            logger.info("Skipping duplicate %s for %s", label, route.destination)
+            MESSAGES.inc('duplicate')
+        else:
+            fresh.append(route)
+    return fresh
+
+def retry_after(error):
+    """
+    Seconds before a send that failed with error can work, None unless it
+    only failed because every account is paused or unavailable. Such sends
+    wait in the queue without using up a retry.
+    """
+    if isinstance(error, (ThrottledError, FloodWaitError, SlowModeWaitError)):
+        return error.seconds
+    if isinstance(error, NoAccountError):
+        return NO_ACCOUNT_RETRY_DELAY
+    return None
+
+def deferral(failed):
+    """How long a queued row whose every route failed can wait for another go, None if one really failed"""
+    delays = list(failed.values())
+    if delays and all(delay is not None for delay in delays):
+        return min(delays)
+    return None
+
+async def queue_message_for(message, routes=None, is_edit=False, grouped_id=None, delay=0):
+    """Queue a message for routes (None meaning all routes of its source), due in delay seconds"""
+    for destination in ([route.key for route in routes] if routes else [None]):
+        await db.queue_message(
+            message_id=message.id,
+            chat_id=message.chat_id,
+            message_text=message.text,
+            media_path=None,
+            is_edit=is_edit,
+            grouped_id=grouped_id,
+            destination=destination,
+            delay=delay
+        )
+        MESSAGES.inc('queued')
+    wake_queue_processor()
+
+async def queue_album(messages, routes=None, is_edit=False):
+    """Queue every item of an album so they are retried together"""
+    for message in messages:
+        await queue_message_for(message, routes, is_edit, grouped_id=message.grouped_id)
+
+async def queue_failed(messages, failed, is_edit=False):
+    """
+    Queue a message or album again for the routes it failed on, routes that
+    were only rate limited become due once sending can resume
+    """
+    for route, delay in failed.items():
+        for message in messages:
+            await queue_message_for(message, [route], is_edit, grouped_id=message.grouped_id, delay=delay or 0)
+
+async def forward_album(messages):
+    """Forward an album to all its routes, queuing it for those that fail"""
+    if not connectivity.is_online:
+        logger.warning("No internet connection. Queuing album for later.")
+        await queue_album(messages)
+        return
+
+    routes = await drop_duplicate_routes(
+        album_fingerprint(messages), routing.routes_for(messages[0].chat_id), f"album {messages[0].grouped_id}"
+    )
+    if not routes:
+        return
+    failed = await fan_out_album(messages, routes)
+    if failed:
+        await queue_failed(messages, failed)
+    if len(failed) < len(routes):
+        logger.info("Album forwarded successfully (%s items)", len(messages))
+
+def get_media_size(message):
+    """Size in bytes of the media of a message, 0 if unknown or no media"""
+    file = message.file if message.media else None
+    return (file.size or 0) if file else 0
+
+def is_bulk(message):
+    """Whether a message is heavy enough for the bulk lane: videos and large documents"""
+    if not isinstance(message.media, types.MessageMediaDocument) or not message.file:
+        return False
+    mime_type = message.file.mime_type or ''
+    return mime_type.startswith('video/') or get_media_size(message) >= BULK_LANE_THRESHOLD
+
+def lane_for(messages):
+    """Dispatcher (lane) a message or album is forwarded on"""
+    return bulk_dispatcher if any(is_bulk(message) for message in messages) else dispatcher
+
+async def forward_message(message, is_edit=False):
+    """Forward a message to all its routes, queuing it for those that fail"""
+    if not connectivity.is_online:
+        logger.warning("No internet connection. Queuing message for later.")
+        await queue_message_for(message, is_edit=is_edit)
+        return
+
+    routes = routing.routes_for(message.chat_id)
+    # Copies of an edited message are edited whatever the dedupe window says
+    if is_edit:
+        routes = await edit_in_place(message, routes)
+    routes = await drop_duplicate_routes(
+        dedupe_cache.fingerprint(message), routes, f"message {message.id}", dedupe_cache.window_for(message)
+    )
+    if not routes:
+        return
+    strategy = choose_media_strategy(message)
+    if strategy:
+        logger.info("Using %s media strategy for message %s", strategy, message.id)
+    media_path = await handle_media(message) if strategy == MEDIA_DOWNLOAD_STRATEGY else None
+    
+    try:
+        failed = await fan_out_message(message, routes, media_path, is_edit, strategy)
+        if failed:
+            await queue_failed([message], failed, is_edit)
+        if len(failed) < len(routes):
+            logger.info("Message forwarded successfully (ID: %s)", message.id)
+    finally:
+        if media_path:
+            await cleanup_media(media_path)
+
+async def forward_new(messages):
+    """
+    Forward a new message or album, then move its source checkpoint past it
+    A forward cut short (the lanes stopping at shutdown) leaves the checkpoint
+    below it, so the next start catches up on it
+    """
+    try:
+        if messages[0].grouped_id:
+            await forward_album(messages)
+        else:
+            await forward_message(messages[0])
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error forwarding message {messages[0].id}, queuing it for later: {str(e)}")
+        if messages[0].grouped_id:
+            await queue_album(messages)
+        else:
+            await queue_message_for(messages[0])
+    await checkpoints.finish(messages[0].chat_id, [message.id for message in messages])
+
+async def handle_album(messages):
+    """Dispatch an album collected by the album aggregator"""
+    if not lane_for(messages).submit(messages[0].chat_id, forward_new, messages):
+        logger.warning("Forwarding queue is full. Queuing album for later.")
+        await queue_album(messages)
+        await checkpoints.finish(messages[0].chat_id, [message.id for message in messages])
+
+async def handle_message(message):
+    """Dispatch a new message that isn't part of an album"""
+    if not lane_for([message]).submit(message.chat_id, forward_new, [message]):
+        logger.warning("Forwarding queue is full. Queuing message for later.")
+        await queue_message_for(message)
+        await checkpoints.finish(message.chat_id, [message.id])
+
+# Forwarding runs on the dispatcher workers, handlers only hand messages over.
+# Text and small media use the fast lane, heavy media the bulk lane.
+dispatcher = Dispatcher(workers=FORWARD_WORKERS, max_queue=FORWARD_QUEUE_SIZE, name='fast lane')
+bulk_dispatcher = Dispatcher(workers=BULK_LANE_WORKERS, max_queue=FORWARD_QUEUE_SIZE, name='bulk lane')
+
+# Scraped from the web server thread: plain attribute reads, and queue stats
+# through the database writer thread so the bot loop is never involved
+REGISTRY.gauge(
+    'forwarder_queue_depth', 'Messages waiting in the retry queue',
+    lambda: db.get_queue_stats_blocking()["backlog"]
+)
+REGISTRY.gauge(
+    'forwarder_queue_oldest_age_seconds', 'Age of the oldest message waiting in the retry queue',
+    lambda: db.get_queue_stats_blocking()["oldest_age"]
+)
+REGISTRY.gauge(
+    'forwarder_flood_wait_seconds_total', 'Seconds of flood waits imposed by Telegram',
+    lambda: accounts.flood_wait_seconds, metric_type='counter'
+)
+REGISTRY.gauge(
+    'forwarder_flood_waits_total', 'Flood waits imposed by Telegram',
+    lambda: accounts.flood_waits, metric_type='counter'
+)
+REGISTRY.gauge('forwarder_fast_lane_depth', 'Jobs waiting in the fast lane', lambda: dispatcher.depth)
+REGISTRY.gauge('forwarder_bulk_lane_depth', 'Jobs waiting in the bulk lane', lambda: bulk_dispatcher.depth)
+bulk_bandwidth = TokenBucket(
+    'bulk lane bandwidth', BULK_LANE_BANDWIDTH, BULK_LANE_BANDWIDTH
+) if BULK_LANE_BANDWIDTH > 0 else None
+album_aggregator = AlbumAggregator(
+    handle_album, handle_message, quiet_period=ALBUM_QUIET_PERIOD, max_wait=ALBUM_MAX_WAIT
+)
+backfill = Backfill(
+    client, checkpoints,
+    resolve=lambda chat_id: entity_cache.get(client, chat_id),
+    forward=forward_new,
+    lane_for=lane_for,
+    concurrency=BACKFILL_CONCURRENCY,
+    limit=BACKFILL_LIMIT
+)
+
+async def handle_edit(message):
+    """Dispatch the final version of an edited message"""
+    if not lane_for([message]).submit(message.chat_id, forward_message, message, True):
+        logger.warning("Forwarding queue is full. Queuing edited message for later.")
+        await queue_message_for(message, is_edit=True)
+
+def edit_cost(message):
+    """Downloads and sends forwarding an edit takes, for the coalescing stats"""
+    downloads = 1 if choose_media_strategy(message) in (MEDIA_DOWNLOAD_STRATEGY, MEDIA_STREAM_STRATEGY) else 0
+    return downloads, len(routing.routes_for(message.chat_id))
+
+edit_debouncer = EditDebouncer(handle_edit, quiet_period=EDIT_QUIET_PERIOD, max_wait=EDIT_MAX_WAIT, cost=edit_cost)
+
+@client.on(events.NewMessage())
+async def handle_new_message(event):
+    """Handle new messages from source groups/channels"""
+    try:
+        # Chats without routes are dropped with a single lookup
+        if not routing.routes_for(event.chat_id):
+            return
+        message = event.message
+        logger.info("New message received from source %s", message.chat_id)
+        # Messages the catch-up already handed over are not forwarded twice
+        if not backfill.claim(message.chat_id, message.id):
+            return
+        checkpoints.start(message.chat_id, message.id)
+        
+        # Album items are collected and forwarded together, later messages
+        # of the chat wait for the album so they don't overtake it
+        if album_aggregator.add(message):
+            return
+        
+        await handle_message(message)
     except Exception as e:
         logger.error(f"Error in handle_new_message: {str(e)}")
 
-@client.on(events.MessageEdited(chats=SOURCE))
+@client.on(events.Raw())
+async def handle_raw_update(update):
+    """Keep cached sender names current from the users that come with updates"""
+    sender_cache.refresh(update)
+
+@client.on(events.MessageEdited())
 async def handle_edited_message(event):
-    """Handle edited messages from source group/channel"""
+    """Handle edited messages from source groups/channels"""
     try:
+        if not routing.routes_for(event.chat_id):
+            return
         message = event.message
-        logger.info(f"Edited message received from source (ID: {message.id})")
+        logger.info("Edited message received from source (ID: %s)", message.id)
         
-        if not await check_internet_connection():
-            logger.warning("No internet connection. Queuing edited message for later.")
-            db.queue_message(
-                message_id=message.id,
-                chat_id=message.chat_id,
-                message_text=message.text,
-                media_path=None,
-                is_edit=True
-            )
+        # Only the last edit of a burst is forwarded, with the edit mark
+        edit_debouncer.add(message)
+    except Exception as e:
+        logger.error(f"Error in handle_edited_message: {str(e)}")
+
+@client.on(events.MessageDeleted())
+async def handle_deleted_message(event):
+    """Delete the copies of messages deleted in source groups/channels"""
+    try:
+        if not PROPAGATE_DELETES:
+            return
+        # Only channel deletes say which chat they come from
+        if event.chat_id is not None and not routing.routes_for(event.chat_id):
             return
+        logger.info("%s messages deleted in source %s", len(event.deleted_ids), event.chat_id)
+        # Queued behind the chat's pending sends, so a copy is never deleted before it exists
+        if not dispatcher.submit(event.chat_id, propagate_deletes_after_bulk, event.chat_id, event.deleted_ids):
+            logger.warning("Forwarding queue is full. Deleting copies right away.")
+            await propagate_deletes(event.chat_id, event.deleted_ids)
+    except Exception as e:
+        logger.error(f"Error in handle_deleted_message: {str(e)}")
 
-        media_path = await handle_media(message)
-        
+def get_queued_routes(row):
+    """Routes a queued row still has to be forwarded to"""
+    if row['destination']:
+        route = routing.find(row['chat_id'], row['destination'])
+        return [route] if route else []
+    return list(routing.routes_for(row['chat_id']))
+
+async def fetch_queued_messages(rows):
+    """
+    Re-fetch the originals of queued rows, one get_messages call per chat and
+    per FETCH_BATCH_SIZE ids
+    Returns a {(chat_id, message_id): message} dict and the set of chats that
+    couldn't be read, whose rows are already marked failed
+    """
+    by_chat = {}
+    for row in rows:
+        by_chat.setdefault(row['chat_id'], []).append(row)
+
+    fetched = {}
+    unreadable = set()
+    for chat_id, chat_rows in by_chat.items():
+        message_ids = sorted({row['message_id'] for row in chat_rows})
         try:
-            # Forward the edited message with edit mark
-            await forward_message_with_retry(message, media_path, is_edit=True)
-            logger.info(f"Edited message forwarded successfully (ID: {message.id})")
+            chat = await entity_cache.get(client, chat_id)
+            for start in range(0, len(message_ids), FETCH_BATCH_SIZE):
+                ids = message_ids[start:start + FETCH_BATCH_SIZE]
+                messages = await client.get_messages(chat, ids=ids)
+                queue_status["fetch_calls"] += 1
+                for message_id, message in zip(ids, messages):
+                    if message:
+                        fetched[(chat_id, message_id)] = message
         except Exception as e:
-            logger.error(f"Failed to forward edited message: {str(e)}")
-            db.queue_message(
-                message_id=message.id,
-                chat_id=message.chat_id,
-                message_text=message.text,
-                media_path=media_path,
-                is_edit=True
+            logger.error(f"Could not re-fetch {len(chat_rows)} queued messages from chat {chat_id}: {str(e)}")
+            await entity_cache.invalidate_on_error(chat_id, e)
+            await db.update_messages_status(
+                [row['id'] for row in chat_rows], 'failed', 'Original message or chat not found'
             )
+            unreadable.add(chat_id)
+    return fetched, unreadable
+
+async def process_queued_album(rows, found):
+    """Forward the re-fetched items of a queued album together"""
+    routes = get_queued_routes(rows[0])
+    if not routes:
+        await db.update_messages_status(
+            [row['id'] for row in rows], 'failed', 'No route for queued album', retry=False
+        )
+        return
+
+    routes = await drop_duplicate_routes(album_fingerprint(found), routes, f"album {rows[0]['grouped_id']}")
+    if not routes:
+        await db.update_messages_status([row['id'] for row in rows], 'completed')
+        return
+
+    is_edit = bool(rows[0]['is_edit'])
+    failed = await fan_out_album(found, routes, is_edit)
+    if len(failed) == len(routes):
+        delay = deferral(failed)
+        if delay is not None:
+            logger.warning(f"Queued album {rows[0]['grouped_id']} is rate limited, trying again in {delay:.0f}s")
+            await db.defer_messages([row['id'] for row in rows], delay, 'Rate limited')
+            return
+        logger.error(f"Error forwarding queued album {rows[0]['grouped_id']}")
+        await db.update_messages_status([row['id'] for row in rows], 'failed', 'Album forward failed')
+        return
+
+    await db.update_messages_status([row['id'] for row in rows], 'completed')
+    # Only the destinations that failed are tried again
+    if failed:
+        await queue_failed(found, failed, is_edit)
+    logger.info("Successfully processed queued album %s", rows[0]['grouped_id'])
+
+async def process_queued_batch(pending_messages):
+    """Forward a batch of claimed queue rows"""
+    # Album items are claimed together and forwarded in one send
+    albums = {}
+    singles = []
+    for msg in pending_messages:
+        if msg['grouped_id']:
+            albums.setdefault((msg['chat_id'], msg['grouped_id'], msg['destination']), []).append(msg)
+        else:
+            singles.append(msg)
+
+    # Originals are re-fetched in bulk, rows whose message is gone are marked at once
+    fetched, unreadable = await fetch_queued_messages(pending_messages)
+    missing = []
+    for key, rows in list(albums.items()):
+        if key[0] in unreadable:
+            del albums[key]
+            continue
+        rows.sort(key=lambda row: row['message_id'])
+        found = [fetched[(key[0], row['message_id'])] for row in rows if (key[0], row['message_id']) in fetched]
+        if found:
+            albums[key] = (rows, found)
+        else:
+            logger.error(f"Could not find original album {key[1]}")
+            missing.extend(row['id'] for row in rows)
+            del albums[key]
+    found_singles = []
+    for msg in singles:
+        if msg['chat_id'] in unreadable:
+            continue
+        if (msg['chat_id'], msg['message_id']) in fetched:
+            found_singles.append(msg)
+        else:
+            logger.error(f"Could not find original message {msg['message_id']}")
+            missing.append(msg['id'])
+    await db.update_messages_status(missing, 'failed', 'Original message not found', retry=False)
+
+    for rows, found in albums.values():
+        await process_queued_album(rows, found)
+    
+    for msg in found_singles:
+        row_id = msg['id']
+        message_id = msg['message_id']
+        try:
+            chat_id = msg['chat_id']
+            is_edit = msg['is_edit']
+            routes = get_queued_routes(msg)
+            if not routes:
+                logger.error(f"No route left for queued message {message_id}")
+                await db.update_message_status(row_id, 'failed', 'No route for queued message', retry=False)
+                continue
+            
+            message = fetched[(chat_id, message_id)]
+            if is_edit:
+                routes = await edit_in_place(message, routes)
+            routes = await drop_duplicate_routes(
+                dedupe_cache.fingerprint(message), routes, f"message {message_id}", dedupe_cache.window_for(message)
+            )
+            if not routes:
+                await db.update_message_status(row_id, 'completed')
+                continue
+
+            # Handle media if present, re-fetched messages carry a fresh
+            # file reference so they can usually be relayed
+            new_media_path = None
+            strategy = choose_media_strategy(message)
+            if strategy:
+                logger.info("Using %s media strategy for queued message %s", strategy, message_id)
+            if strategy == MEDIA_DOWNLOAD_STRATEGY:
+                new_media_path = await handle_media(message)
+                if not new_media_path:
+                    logger.error(f"Error re-downloading media for message {message_id}")
+                    await db.update_message_status(row_id, 'failed', 'Media download failed')
+                    continue
+            
+            # Forward message with edit status if it's an edited message
+            failed = await fan_out_message(message, routes, new_media_path, bool(is_edit), strategy)
+            if len(failed) == len(routes):
+                delay = deferral(failed)
+                if delay is not None:
+                    logger.warning(f"Queued message {message_id} is rate limited, trying again in {delay:.0f}s")
+                    await db.defer_messages([row_id], delay, 'Rate limited')
+                else:
+                    logger.error(f"Error forwarding queued message {message_id}")
+                    await db.update_message_status(row_id, 'failed', 'Forward failed')
+            else:
+                await db.update_message_status(row_id, 'completed')
+                # Only the destinations that failed are tried again
+                if failed:
+                    await queue_failed([message], failed, bool(is_edit))
+                logger.info("Successfully processed queued message %s", message_id)
+                
+        except Exception as e:
+            logger.error(f"Error processing queued message {message_id}: {str(e)}")
+            await db.update_message_status(row_id, 'failed', str(e))
         finally:
-            if media_path:
-                await cleanup_media(media_path)
-    except Exception as e:
-        logger.error(f"Error in handle_edited_message: {str(e)}")
+            if 'new_media_path' in locals() and new_media_path:
+                await cleanup_media(new_media_path)
+
+async def renew_leases(rows):
+    """Keep renewing the leases of a claimed batch, large media can take longer than one lease"""
+    row_ids = [row['id'] for row in rows]
+    while True:
+        await asyncio.sleep(QUEUE_LEASE_SECONDS / 3)
+        try:
+            await db.renew_leases(row_ids, QUEUE_LEASE_SECONDS)
+        except Exception as e:
+            logger.error(f"Error renewing queue leases: {str(e)}")
+
+def wake_queue_processor():
+    """Make the queue processor look at the queue right away"""
+    if queue_wakeup is not None:
+        queue_wakeup.set()
 
 async def process_message_queue():
-    """Process queued messages"""
+    """
+    Process queued messages
+    The queue is drained in batches that grow while they come back full, then
+    the processor sleeps until a message is queued, connectivity comes back or
+    the next retry/lease deadline is due
+    """
+    global queue_wakeup
+    queue_wakeup = asyncio.Event()
+    batch_size = QUEUE_MIN_BATCH
+    last_cleanup = 0
     while True:
         try:
-            if not await check_internet_connection():
+            if not connectivity.is_online:
                 logger.warning("No internet connection. Waiting before processing queue...")
-                await asyncio.sleep(60)
+                # Woken up as soon as the connectivity monitor sees the network back
+                await connectivity.wait_online(timeout=60)
                 continue
 
-            pending_messages = db.get_pending_messages(limit=10)
-            
-            for msg in pending_messages:
+            # Anything queued from now on wakes the next round up
+            queue_wakeup.clear()
+
+            # Claimed rows are leased to this processor until their status is updated
+            started = time.monotonic()
+            pending_messages = await db.claim_pending_messages(limit=batch_size, lease_seconds=QUEUE_LEASE_SECONDS)
+            if pending_messages:
+                renewal = asyncio.ensure_future(renew_leases(pending_messages))
                 try:
-                    message_id, chat_id, message_text, media_path, _, _, _, _, _, is_edit = msg
-                    
-                    # Get the original message
-                    try:
-                        # First try to get the chat entity
-                        chat = await client.get_entity(chat_id)
-                        message = await client.get_messages(chat, ids=message_id)
-                    except Exception as e:
-                        logger.error(f"Could not find original message or chat: {str(e)}")
-                        db.update_message_status(message_id, 'failed', 'Original message or chat not found')
-                        continue
-
-                    if not message:
-                        logger.error(f"Could not find original message {message_id}")
-                        db.update_message_status(message_id, 'failed', 'Original message not found')
-                        continue
-
-                    # Handle media if present
-                    new_media_path = None
-                    if message.media:
-                        try:
-                            # Create temporary directory if it doesn't exist
-                            temp_dir = get_temp_dir()
-                            os.makedirs(temp_dir, exist_ok=True)
-                            
-                            # Download the media to a temporary file
-                            new_media_path = os.path.join(temp_dir, f'media_queued_{message.id}')
-                            await message.download_media(new_media_path)
-                            
-                            # Add proper extension based on media type
-                            if isinstance(message.media, types.MessageMediaPhoto):
-                                new_media_path += '.jpg'
-                            elif isinstance(message.media, types.MessageMediaDocument):
-                                if message.file and message.file.name:
-                                    new_media_path += os.path.splitext(message.file.name)[1]
-                                elif message.media.document.mime_type:
-                                    if 'video' in message.media.document.mime_type:
-                                        new_media_path += '.mp4'
-                                    elif 'audio' in message.media.document.mime_type:
-                                        new_media_path += '.m4a'
-                                    elif 'image/webp' in message.media.document.mime_type:
-                                        new_media_path += '.webp'
-                                    elif 'image/jpeg' in message.media.document.mime_type:
-                                        new_media_path += '.jpg'
-                            elif isinstance(message.media, types.MessageMediaWebPage):
-                                if message.media.webpage.photo:
-                                    new_media_path += '.jpg'
-                                elif message.media.webpage.document:
-                                    if 'video' in message.media.webpage.document.mime_type:
-                                        new_media_path += '.mp4'
-                                    elif 'audio' in message.media.webpage.document.mime_type:
-                                        new_media_path += '.m4a'
-                            
-                            logger.info(f"Media re-downloaded successfully for queued message: {new_media_path}")
-                            
-                            # Verify file was downloaded successfully
-                            if not os.path.exists(new_media_path) or os.path.getsize(new_media_path) == 0:
-                                raise Exception("Media download failed or file is empty")
-                            
-                        except Exception as e:
-                            logger.error(f"Error re-downloading media for message {message_id}: {str(e)}")
-                            db.update_message_status(message_id, 'failed', f'Media download failed: {str(e)}')
-                            continue
-                    
-                    try:
-                        # Forward message with edit status if it's an edited message
-                        await forward_message_with_retry(message, new_media_path, is_edit=bool(is_edit))
-                        db.update_message_status(message_id, 'completed')
-                        logger.info(f"Successfully processed queued message {message_id}")
-                    except Exception as e:
-                        logger.error(f"Error forwarding queued message {message_id}: {str(e)}")
-                        db.update_message_status(message_id, 'failed', str(e))
-                        
-                except Exception as e:
-                    logger.error(f"Error processing queued message {message_id}: {str(e)}")
-                    db.update_message_status(message_id, 'failed', str(e))
+                    await process_queued_batch(pending_messages)
                 finally:
-                    if 'new_media_path' in locals() and new_media_path:
-                        await cleanup_media(new_media_path)
-            
-            db.cleanup_old_messages(days=1)
-            
-            await asyncio.sleep(60)
+                    renewal.cancel()
+                elapsed = max(time.monotonic() - started, 0.001)
+                queue_status["processed"] += len(pending_messages)
+                queue_status["drain_rate"] = round(len(pending_messages) / elapsed, 2)
+                queue_status.update(await db.get_queue_stats())
+
+                # Grow the batch while the backlog keeps it full, shrink it back afterwards
+                if len(pending_messages) >= batch_size:
+                    batch_size = min(batch_size * 2, QUEUE_MAX_BATCH)
+                else:
+                    batch_size = max(QUEUE_MIN_BATCH, batch_size // 2)
+                queue_status["batch_size"] = batch_size
+                continue
+
+            if time.monotonic() - last_cleanup > QUEUE_CLEANUP_INTERVAL:
+                await db.cleanup_old_messages(days=1)
+                await dedupe_cache.prune()
+                await message_map.prune()
+                last_cleanup = time.monotonic()
+
+            queue_status.update(await db.get_queue_stats())
+            queue_status["drain_rate"] = 0
+
+            # Sleep until the next deadline unless something wakes us up first
+            next_due_at = await db.get_next_due_at()
+            timeout = QUEUE_IDLE_TIMEOUT
+            if next_due_at is not None:
+                timeout = min(timeout, max(next_due_at - time.time(), 0.1))
+            try:
+                await asyncio.wait_for(queue_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
             
         except Exception as e:
             logger.error(f"Error in queue processor: {str(e)}")
             await asyncio.sleep(60)
 
+def collect_stats():
+    """Stats of every component, for the status server"""
+    return {
+        "entity_cache": entity_cache.stats(),
+        "dedupe": dedupe_cache.stats(),
+        "senders": sender_cache.stats(),
+        "media_cache": media_cache.stats(),
+        "parallel_transfer": parallel_transfer.stats(),
+        "message_map": message_map.stats(),
+        "backfill": backfill.stats(),
+        "edits": dict(edit_debouncer.stats(), queued_collapsed=db.edits_collapsed),
+        "lanes": {
+            "fast": dispatcher.stats(),
+            "bulk": bulk_dispatcher.stats()
+        },
+        "rate_limiter": rate_limiter.stats(),
+        "accounts": accounts.stats(),
+        "logging": sampling_stats(),
+        "loop": loop_lag.stats(),
+        "queue": queue_status
+    }
+
+def check_health(queue_stats, running):
+    """
+    Health of the running bot from what it actually sees: event loop lag,
+    Telegram connection, network state and the age of the retry queue
+    queue_stats is what db.get_queue_stats() returned, running whether the
+    bot was started and hasn't ended
+    Returns the overall state and the individual checks
+    """
+    if started_at is None:
+        # Connecting, loading caches and resolving routes can take a while
+        return evaluate({"bot": (STARTING if running else UNHEALTHY, {"running": running})})
+
+    lag = loop_lag.lag or 0.0
+    offline_for = time.monotonic() - connectivity.changed_at if connectivity.state == OFFLINE else 0.0
+    oldest_age = queue_stats.get("oldest_age") or 0
+    connected = client.is_connected()
+    return evaluate({
+        "bot": (HEALTHY, {"running": True, "uptime": round(time.monotonic() - started_at)}),
+        "loop": (UNHEALTHY if lag > HEALTH_MAX_LOOP_LAG else HEALTHY, {"lag": round(lag, 3)}),
+        "connectivity": (
+            UNHEALTHY if offline_for > HEALTH_MAX_OFFLINE
+            else HEALTHY if connectivity.state == ONLINE and connected
+            else DEGRADED,
+            {"network": connectivity.state, "connected": connected, "offline_for": round(offline_for)}
+        ),
+        "queue": (
+            DEGRADED if oldest_age > HEALTH_MAX_QUEUE_AGE else HEALTHY,
+            {"backlog": queue_stats.get("backlog"), "oldest_age": oldest_age}
+        )
+    })
+
 async def main():
     """Main function to run the client"""
-    global is_running
+    global is_running, started_at
     
     try:
         logger.info("Starting Telegram Forwarder...")
         
-        if not all([API_ID, API_HASH, SOURCE, DESTINATION_CHANNEL, SESSION_STRING]):
+        if not all([API_ID, API_HASH, SESSION_STRING]) or not routing.routes:
             raise ValueError("Missing required environment variables")
         
-        dest_channel = validate_channel_id(DESTINATION_CHANNEL)
-        logger.info(f"Using destination channel: {dest_channel}")
+        logger.info(f"Using routes: {routing.routes}")
+        
+        # Workers are running before the first update can arrive
+        loop_lag.start()
+        dispatcher.start()
+        bulk_dispatcher.start()
         
         await client.start()
         logger.info("Client started successfully")
+        await accounts.start()
         
-        try:
-            entity = await client.get_entity(dest_channel)
-            logger.info(f"Successfully connected to destination channel: {entity.title if hasattr(entity, 'title') else dest_channel}")
-        except Exception as e:
-            logger.error(f"Failed to access destination channel: {str(e)}")
-            raise
+        # Resolve destinations and sources once, reusing what was cached before a restart
+        await entity_cache.load()
+        await dedupe_cache.load()
+        # Held until caught up, live messages must not move them past the gap
+        await checkpoints.load(hold=BACKFILL)
+        for dest_channel in routing.destinations:
+            try:
+                await entity_cache.get(client, dest_channel)
+                logger.info(f"Successfully connected to destination channel: {dest_channel}")
+            except Exception as e:
+                logger.error(f"Failed to access destination channel: {str(e)}")
+                raise
+        
+        await routing.compile(lambda source: entity_cache.get(client, source))
+        # Live messages are forwarded from here on, the catch-up must know them
+        if BACKFILL:
+            backfill.watch(routing.sources)
+        logger.info(f"Entity cache: {entity_cache.stats()}")
         
         # Create temp directory in Render's disk storage
         temp_dir = get_temp_dir()
         os.makedirs(temp_dir, exist_ok=True)
         
-        # Start message queue processor
+        # Start connectivity monitor and message queue processor
+        connectivity.report_success()
+        connectivity.add_listener(wake_queue_processor)
+        connectivity.start(client)
         queue_task = asyncio.create_task(process_message_queue())
+        backfill_task = asyncio.create_task(backfill.run(routing.sources)) if BACKFILL else None
+        started_at = time.monotonic()
         
         # Run until shutdown signal is received
         while is_running:
@@ -480,19 +1600,30 @@ async def main():
         
         # Cleanup
         logger.info("Shutting down...")
+        if backfill_task:
+            backfill_task.cancel()
+        await album_aggregator.flush_all()
+        await edit_debouncer.flush_all()
+        await dispatcher.stop()
+        await bulk_dispatcher.stop()
         queue_task.cancel()
+        await connectivity.stop()
         await client.disconnect()
+        await accounts.stop()
         
     except Exception as e:
         logger.error(f"Error in main function: {str(e)}")
         raise
     finally:
+        started_at = None
+        await loop_lag.stop()
         try:
             # Cleanup temp directory
             temp_dir = get_temp_dir()
             if os.path.exists(temp_dir):
                 import shutil
                 shutil.rmtree(temp_dir)
+                media_cache.clear()
                 logger.info("Cleaned up temp directory")
         except Exception as e:
             logger.error(f"Error cleaning up temp directory: {str(e)}")